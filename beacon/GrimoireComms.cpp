@@ -4,6 +4,7 @@
 
 #include "GrimoireComms.hpp"
 #include "Utils.hpp"
+#include "GrimoireConfig.hpp"
 #include <iostream>
 #include <sstream>
 #include <nlohmann/json.hpp>
@@ -13,9 +14,9 @@
 
 namespace Grimoire::Comms {
 
-    extern const std::string Grimoire_C2_HOST = GRIMOIRE_C2_HOST;
-    extern const std::string Grimoire_C2_PORT = GRIMOIRE_C2_PORT;
-    extern const std::string Grimoire_C2_PROTOCOL = GRIMOIRE_C2_PROTOCOL;
+    using Grimoire::Config::Grimoire_C2_HOST;
+    using Grimoire::Config::Grimoire_C2_PORT;
+    using Grimoire::Config::Grimoire_C2_PROTOCOL;
     // extern const std::string Grimoire_C2_LOGIN;
     // extern const std::string Grimoire_C2_SEND;
     using json = nlohmann::json;
@@ -2,4 +2,13 @@
 // Created by Nebu1ea on 2025/11/27.
 //
 
-#include "GrimoireConfig.hpp"
\ No newline at end of file
+#include "GrimoireConfig.hpp"
+#include "GrimoireC2Config.h"
+
+namespace Grimoire::Config {
+
+    // 在编译时，HOST和PORT 会被替换成 server 脚本传入的字符串字面量
+    const std::string Grimoire_C2_PORT = GRIMOIRE_C2_PORT;
+    const std::string Grimoire_C2_HOST = GRIMOIRE_C2_HOST;
+    const std::string Grimoire_C2_PROTOCOL = GRIMOIRE_C2_PROTOCOL;
+}
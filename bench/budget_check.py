@@ -0,0 +1,382 @@
+"""
+签入和操作员接口的查询数 / 内存分配 / 延迟预算检查，CI 里跑，超出任何一项预算就以非 0 退出：
+    chat.login / chat.heartbeat / chat.task_pickup / chat.upload     Beacon 协议的四种请求
+    operator.beacons / operator.task_create / operator.history       控制台的列表、下发、历史记录
+    job.flush_checkins / job.cleanup_stale                           调度任务，批量写回和标记 Stale
+
+整个 Flask 应用跑在临时目录的 SQLite 上，请求走真实的 HTTP 路径 (a2wsgi + httpx，不起端口)，
+SQL 语句数取自响应头 X-DB-Queries。后台调度器暂停，服务层的 datetime 换成假时钟，
+签入时间和 Stale 判定只随检查脚本里的 advance() 变化，每次跑的结果都一样。
+
+    python -m bench.budget_check
+    python -m bench.budget_check --fleet-sizes 100 1000 5000 --time-scale 2 --output budgets.json
+
+查询数预算是精确的：心跳路径上多一条 SQL 就会失败。延迟预算按开发机定的，慢一些的 CI 机器用 --time-scale 放宽。
+"""
+import os
+import shutil
+import tempfile
+
+# config 在导入时读取环境变量，要先把数据库和数据目录都指到临时目录
+_WORK_DIR = tempfile.mkdtemp(prefix="grimoire-budget-")
+os.environ.update({
+    "GRIMOIRE_DATABASE_URI": f"sqlite:///{os.path.join(_WORK_DIR, 'budget.db')}",
+    "GRIMOIRE_DB_ECHO": "0",
+    "GRIMOIRE_BLOB_STORE_DIR": os.path.join(_WORK_DIR, 'blobs'),
+    "GRIMOIRE_UPLOAD_STAGING_DIR": os.path.join(_WORK_DIR, 'uploads'),
+    "GRIMOIRE_BUILD_ROOT_DIR": os.path.join(_WORK_DIR, 'builds'),
+    "GRIMOIRE_LOG_DIR": os.path.join(_WORK_DIR, 'logs'),
+    "GRIMOIRE_LOG_CONSOLE": "0",
+    "GRIMOIRE_SERVER_KEY_PATH": "",
+    "GRIMOIRE_SESSION_STORE_PATH": "",
+    "GRIMOIRE_QUERY_STATS_HEADERS": "1",
+    "GRIMOIRE_AI_BACKEND": "stub",
+})
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import secrets
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import insert, update
+
+from bench.beacon_client import VirtualBeacon
+from bench.listener_bench import percentile
+from config import Config
+from server import operator_routes
+from server.app import create_app
+from server.core.beacon_service import GrimoireBeaconService
+from server.core import beacon_service as beacon_service_module
+from server.core import task_service as task_service_module
+from server.persistence import database
+from server.persistence.database import get_db_session
+from server.persistence.models import Beacon, Task
+from server.persistence.query_metrics import query_scope
+
+# 每次调用的上限：SQL 语句数、峰值内存分配 (KB)、p95 延迟 (ms)
+# 延迟和内存按默认最大的规模 (1000 个 Beacon、1000 条历史记录) 定，规模更小时只会更宽松
+# 带 per 的项语句数按规模算：每 per 个 Beacon 允许 queries 条 (批量写回按批次拆语句)
+BUDGETS: Dict[str, Dict[str, float]] = {
+    "chat.login":           {"queries": 2, "alloc_kb": 192, "p95_ms": 25},
+    "chat.heartbeat":       {"queries": 0, "alloc_kb": 192, "p95_ms": 10},
+    "chat.task_pickup":     {"queries": 1, "alloc_kb": 192, "p95_ms": 15},
+    "chat.upload":          {"queries": 3, "alloc_kb": 768, "p95_ms": 25},
+    "operator.beacons":     {"queries": 2, "alloc_kb": 6144, "p95_ms": 200},
+    "operator.task_create": {"queries": 3, "alloc_kb": 192, "p95_ms": 25},
+    "operator.history":     {"queries": 1, "alloc_kb": 384, "p95_ms": 25},
+    "job.flush_checkins":   {"queries": 1, "per": GrimoireBeaconService.CHECKIN_FLUSH_BATCH_SIZE,
+                             "alloc_kb": 3072, "p95_ms": 150},
+    "job.cleanup_stale":    {"queries": 1, "alloc_kb": 64, "p95_ms": 40},
+}
+
+
+class FakeClock:
+    """
+    替换服务层模块里的 datetime，utcnow() 返回检查脚本控制的时间。
+    models 里的列默认值在导入时就绑定了真的 utcnow，不受影响 (只影响 first_seen / updated_at 这类记录字段)。
+    """
+    def __init__(self, start: datetime):
+        self.now = start
+
+    def advance(self, seconds: float):
+        self.now += timedelta(seconds=seconds)
+
+    def install(self, *modules):
+        clock = self
+
+        class _FakeDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return clock.now
+
+        for module in modules:
+            module.datetime = _FakeDatetime
+
+
+class CallStats:
+    """
+    一种调用在一个规模下的测量结果。
+    """
+    def __init__(self):
+        self.samples: List[float] = []
+        self.queries = 0
+        self.alloc_bytes = 0
+
+    def summarize(self) -> Dict[str, float]:
+        return {
+            "iterations": len(self.samples),
+            "queries": self.queries,
+            "alloc_kb": self.alloc_bytes / 1024,
+            "p50_ms": percentile(self.samples, 50) * 1000,
+            "p95_ms": percentile(self.samples, 95) * 1000,
+        }
+
+
+class BudgetRunner:
+    """
+    对着一个 Flask 应用跑所有检查项。每项先跑 iterations 次计时 (不开 tracemalloc)，
+    再跑 alloc_iterations 次测内存分配；语句数取所有调用里的最大值。
+    """
+    def __init__(self, flask_app, client: httpx.AsyncClient, clock: FakeClock, args):
+        self.app = flask_app
+        self.client = client
+        self.clock = clock
+        self.args = args
+        self.beacon_service = flask_app.config['BEACON_SERVICE']
+        self.task_service = flask_app.config['TASK_SERVICE']
+        self.last_response: Optional[httpx.Response] = None
+        self.operator_headers: Dict[str, str] = {}
+
+    async def capture_response(self, response: httpx.Response):
+        # httpx 的响应钩子，VirtualBeacon 只返回解密后的内容，语句数要从这里拿
+        self.last_response = response
+
+    def response_queries(self) -> int:
+        return int(self.last_response.headers.get('X-DB-Queries', 0))
+
+    async def measure(self, call: Callable[[], Awaitable[int]],
+                      setup: Optional[Callable[[], Awaitable[None]]] = None) -> CallStats:
+        """
+        call 返回这次调用执行的 SQL 语句数，setup 的耗时和语句不计入。
+        """
+        stats = CallStats()
+
+        async def once() -> float:
+            if setup:
+                await setup()
+            start = time.perf_counter()
+            stats.queries = max(stats.queries, await call())
+            return time.perf_counter() - start
+
+        # 预热，顺带把前面各项留下的状态 (没写回的签入时间之类) 清掉，这一次的语句数不算
+        if setup:
+            await setup()
+        await call()
+        for _ in range(self.args.iterations):
+            stats.samples.append(await once())
+
+        tracemalloc.start()
+        try:
+            for _ in range(self.args.alloc_iterations):
+                if setup:
+                    await setup()
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                stats.queries = max(stats.queries, await call())
+                stats.alloc_bytes = max(stats.alloc_bytes, tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+        return stats
+
+    async def operator_login(self):
+        response = await self.client.post('/api/auth/login', json={"username": self.args.operator_user,
+                                                                   "password": self.args.operator_password})
+        response.raise_for_status()
+        self.operator_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def seed_fleet(self, count: int) -> List[str]:
+        """
+        直接批量插入 count 个 Active 的 Beacon，签入时间是假时钟的当前时间。
+        """
+        now = self.clock.now
+        rows = [{"id": secrets.token_hex(32), "ip_address": "10.0.0.1", "hostname": f"BUDGET-{i}",
+                 "username": f"budget-{i}", "os_info": "Windows 10", "status": "Active",
+                 "first_seen": now, "last_checkin": now, "updated_at": now} for i in range(count)]
+        with get_db_session() as db:
+            for offset in range(0, count, 1000):
+                db.execute(insert(Beacon).values(rows[offset:offset + 1000]))
+        return [row["id"] for row in rows]
+
+    def seed_history(self, beacon_id: str, count: int):
+        start = self.clock.now - timedelta(seconds=count)
+        rows = [{"beacon_id": beacon_id, "command": "shell", "arguments": "whoami", "status": "COMPLETED",
+                 "created_at": start + timedelta(seconds=i), "assigned_at": start + timedelta(seconds=i)}
+                for i in range(count)]
+        with get_db_session() as db:
+            for offset in range(0, count, 1000):
+                db.execute(insert(Task).values(rows[offset:offset + 1000]))
+
+    def queue_task(self, beacon_id: str):
+        with get_db_session() as db:
+            self.task_service.create_task(db, beacon_id, 'shell', 'whoami')
+
+    async def run(self, fleet_size: int) -> Dict[str, CallStats]:
+        results: Dict[str, CallStats] = {}
+        fleet = self.seed_fleet(fleet_size)
+        self.seed_history(fleet[0], self.args.history_size)
+
+        # Beacon 协议
+        async def login():
+            await VirtualBeacon(self.client).login()
+            return self.response_queries()
+
+        results["chat.login"] = await self.measure(login)
+
+        beacon = VirtualBeacon(self.client)
+        await beacon.login()
+
+        async def heartbeat():
+            await beacon.heartbeat()
+            return self.response_queries()
+
+        results["chat.heartbeat"] = await self.measure(heartbeat)
+
+        async def prepare_pickup():
+            self.queue_task(beacon.beacon_id)
+
+        results["chat.task_pickup"] = await self.measure(heartbeat, setup=prepare_pickup)
+
+        pending = {}
+
+        async def prepare_upload():
+            self.queue_task(beacon.beacon_id)
+            pending["task_id"] = (await beacon.heartbeat())["task_id"]
+
+        async def upload():
+            await beacon.upload_result(pending["task_id"], os.urandom(self.args.output_size))
+            return self.response_queries()
+
+        results["chat.upload"] = await self.measure(upload, setup=prepare_upload)
+
+        # 控制台
+        async def list_beacons():
+            response = await self.client.get('/api/operator/beacons', headers=self.operator_headers)
+            response.raise_for_status()
+            return self.response_queries()
+
+        results["operator.beacons"] = await self.measure(list_beacons)
+
+        async def create_task():
+            response = await self.client.post('/api/operator/task/create', headers=self.operator_headers,
+                                              json={"beacon_id": fleet[-1], "command": "shell", "arguments": "id"})
+            response.raise_for_status()
+            return self.response_queries()
+
+        results["operator.task_create"] = await self.measure(create_task)
+
+        async def history():
+            response = await self.client.get(f'/api/operator/task/history/{fleet[0]}', headers=self.operator_headers)
+            response.raise_for_status()
+            return self.response_queries()
+
+        results["operator.history"] = await self.measure(history)
+
+        # 调度任务：假时钟往前走，整个规模的 Beacon 都签入一次 / 都越过 Stale 阈值
+        async def prepare_flush():
+            self.clock.advance(1)
+            for beacon_id in fleet:
+                self.beacon_service.update_checkin_time(None, beacon_id)
+
+        async def flush():
+            with get_db_session() as db, query_scope('job', 'budget.flush_checkins') as stats:
+                self.beacon_service.flush_checkin_times(db)
+            return stats.count
+
+        results["job.flush_checkins"] = await self.measure(flush, setup=prepare_flush)
+
+        async def prepare_stale():
+            with get_db_session() as db:
+                db.execute(update(Beacon).where(Beacon.id.in_(fleet)).values(status='Active', last_checkin=self.clock.now))
+            self.clock.advance(Config.STALE_THRESHOLD_SECONDS + 1)
+
+        async def cleanup():
+            with get_db_session() as db, query_scope('job', 'budget.cleanup_stale') as stats:
+                self.beacon_service.cleanup_stale_beacons(db)
+            return stats.count
+
+        results["job.cleanup_stale"] = await self.measure(cleanup, setup=prepare_stale)
+
+        # 删掉这一轮的数据，下一个规模从空库开始
+        with get_db_session() as db:
+            db.query(Task).filter(Task.beacon_id.in_(fleet)).delete(synchronize_session=False)
+            db.query(Beacon).filter(Beacon.id.in_(fleet)).delete(synchronize_session=False)
+        return results
+
+
+def check(name: str, fleet_size: int, stats: Dict[str, float], time_scale: float) -> List[str]:
+    budget = BUDGETS[name]
+    max_queries = budget["queries"] * (math.ceil(fleet_size / budget["per"]) if "per" in budget else 1)
+    failures = []
+    if stats["queries"] > max_queries:
+        failures.append(f"{stats['queries']} queries > {max_queries}")
+    if stats["alloc_kb"] > budget["alloc_kb"]:
+        failures.append(f"{stats['alloc_kb']:.0f} KB allocated > {budget['alloc_kb']}")
+    if stats["p95_ms"] > budget["p95_ms"] * time_scale:
+        failures.append(f"p95 {stats['p95_ms']:.2f} ms > {budget['p95_ms'] * time_scale:g}")
+    return failures
+
+
+async def run_checks(flask_app, args) -> Dict[int, Dict[str, Dict[str, float]]]:
+    clock = FakeClock(datetime.utcnow().replace(microsecond=0))
+    clock.install(beacon_service_module, task_service_module, operator_routes)
+
+    results = {}
+    transport = httpx.ASGITransport(app=WSGIMiddleware(flask_app))
+    async with httpx.AsyncClient(transport=transport, base_url="http://budget") as client:
+        runner = BudgetRunner(flask_app, client, clock, args)
+        client.event_hooks['response'] = [runner.capture_response]
+        await runner.operator_login()
+        for fleet_size in args.fleet_sizes:
+            stats = await runner.run(fleet_size)
+            results[fleet_size] = {name: s.summarize() for name, s in stats.items()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grimoire query / allocation / latency budget checks")
+    parser.add_argument("--fleet-sizes", type=int, nargs="+", default=[100, 1000], help="数据库里的 Beacon 数量")
+    parser.add_argument("--history-size", type=int, default=1000, help="历史记录查询的那个 Beacon 的任务数")
+    parser.add_argument("--output-size", type=int, default=4096, help="chat.upload 回传的输出大小 (字节)")
+    parser.add_argument("--iterations", type=int, default=50, help="每项计时的次数")
+    parser.add_argument("--alloc-iterations", type=int, default=5, help="每项测内存分配的次数")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="延迟预算的放宽倍数，慢机器上调大")
+    parser.add_argument("--operator-user", default="admin")
+    parser.add_argument("--operator-password", default="password")
+    parser.add_argument("--output", help="把测量结果写成 JSON 文件")
+    args = parser.parse_args()
+
+    try:
+        # 初始化和服务层的 print 丢掉，不然结果表会被刷掉
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            flask_app = create_app()
+            # 调度任务由检查脚本按假时钟手动触发，后台的定时执行会让结果随墙上时间变化
+            flask_app.scheduler.pause()
+            try:
+                results = asyncio.run(run_checks(flask_app, args))
+            finally:
+                flask_app.scheduler.shutdown(wait=False)
+    finally:
+        if database.ConnectEngine is not None:
+            database.ConnectEngine.dispose()
+        shutil.rmtree(_WORK_DIR, ignore_errors=True)
+
+    failed = 0
+    print(f"{'check':<24}{'fleet':>7}{'queries':>9}{'alloc KB':>10}{'p50 ms':>9}{'p95 ms':>9}  result")
+    for fleet_size, checks in results.items():
+        for name, stats in checks.items():
+            failures = check(name, fleet_size, stats, args.time_scale)
+            failed += bool(failures)
+            print(f"{name:<24}{fleet_size:>7}{stats['queries']:>9}{stats['alloc_kb']:>10.0f}"
+                  f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}  {'; '.join(failures) or 'ok'}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"budgets": BUDGETS, "results": {str(k): v for k, v in results.items()}}, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+    if failed:
+        print(f"{failed} check(s) over budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+签入热路径的微基准，给每次优化留一个可以对比的基线：
+    crypto.encrypt / crypto.decrypt          各种负载大小的 grimoire_encrypt / grimoire_decrypt
+    crypto.derive_session_key                一次握手的密钥派生
+    task.heartbeat                           process_and_get_task，不带回传、没有任务
+    task.heartbeat_with_output               process_and_get_task，带一条回传
+    task.record_output                       各种输出大小的 record_output
+    task.history_page                        不同历史记录数量下 get_task_history_page 的第一页和最后一页
+
+数据库是临时目录里的 SQLite，跑完删掉，不会碰到配置里的数据库。
+
+    python -m bench.hotpath_bench --output baseline.json
+    python -m bench.hotpath_bench --output after.json --compare baseline.json
+"""
+import os
+import shutil
+import tempfile
+
+# config 在导入时读取环境变量，要先把数据库和数据目录都指到临时目录
+_WORK_DIR = tempfile.mkdtemp(prefix="grimoire-bench-")
+os.environ.update({
+    "GRIMOIRE_DATABASE_URI": f"sqlite:///{os.path.join(_WORK_DIR, 'bench.db')}",
+    "GRIMOIRE_DB_ECHO": "0",
+    "GRIMOIRE_BLOB_STORE_DIR": os.path.join(_WORK_DIR, 'blobs'),
+    "GRIMOIRE_UPLOAD_STAGING_DIR": os.path.join(_WORK_DIR, 'uploads'),
+    "GRIMOIRE_SERVER_KEY_PATH": "",
+    "GRIMOIRE_SESSION_STORE_PATH": "",
+})
+
+import argparse
+import base64
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import sqlalchemy
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+from sqlalchemy import insert
+
+from bench.listener_bench import percentile
+from server.core.beacon_service import GrimoireBeaconService
+from server.core.task_service import GrimoireTaskService
+from server.persistence import database
+from server.persistence.database import get_db_session
+from server.persistence.models import Task
+from shared.CryptoManager import GrimoireCryptoManager
+
+
+def measure(fn: Callable[[], None], setup: Optional[Callable[[], None]], min_time: float,
+            min_iterations: int, max_iterations: int) -> Dict[str, float]:
+    """
+    反复调用 fn，至少跑 min_time 秒和 min_iterations 次，setup 的耗时不算在内。
+    """
+    if setup:
+        setup()
+    fn()  # 预热
+
+    samples: List[float] = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < max_iterations and (len(samples) < min_iterations or time.perf_counter() < deadline):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    mean = sum(samples) / len(samples)
+    return {
+        "iterations": len(samples),
+        "mean_us": mean * 1e6,
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p95_us": percentile(samples, 95) * 1e6,
+        "min_us": min(samples) * 1e6,
+        "ops_per_sec": 1 / mean if mean else 0.0,
+    }
+
+
+def new_beacon_public_key() -> bytes:
+    return x25519.X25519PrivateKey.generate().public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+
+
+def register_beacon(beacon_service: GrimoireBeaconService, beacon_id: str):
+    with get_db_session() as db:
+        beacon_service.register_new_beacon(db, beacon_id, '127.0.0.1', {'user': 'bench', 'hostname': 'bench'})
+
+
+def assign_new_task(task_service: GrimoireTaskService, beacon_id: str) -> int:
+    """
+    建一个任务并分配给 beacon，返回 task_id，和真实流程一样走内存队列。
+    """
+    with get_db_session() as db:
+        task_service.create_task(db, beacon_id, 'shell', 'whoami')
+    with get_db_session() as db:
+        return int(task_service.get_pending_task(db, beacon_id)['task_id'])
+
+
+def seed_history(beacon_id: str, count: int):
+    """
+    直接批量插入 count 条已完成的任务，不走服务层，只是给历史记录查询准备数据。
+    """
+    start = datetime.utcnow() - timedelta(seconds=count)
+    rows = [{"beacon_id": beacon_id, "command": "shell", "arguments": "whoami", "status": "COMPLETED",
+             "created_at": start + timedelta(seconds=i), "assigned_at": start + timedelta(seconds=i)}
+            for i in range(count)]
+    with get_db_session() as db:
+        for offset in range(0, count, 1000):
+            db.execute(insert(Task).values(rows[offset:offset + 1000]))
+
+
+def bench_crypto(results: Dict, sizes: List[int], run):
+    crypto = GrimoireCryptoManager(key_path=None, store_path=None)
+    results["crypto.derive_session_key"] = run(
+        lambda: crypto.derive_session_key(my_private=crypto.private, beacon_public_key=new_beacon_public_key()))
+
+    beacon_id = crypto.derive_session_key(my_private=crypto.private, beacon_public_key=new_beacon_public_key())
+    for size in sizes:
+        data = os.urandom(size)
+        payload = crypto.grimoire_encrypt(beacon_id, data)
+        results[f"crypto.encrypt[{size}]"] = run(lambda: crypto.grimoire_encrypt(beacon_id, data))
+        results[f"crypto.decrypt[{size}]"] = run(lambda: crypto.grimoire_decrypt(payload))
+
+
+def bench_task_service(results: Dict, sizes: List[int], history_sizes: List[int], run):
+    beacon_service = GrimoireBeaconService()
+    task_service = GrimoireTaskService()
+
+    beacon_id = uuid.uuid4().hex
+    register_beacon(beacon_service, beacon_id)
+
+    heartbeat = json.dumps({"action": "heartbeat"}).encode('utf-8')
+
+    def process(plaintext: bytes):
+        with get_db_session() as db:
+            beacon_service.update_checkin_time(db, beacon_id)
+            task_service.process_and_get_task(db, beacon_id, plaintext)
+
+    results["task.heartbeat"] = run(lambda: process(heartbeat))
+
+    # 每轮在 setup 里先分配一个新任务，计时部分只有带回传的那一次签入
+    state = {}
+
+    def prepare_result():
+        task_id = assign_new_task(task_service, beacon_id)
+        output = base64.b64encode(os.urandom(1024)).decode('utf-8')
+        state["plaintext"] = json.dumps({"task_id": str(task_id), "output": output}).encode('utf-8')
+
+    results["task.heartbeat_with_output"] = run(lambda: process(state["plaintext"]), setup=prepare_result)
+
+    for size in sizes:
+        def prepare_output(size=size):
+            state["task_id"] = assign_new_task(task_service, beacon_id)
+            state["output"] = os.urandom(size)
+
+        def record():
+            with get_db_session() as db:
+                task_service.record_output(db, state["task_id"], state["output"], 'raw')
+
+        results[f"task.record_output[{size}]"] = run(record, setup=prepare_output)
+
+    for count in history_sizes:
+        history_beacon = uuid.uuid4().hex
+        register_beacon(beacon_service, history_beacon)
+        seed_history(history_beacon, count)
+
+        def first_page():
+            with get_db_session() as db:
+                task_service.get_task_history_page(db, history_beacon)
+
+        # 翻到最后一页的游标，测深翻页是不是还能走索引
+        with get_db_session() as db:
+            last = (db.query(Task.assigned_at, Task.task_id).filter(Task.beacon_id == history_beacon)
+                    .order_by(Task.assigned_at.asc(), Task.task_id.asc()).offset(min(50, count - 1)).first())
+        last_cursor = f"{last.assigned_at.isoformat()}~{last.task_id}"
+
+        def last_page():
+            with get_db_session() as db:
+                task_service.get_task_history_page(db, history_beacon, cursor=last_cursor)
+
+        results[f"task.history_page[{count}]"] = run(first_page)
+        results[f"task.history_page_last[{count}]"] = run(last_page)
+
+
+def environment() -> Dict[str, str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+    }
+
+
+def print_table(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]):
+    print(f"{'benchmark':<34}{'iters':>8}{'mean us':>12}{'p50 us':>12}{'p95 us':>12}{'ops/s':>12}"
+          + (f"{'vs base':>10}" if baseline else ""))
+    for name, stats in results.items():
+        line = (f"{name:<34}{stats['iterations']:>8}{stats['mean_us']:>12.1f}{stats['p50_us']:>12.1f}"
+                f"{stats['p95_us']:>12.1f}{stats['ops_per_sec']:>12.1f}")
+        if baseline and name in baseline:
+            # 按中位数比，>1 表示比基线慢
+            line += f"{stats['p50_us'] / baseline[name]['p50_us']:>9.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grimoire check-in hot path micro-benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 4096, 65536, 1048576],
+                        help="加解密和 record_output 的负载大小 (字节)")
+    parser.add_argument("--history-sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="历史记录查询时该 Beacon 的任务数量")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每项至少跑多少秒")
+    parser.add_argument("--min-iterations", type=int, default=10)
+    parser.add_argument("--max-iterations", type=int, default=100000)
+    parser.add_argument("--only", help="只跑名字以这个前缀开头的组，例如 crypto 或 task")
+    parser.add_argument("--output", help="把结果写成 JSON 文件")
+    parser.add_argument("--compare", help="和之前 --output 写出的 JSON 对比")
+    args = parser.parse_args()
+
+    def run(fn, setup=None):
+        return measure(fn, setup, args.min_time, args.min_iterations, args.max_iterations)
+
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        # 服务层每次分配任务都会 print，跑的时候丢掉，不然结果表会被刷掉
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            database.init_db()
+            if not args.only or "crypto".startswith(args.only):
+                bench_crypto(results, args.sizes, run)
+            if not args.only or "task".startswith(args.only):
+                bench_task_service(results, args.sizes, args.history_sizes, run)
+    finally:
+        if database.ConnectEngine is not None:
+            database.ConnectEngine.dispose()
+        shutil.rmtree(_WORK_DIR, ignore_errors=True)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
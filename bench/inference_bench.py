@@ -0,0 +1,106 @@
+"""
+AI 推理吞吐基准：用选定的推理后端反复跑 route_intent 和 chat_stream_generator，
+统计每次推理的延迟、生成 token 数和 token/s，方便在不同机器、不同后端之间对比。
+路由请求走微批队列，--concurrency 大于 1 时可以看到批量生成带来的吞吐变化。
+
+    python -m bench.inference_bench --backend cpu --threads 8 --iterations 20
+    python -m bench.inference_bench --backend cuda --concurrency 8 --output cuda.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from bench.listener_bench import percentile
+from config import Config
+from server.core.ai_service import GrimoireAIService
+from server.core.inference_backend import GrimoireCPUBackend, create_inference_backend
+
+ROUTE_QUERIES = [
+    "给所有 Windows 主机执行 whoami",
+    "列出 LAB-01 桌面上的文件",
+    "今天天气怎么样",
+    "截一张 10.0.0.5 那台机器的屏幕",
+]
+CHAT_MESSAGES = [{"role": "user", "content": "解释一下为什么 Beacon 的心跳要加抖动"}]
+
+
+def run(fn: Callable[[], int], iterations: int, concurrency: int = 1) -> Dict[str, float]:
+    """
+    fn 执行一次推理并返回生成的 token 数。concurrency > 1 时多个线程同时调用，路由请求会被合成批。
+    """
+    fn()  # 预热，第一次会编译 kernel / 分配 KV cache
+    latencies: List[float] = []
+
+    def timed(_) -> int:
+        start = time.perf_counter()
+        tokens = fn()
+        latencies.append(time.perf_counter() - start)
+        return tokens
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        tokens = sum(pool.map(timed, range(iterations)))
+    total = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "tokens": tokens,
+        "tokens_per_sec": tokens / total if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grimoire AI inference throughput benchmark")
+    parser.add_argument("--backend", choices=["auto", "cuda", "cpu", "stub"], default="auto")
+    parser.add_argument("--threads", type=int, help="CPU 推理线程数，默认 GRIMOIRE_AI_CPU_THREADS")
+    parser.add_argument("--model", help="CPU 后端用的模型目录，默认 GRIMOIRE_CPU_MODEL_PATH")
+    parser.add_argument("--no-quantize", action="store_true", help="CPU 后端不做 int8 动态量化")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1, help="同时发起路由请求的线程数，用来看批量生成的吞吐")
+    parser.add_argument("--output", help="把结果写成 JSON 文件")
+    args = parser.parse_args()
+
+    load_started = time.perf_counter()
+    if args.backend == "cpu":
+        backend = GrimoireCPUBackend(model_path=args.model, threads=args.threads or Config.AI_CPU_THREADS,
+                                     quantize=Config.AI_CPU_QUANTIZE and not args.no_quantize)
+    else:
+        backend = create_inference_backend(args.backend)
+    load_seconds = time.perf_counter() - load_started
+    service = GrimoireAIService(backend)
+
+    queries = itertools.cycle(ROUTE_QUERIES)
+
+    def route() -> int:
+        return backend.count_tokens(service.route_intent(next(queries)))
+
+    def chat() -> int:
+        chunks = [chunk for chunk in service.chat_stream_generator(list(CHAT_MESSAGES))]
+        text = "".join(json.loads(chunk[6:])["content"] for chunk in chunks[:-1])
+        return backend.count_tokens(text)
+
+    results = {"route": run(route, args.iterations, args.concurrency), "chat": run(chat, args.iterations)}
+
+    print(f"backend {backend.name}, model loaded in {load_seconds:.1f}s")
+    print(f"{'kind':<8}{'iters':>8}{'p50 ms':>12}{'p95 ms':>12}{'tokens':>10}{'tok/s':>10}")
+    for kind, stats in results.items():
+        print(f"{kind:<8}{stats['iterations']:>8}{stats['p50_ms']:>12.1f}{stats['p95_ms']:>12.1f}"
+              f"{stats['tokens']:>10}{stats['tokens_per_sec']:>10.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"environment": {"backend": backend.name, "python": platform.python_version(),
+                                       "platform": platform.platform(), "load_seconds": load_seconds},
+                       "results": results}, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+对比 Flask 线程模式和 ASGI 监听器的 /api/chat/login 与 /api/chat/send 吞吐量和延迟。
+
+先分别启动两个服务 (同一个数据库)：
+    python -m server.app                                   # Flask，默认 8080
+    GRIMOIRE_ASYNC_PORT=8081 python -m server.async_listener
+
+然后：
+    python -m bench.listener_bench --target flask=http://127.0.0.1:8080 --target asgi=http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench.beacon_client import VirtualBeacon
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "rps": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+async def run_target(base_url: str, beacons: int, heartbeats: int, concurrency: int) -> Dict[str, Dict[str, float]]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        fleet = [VirtualBeacon(client) for _ in range(beacons)]
+
+        async def timed(coro_factory, samples: List[float], failures: List[int]):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await coro_factory()
+                    samples.append(time.perf_counter() - start)
+                except Exception:
+                    failures.append(1)
+
+        # 握手阶段
+        login_samples, login_errors = [], []
+        start = time.perf_counter()
+        await asyncio.gather(*(timed(b.login, login_samples, login_errors) for b in fleet))
+        login_elapsed = time.perf_counter() - start
+
+        # 心跳阶段，只用握手成功的 Beacon
+        alive = [b for b in fleet if b.aesgcm is not None]
+        send_samples, send_errors = [], []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            timed(b.heartbeat, send_samples, send_errors)
+            for _ in range(heartbeats) for b in alive
+        ))
+        send_elapsed = time.perf_counter() - start
+
+    return {
+        "login": summarize(login_samples, len(login_errors), login_elapsed),
+        "send": summarize(send_samples, len(send_errors), send_elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grimoire beacon listener benchmark")
+    parser.add_argument("--target", action="append", required=True,
+                        help="name=url，可以重复，例如 flask=http://127.0.0.1:8080")
+    parser.add_argument("--beacons", type=int, default=200, help="虚拟 Beacon 数量")
+    parser.add_argument("--heartbeats", type=int, default=20, help="每个 Beacon 的心跳次数")
+    parser.add_argument("--concurrency", type=int, default=100, help="同时在途的请求数")
+    args = parser.parse_args()
+
+    results = {}
+    for target in args.target:
+        name, url = target.split("=", 1)
+        results[name] = asyncio.run(run_target(url, args.beacons, args.heartbeats, args.concurrency))
+
+    print(f"{'target':<10}{'endpoint':<8}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, endpoints in results.items():
+        for endpoint, stats in endpoints.items():
+            print(f"{name:<10}{endpoint:<8}{stats['requests']:>10}{stats['errors']:>8}"
+                  f"{stats['rps']:>10.1f}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
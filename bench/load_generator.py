@@ -0,0 +1,249 @@
+"""
+虚拟 Beacon 压测：模拟 N 个并发 Beacon 按真实协议跟服务端通信
+(/api/chat/login 握手、加密心跳、任务回传，大输出走分块回传)，
+同时用操作员账号按设定的任务比例批量下发任务，最后按接口统计吞吐量、p50/p95/p99 延迟和错误率。
+
+对着已经在跑的服务端：
+    python -m bench.load_generator --url http://127.0.0.1:8080 --beacons 500 --duration 60
+
+完全本地跑 (临时目录里的 SQLite 数据库，跑完自动关掉)：
+    python -m bench.load_generator --spawn asgi --beacons 200 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+
+from bench.beacon_client import VirtualBeacon
+from bench.listener_bench import percentile
+
+
+class EndpointStats:
+    """
+    一个接口的延迟样本和错误数。
+    """
+    def __init__(self):
+        self.samples: List[float] = []
+        self.errors = 0
+
+    def summarize(self, elapsed: float) -> Dict[str, float]:
+        total = len(self.samples) + self.errors
+        return {
+            "requests": len(self.samples),
+            "errors": self.errors,
+            "error_rate": self.errors / total if total else 0.0,
+            "rps": len(self.samples) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(self.samples, 50) * 1000,
+            "p95_ms": percentile(self.samples, 95) * 1000,
+            "p99_ms": percentile(self.samples, 99) * 1000,
+        }
+
+
+class LoadReport:
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointStats] = {}
+
+    async def timed(self, endpoint: str, coro):
+        """
+        记一次请求的耗时，失败只计数不抛出，返回 None。
+        """
+        stats = self.endpoints.setdefault(endpoint, EndpointStats())
+        start = time.perf_counter()
+        try:
+            result = await coro
+        except Exception:
+            stats.errors += 1
+            return None
+        stats.samples.append(time.perf_counter() - start)
+        return result
+
+
+def parse_weights(spec: str) -> Tuple[List[str], List[float]]:
+    """
+    "shell=6,ls=3,screenshot=1" -> (["shell", "ls", "screenshot"], [6.0, 3.0, 1.0])
+    """
+    names, weights = [], []
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        names.append(name.strip())
+        weights.append(float(weight) if weight else 1.0)
+    return names, weights
+
+
+def sleep_interval(interval: float, jitter: float) -> float:
+    # 和 beacon 的抖动一样：在 interval 上下浮动 jitter 比例
+    return max(0.0, interval * (1 + random.uniform(-jitter, jitter)))
+
+
+async def run_beacon(client: httpx.AsyncClient, report: LoadReport, user: str, deadline: float, args):
+    beacon = VirtualBeacon(client, user=user)
+
+    # 握手时间错开，别让所有 Beacon 同一瞬间一起上线
+    await asyncio.sleep(random.uniform(0, args.ramp_up))
+    if await report.timed("login", beacon.login()) is None:
+        return
+
+    while time.monotonic() < deadline:
+        response = await report.timed("heartbeat", beacon.heartbeat(wait=args.wait))
+
+        # 拿到任务就立即回传，回传的响应里可能又是下一个任务
+        while response and "task_id" in response and time.monotonic() < deadline:
+            size = random.choice(args.output_sizes)
+            output = os.urandom(size)
+            if size > args.chunk_size:
+                response = await report.timed("upload_chunked",
+                                              beacon.upload_result_chunked(response["task_id"], output, args.chunk_size))
+            else:
+                response = await report.timed("upload", beacon.upload_result(response["task_id"], output))
+
+        await asyncio.sleep(sleep_interval(args.interval, args.jitter))
+
+
+async def run_operator(client: httpx.AsyncClient, report: LoadReport, user_pattern: str, deadline: float, args):
+    """
+    按 task_rate 每秒下发一批任务给这次压测的所有 Beacon，命令按 task_mix 的权重随机选。
+    """
+    response = await client.post('/api/auth/login', json={"username": args.operator_user,
+                                                          "password": args.operator_password})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    commands, weights = parse_weights(args.task_mix)
+
+    async def create_batch(command: str):
+        response = await client.post('/api/operator/task/bulk', headers=headers, json={
+            "command": command, "arguments": "", "filter": {"user": user_pattern}
+        })
+        response.raise_for_status()
+
+    # 等 Beacon 基本都上线了再开始下发
+    await asyncio.sleep(args.ramp_up)
+    while time.monotonic() < deadline:
+        await report.timed("operator_bulk", create_batch(random.choices(commands, weights)[0]))
+        await asyncio.sleep(1 / args.task_rate)
+
+
+async def run_load(base_url: str, args) -> Dict[str, Dict[str, float]]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    run_id = secrets.token_hex(3)
+    report = LoadReport()
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.monotonic()
+        deadline = start + args.ramp_up + args.duration
+        jobs = [run_beacon(client, report, f"vbeacon-{run_id}-{i}", deadline, args) for i in range(args.beacons)]
+        if args.task_rate > 0:
+            jobs.append(run_operator(client, report, f"vbeacon-{run_id}-*", deadline, args))
+        await asyncio.gather(*jobs)
+        elapsed = time.monotonic() - start
+
+    return {endpoint: stats.summarize(elapsed) for endpoint, stats in report.endpoints.items()}
+
+
+def wait_for_port(host: str, port: int, timeout: float, process: subprocess.Popen):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited early with code {process.returncode}")
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not start listening on {host}:{port} within {timeout}s")
+
+
+def spawn_server(kind: str, port: int, data_dir: str) -> subprocess.Popen:
+    """
+    在子进程里起一个服务端，数据库和所有数据目录都放在 data_dir 里。
+    """
+    env = os.environ.copy()
+    env.update({
+        "GRIMOIRE_DATABASE_URI": f"sqlite:///{os.path.join(data_dir, 'grimoire.db')}",
+        "GRIMOIRE_DB_ECHO": "0",
+        "GRIMOIRE_HOST": "127.0.0.1",
+        "GRIMOIRE_PORT": str(port),
+        "GRIMOIRE_ASYNC_PORT": str(port),
+        "GRIMOIRE_BLOB_STORE_DIR": os.path.join(data_dir, 'blobs'),
+        "GRIMOIRE_UPLOAD_STAGING_DIR": os.path.join(data_dir, 'uploads'),
+        "GRIMOIRE_BUILD_ROOT_DIR": os.path.join(data_dir, 'builds'),
+        "GRIMOIRE_SERVER_KEY_PATH": "",
+        "GRIMOIRE_SESSION_STORE_PATH": "",
+        "GRIMOIRE_AI_BACKEND": "stub",
+    })
+    module = "server.async_listener" if kind == "asgi" else "server.app"
+    process = subprocess.Popen([sys.executable, "-m", module], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port("127.0.0.1", port, 120, process)
+    except Exception:
+        process.kill()
+        raise
+    return process
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grimoire virtual beacon load generator")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="已经在跑的服务端地址，例如 http://127.0.0.1:8080")
+    target.add_argument("--spawn", choices=["flask", "asgi"], help="在本地起一个用临时 SQLite 数据库的服务端")
+    parser.add_argument("--beacons", type=int, default=100, help="虚拟 Beacon 数量")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长 (秒，不含 ramp-up)")
+    parser.add_argument("--ramp-up", type=float, default=5, help="Beacon 在这段时间里随机错开上线 (秒)")
+    parser.add_argument("--interval", type=float, default=1, help="心跳间隔 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="心跳间隔的抖动比例 (0-1)")
+    parser.add_argument("--wait", type=float, default=0, help="长轮询等待秒数，0 为普通心跳 (只有 asgi 支持)")
+    parser.add_argument("--task-rate", type=float, default=1, help="操作员每秒下发几批任务，0 为不下发")
+    parser.add_argument("--task-mix", default="shell=6,ls=3,screenshot=1", help="命令=权重，逗号分隔")
+    parser.add_argument("--output-sizes", default="256,4096,65536",
+                        help="回传输出大小 (字节)，逗号分隔，每次随机选一个")
+    parser.add_argument("--chunk-size", type=int, default=1024 * 1024, help="输出超过这个大小就分块回传")
+    parser.add_argument("--concurrency", type=int, default=200, help="最多同时打开的连接数")
+    parser.add_argument("--operator-user", default="admin")
+    parser.add_argument("--operator-password", default="password")
+    parser.add_argument("--json", action="store_true", help="只输出 JSON 结果")
+    args = parser.parse_args()
+    args.output_sizes = [int(size) for size in args.output_sizes.split(',')]
+
+    process = None
+    with tempfile.TemporaryDirectory(prefix="grimoire-load-") as data_dir:
+        if args.spawn:
+            port = free_port()
+            process = spawn_server(args.spawn, port, data_dir)
+            base_url = f"http://127.0.0.1:{port}"
+        else:
+            base_url = args.url
+
+        try:
+            results = asyncio.run(run_load(base_url, args))
+        finally:
+            if process:
+                process.terminate()
+                process.wait(timeout=30)
+
+    if not args.json:
+        print(f"{'endpoint':<16}{'requests':>10}{'errors':>8}{'err %':>8}{'rps':>10}"
+              f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for endpoint, stats in results.items():
+            print(f"{endpoint:<16}{stats['requests']:>10}{stats['errors']:>8}{stats['error_rate'] * 100:>8.2f}"
+                  f"{stats['rps']:>10.1f}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import { defineStore } from 'pinia';
 import apiClient from '@/utils/http';
+import { waitForTask } from '@/utils/events';
 
 interface LogEntry {
     type: 'input' | 'output' | 'error' | 'system' | 'easter-egg';
@@ -143,22 +144,19 @@ export const useTerminalStore = defineStore('terminal', {
                     isHtml: false
                 });
 
-                // 开始轮询结果
+                // 等待结果，最多约 1 分钟
                 let output = null;
-                let attempts = 0;
-                const maxAttempts = 30; // 最多轮询 30 次 (约 1 分钟)
-
-                while (!output && attempts < maxAttempts) {
-                    attempts++;
+                const deadline = Date.now() + 60000;
 
+                while (!output && Date.now() < deadline) {
                     const outputRes = await apiClient.get(`/operator/task/output/${taskId}`);
 
                     // 假设后端在没结果时返回空字符串或特定的状态码
                     if (outputRes.data && outputRes.data.output_content) {
                         output = outputRes.data.output_content;
                     } else {
-                        // 每 2 秒查一次
-                        await this.sleep(2000);
+                        // 等事件流推送任务完成，10 秒没等到再查一次兜底；事件流连不上就每 2 秒查一次
+                        await waitForTask(taskId, 10000);
                     }
                 }
 
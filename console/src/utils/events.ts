@@ -0,0 +1,63 @@
+// src/utils/events.ts
+// 订阅后端的操作员事件流 (SSE)，整个控制台共用一条连接
+
+const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || '/api';
+
+type EventHandler = (data: any) => void;
+
+let source: EventSource | null = null;
+const handlers: Record<string, Set<EventHandler>> = {};
+
+function ensureConnected(): EventSource | null {
+    if (source && source.readyState !== EventSource.CLOSED) return source;
+
+    const token = localStorage.getItem('auth_token');
+    if (!token || typeof EventSource === 'undefined') return null;
+
+    // EventSource 不能带 Authorization 头，token 放在查询参数里
+    source = new EventSource(`${API_BASE_URL}/operator/events?jwt=${encodeURIComponent(token)}`);
+    for (const type of Object.keys(handlers)) {
+        source.addEventListener(type, dispatch(type));
+    }
+    return source;
+}
+
+function dispatch(type: string) {
+    return (e: MessageEvent) => {
+        const data = JSON.parse(e.data || '{}');
+        handlers[type]?.forEach(handler => handler(data));
+    };
+}
+
+// 订阅一种事件，返回取消订阅的函数
+export function onEvent(type: string, handler: EventHandler): () => void {
+    if (!handlers[type]) {
+        handlers[type] = new Set();
+        source?.addEventListener(type, dispatch(type));
+    }
+    handlers[type].add(handler);
+    ensureConnected();
+    return () => handlers[type].delete(handler);
+}
+
+// 等待某个任务完成，收到完成事件返回 true，超时返回 false
+// 事件流连不上时等 fallbackMs 后返回 false，调用方照旧轮询
+export function waitForTask(taskId: number, timeoutMs: number, fallbackMs = 2000): Promise<boolean> {
+    return new Promise(resolve => {
+        if (!ensureConnected()) {
+            setTimeout(() => resolve(false), fallbackMs);
+            return;
+        }
+        const off = onEvent('task.completed', (data) => {
+            if (data.task_id === taskId) {
+                off();
+                clearTimeout(timer);
+                resolve(true);
+            }
+        });
+        const timer = setTimeout(() => {
+            off();
+            resolve(false);
+        }, timeoutMs);
+    });
+}
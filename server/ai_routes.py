@@ -1,28 +1,49 @@
+from functools import wraps
+
 from flask import Blueprint, request, Response, current_app, jsonify
 from flask_jwt_extended import jwt_required
 
 ai_bp = Blueprint('ai', __name__, url_prefix='/api/ai')
 
 
+def ai_service_required(view):
+    # 模型没加载起来 (或者 debug 模式的重载父进程) 时没有 AI_SERVICE，直接 503
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_app.config.get('AI_SERVICE') is None:
+            return jsonify({"error": "AI service unavailable"}), 503
+        return view(*args, **kwargs)
+    return wrapper
+
+
 @ai_bp.route('/route', methods=['POST'])
 @jwt_required()
+@ai_service_required
 def ai_route():
     ai_service = current_app.config['AI_SERVICE']
-    data = request.json
-    print(data)
+    data = request.get_json(silent=True) or {}
 
+    # 一批里有一条坏的整批都会失败，入队前先挡掉
     query = data.get('query')
-    result = ai_service.route_intent(query)
+    if not isinstance(query, str) or not query.strip():
+        return jsonify({"error": "query must be a non-empty string"}), 400
+    try:
+        result = ai_service.route_intent(query)
+    except OverflowError as e:
+        # 路由队列满了，让前端过一会儿再试，不在这里堆线程
+        return jsonify({"error": str(e)}), 429
+    except TimeoutError:
+        return jsonify({"error": "Router timed out"}), 504
     return jsonify({"result": result})
 
 
 @ai_bp.route('/chat', methods=['POST'])
 @jwt_required()
+@ai_service_required
 def ai_chat():
     ai_service = current_app.config['AI_SERVICE']
     data = request.json
     messages = data.get('messages')
-    print(messages)
     # 返回 Flask 的流式响应
     return Response(
         ai_service.chat_stream_generator(messages),
@@ -1,15 +1,19 @@
 # Beacon回连的地方
 import base64
 import json
+import logging
 import os
 
 from flask import Blueprint, request, jsonify, current_app
 
+from server.core.metrics import CHECKINS, DECRYPT_FAILURES, HANDSHAKES
 from server.persistence.database import get_db_session
 
 # 创建蓝图，URL 前缀为 /api/chat
 api_bp = Blueprint('chat_api', __name__, url_prefix='/api/chat')
 
+log = logging.getLogger(__name__)
+
 
 def get_services():
     """从应用配置中获取所有共享的服务实例"""
@@ -84,6 +88,8 @@ def initial_handshake():
 
         server_public_key_b64 = base64.b64encode(crypto_mgr.get_publickey()).decode('utf-8')
 
+        HANDSHAKES.inc(labels=('ok',))
+
         # 返回确认信息（无需返回 ID，因为它不通过网络传输）
         return jsonify({
             'welcome': server_public_key_b64,
@@ -92,7 +98,8 @@ def initial_handshake():
         }), 200
 
     except Exception as e:
-        print(f"Handshake failed for {beacon_ip}: {e}")
+        HANDSHAKES.inc(labels=('error',))
+        log.exception("Handshake failed for %s: %s", beacon_ip, e, extra={"ip_address": beacon_ip})
         return jsonify({'error': 'Internal server error'}), 503
 
 
@@ -139,17 +146,26 @@ def secure_communication():
     crypto_mgr = services['crypto_mgr']
     task_service = services['task_service']
 
-    # 解密输入
-    payload = request.get_json().get('auth', '')
+    # 解密输入，请求体不是 JSON 对象直接 400
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Malformed request body'}), 400
+    payload = data.get('auth', '')
     if not payload:
         return jsonify({'error': 'Missing Authentication'}), 400    # 没发payload过来
     try:
         plaintext_bytes, beacon_id = crypto_mgr.grimoire_decrypt(payload)
 
     except Exception as e:
+        DECRYPT_FAILURES.inc()
         return jsonify({'error': 'Decryption/Authentication failed'}), 401
 
+    CHECKINS.inc()
+
     with get_db_session() as db:
+        # 记录签入时间，只写内存，由调度器批量写回数据库
+        services['beacon_service'].update_checkin_time(db=db, beacon_id=beacon_id)
+
         # TaskService 处理一切，并返回格式化好地响应字典
         response_data = task_service.process_and_get_task(
             db=db,
@@ -165,5 +181,5 @@ def secure_communication():
         response.headers['X-Data-Ref'] = encrypted_response
         return response,200
     except Exception as e:
-        print(f"Encryption failed for {beacon_id}: {e}")
+        log.exception("Encryption failed for %s: %s", beacon_id[:8], e, extra={"beacon_id": beacon_id})
         return jsonify({'error': 'Internal encryption error'}), 500
\ No newline at end of file
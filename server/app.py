@@ -1,3 +1,4 @@
+import logging
 import os
 
 from flask import Flask
@@ -7,7 +8,12 @@ from config import Config
 from server.api_routes import api_bp
 from server.auth_routes import auth_bp
 from server.core.beacon_service import GrimoireBeaconService
+from server.core.build_queue import GrimoireBuildQueue
+from server.core.build_service import GrimoireBuildService
+from server.core.event_bus import GrimoireEventBus
+from server.core.structured_log import init_logging
 from server.core.task_service import GrimoireTaskService
+from server.metrics_routes import init_metrics, metrics_bp
 from server.operator_routes import operator_bp
 # 导入核心管理器和数据库管理
 from server.persistence import database
@@ -16,11 +22,17 @@ from shared.CryptoManager import GrimoireCryptoManager
 from server.core.ai_service import GrimoireAIService
 from server.ai_routes import ai_bp
 
+log = logging.getLogger(__name__)
+
+
 def create_app():
     # 实例化 Flask 应用
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    # 日志先于数据库初始化，SQL 回显和调度器日志都走后台队列
+    init_logging()
+
     # 初始化数据库连接和模型
     try:
         database.init_db()
@@ -31,13 +43,25 @@ def create_app():
         exit(1)
 
     if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
-        app.config['AI_SERVICE'] = GrimoireAIService()
+        # 模型加载失败不影响 C2 本身，AI 接口返回 503
+        try:
+            app.config['AI_SERVICE'] = GrimoireAIService()
+        except Exception as e:
+            log.exception("AI service initialization failed, AI routes disabled: %s", e)
 
 
     app.config["JWT_SECRET_KEY"] = Config.JWT_SECRET_KEY
     app.config['CRYPTO_MANAGER'] = GrimoireCryptoManager()
-    app.config['BEACON_SERVICE'] = GrimoireBeaconService()
-    app.config['TASK_SERVICE'] = GrimoireTaskService()
+    # 服务层共用一条事件总线，操作员的事件流从这里订阅
+    app.config['EVENT_BUS'] = GrimoireEventBus()
+    app.config['BEACON_SERVICE'] = GrimoireBeaconService(event_bus=app.config['EVENT_BUS'])
+    app.config['TASK_SERVICE'] = GrimoireTaskService(event_bus=app.config['EVENT_BUS'])
+    # Payload 构建在后台线程池里排队执行
+    app.config['BUILD_QUEUE'] = GrimoireBuildQueue(GrimoireBuildService())
+
+    # 从数据库的 PENDING 记录重建内存任务队列
+    with database.get_db_session() as db:
+        app.config['TASK_SERVICE'].restore_pending_queue(db)
 
 
     jwt = JWTManager(app)
@@ -51,6 +75,10 @@ def create_app():
     app.register_blueprint(operator_bp)
     app.register_blueprint(auth_bp)
     app.register_blueprint(ai_bp)
+    app.register_blueprint(metrics_bp)
+
+    # 按路由统计请求数和延迟，Prometheus 从 /metrics 抓取
+    init_metrics(app)
 
     start_scheduler(app)
 
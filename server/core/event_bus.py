@@ -0,0 +1,104 @@
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import Config
+
+
+class GrimoireEvent(NamedTuple):
+    id: int
+    type: str               # 形如 task.completed / beacon.registered，点号前面是主题
+    data: Dict[str, Any]
+    timestamp: float
+
+
+class GrimoireEventSubscription:
+    """
+    一个订阅者的事件缓冲区，长度有上限。
+    订阅者消费太慢时丢掉最旧的事件并计数，服务端内存不会跟着慢客户端一直涨。
+    """
+    def __init__(self, bus: "GrimoireEventBus", topics: Optional[Set[str]], max_buffer: int):
+        self._bus = bus
+        self.topics = topics
+        self._events: Deque[GrimoireEvent] = deque(maxlen=max_buffer)
+        self._cond = threading.Condition()
+        self._dropped = 0
+        self.closed = False
+
+    def wants(self, event_type: str) -> bool:
+        return self.topics is None or event_type.split('.', 1)[0] in self.topics
+
+    def deliver(self, grimoire_event: GrimoireEvent):
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self._dropped += 1
+            self._events.append(grimoire_event)
+            self._cond.notify()
+
+    def get(self, timeout: float) -> Tuple[List[GrimoireEvent], int]:
+        """
+        取出缓冲区里的所有事件，没有事件时最多等 timeout 秒。
+        返回 (事件列表, 上次取完之后因为缓冲区满丢掉的事件数)。
+        """
+        with self._cond:
+            if not self._events and not self.closed:
+                self._cond.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            dropped, self._dropped = self._dropped, 0
+        return events, dropped
+
+    def close(self):
+        self._bus.unsubscribe(self)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class GrimoireEventBus:
+    """
+    进程内的发布/订阅总线，服务层发布事件，操作员的事件流 (SSE) 订阅。
+    只在当前进程内有效，多进程部署时每个进程各自一份。
+    """
+    def __init__(self, max_buffer: int = Config.EVENT_SUBSCRIBER_BUFFER):
+        self.max_buffer = max_buffer
+        self._subscribers: Set[GrimoireEventSubscription] = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+
+    def subscribe(self, topics: Iterable[str] = None) -> GrimoireEventSubscription:
+        subscription = GrimoireEventSubscription(self, set(topics) if topics else None, self.max_buffer)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: GrimoireEventSubscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event_type: str, data: Dict[str, Any]):
+        """
+        立即发布一个事件，不会阻塞发布者。
+        """
+        grimoire_event = GrimoireEvent(id=next(self._ids), type=event_type, data=data, timestamp=time.time())
+        with self._lock:
+            subscribers = [s for s in self._subscribers if s.wants(event_type)]
+            self.published += 1
+        for subscription in subscribers:
+            subscription.deliver(grimoire_event)
+
+    def publish_after_commit(self, db: Session, event_type: str, data: Dict[str, Any]):
+        """
+        事务提交之后再发布，回滚了就不发，订阅者看到的一定是已经落库的状态。
+        """
+        event.listen(db, 'after_commit', lambda session: self.publish(event_type, data), once=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "published": self.published}
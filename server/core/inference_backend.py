@@ -0,0 +1,284 @@
+"""
+AI 推理后端。GrimoireAIService 只管提示词和指标，模型加载、设备和生成都在这里：
+    GrimoireUnslothBackend        CUDA 上用 unsloth 加载 4-bit 模型 (原来的做法)
+    GrimoireCPUBackend            transformers + peft 跑在 CPU 上，可选 int8 动态量化，线程数可配
+    GrimoireStubBackend           不加载模型，固定回复，给压测和没有模型文件的环境用
+
+torch / transformers / unsloth 都是在后端初始化时才导入，选 stub 的机器不需要装这些。
+"""
+import importlib.util
+import logging
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+
+log = logging.getLogger(__name__)
+
+Messages = List[Dict[str, str]]
+
+
+class GrimoireInferenceBackend:
+    """
+    推理后端接口。adapter 是适配器名 (router / character)，没有加载对应适配器的后端直接用基础模型。
+    """
+    name = "base"
+
+    def generate(self, adapter: str, messages: Messages, max_new_tokens: int, temperature: float,
+                 top_p: Optional[float] = None) -> Tuple[str, int]:
+        """
+        一次生成完，返回 (生成的文本, 生成的 token 数)。
+        """
+        raise NotImplementedError
+
+    def generate_batch(self, adapter: str, batch: List[Messages], max_new_tokens: int, temperature: float,
+                       top_p: Optional[float] = None) -> List[Tuple[str, int]]:
+        """
+        一批对话一起生成，按顺序返回每条的 (文本, token 数)。默认逐条调用 generate。
+        """
+        return [self.generate(adapter, messages, max_new_tokens, temperature, top_p) for messages in batch]
+
+    def stream(self, adapter: str, messages: Messages, max_new_tokens: int, temperature: float,
+               top_p: Optional[float] = None) -> Iterator[str]:
+        """
+        流式生成，逐段返回新生成的文本。
+        """
+        raise NotImplementedError
+
+    def count_tokens(self, text: str) -> int:
+        raise NotImplementedError
+
+
+class _TorchBackend(GrimoireInferenceBackend):
+    """
+    unsloth 和 CPU 后端共用的 transformers 生成逻辑，子类只负责加载模型和分词器。
+    同一个模型上切换适配器不是线程安全的，切换加生成整个过程都持有锁。
+    """
+    def __init__(self, device: str):
+        self.device = device
+        self.adapters: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.model, self.tokenizer = self._load()
+        # 批量生成时 prompt 长短不一，decoder-only 模型要在左边补齐，新 token 才能接在每条 prompt 后面
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        log.info("AI backend %s ready on %s, adapters: %s", self.name, self.device, list(self.adapters) or "none")
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _adapter_paths(self) -> Dict[str, str]:
+        return {"router": Config.ROUTER_ADAPTER_PATH, "character": Config.CHARACTER_ADAPTER_PATH}
+
+    def _load_adapters(self, model):
+        for name, path in self._adapter_paths().items():
+            if path:
+                model.load_adapter(str(path), adapter_name=name)
+                self.adapters[name] = str(path)
+
+    def _use_adapter(self, adapter: str):
+        if adapter in self.adapters:
+            self.model.set_adapter(adapter)
+
+    def _encode(self, adapter: str, messages: Messages):
+        self._use_adapter(adapter)
+        # 使用 apply_chat_template 自动生成标准的 ChatML 格式
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=True,
+            add_generation_prompt=True,
+            return_tensors="pt",
+        ).to(self.device)
+
+    def generate(self, adapter, messages, max_new_tokens, temperature, top_p=None):
+        with self._lock:
+            inputs = self._encode(adapter, messages)
+            outputs = self.model.generate(
+                input_ids=inputs,
+                max_new_tokens=max_new_tokens,
+                use_cache=True,
+                temperature=temperature,
+                top_p=top_p,
+                pad_token_id=self.tokenizer.eos_token_id,
+            )
+        # 只取生成的部分
+        generated = outputs[0][inputs.shape[1]:]
+        return self.tokenizer.decode(generated, skip_special_tokens=True), len(generated)
+
+    def generate_batch(self, adapter, batch, max_new_tokens, temperature, top_p=None):
+        if len(batch) == 1:
+            return [self.generate(adapter, batch[0], max_new_tokens, temperature, top_p)]
+
+        prompts = [self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+                   for messages in batch]
+        with self._lock:
+            self._use_adapter(adapter)
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                use_cache=True,
+                temperature=temperature,
+                top_p=top_p,
+                pad_token_id=self.tokenizer.pad_token_id,
+            )
+
+        # 每行都是 [左补齐的 prompt | 生成部分 | 先结束的行在右边补的 pad]
+        prompt_length = inputs["input_ids"].shape[1]
+        results = []
+        for row in outputs[:, prompt_length:]:
+            tokens = int((row != self.tokenizer.pad_token_id).sum())
+            results.append((self.tokenizer.decode(row, skip_special_tokens=True), tokens))
+        return results
+
+    def stream(self, adapter, messages, max_new_tokens, temperature, top_p=None):
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self._lock.acquire()
+        try:
+            inputs = self._encode(adapter, messages)
+        except Exception:
+            self._lock.release()
+            raise
+
+        def run():
+            # 锁一直持有到生成结束，免得别的请求中途把适配器切走
+            try:
+                self.model.generate(input_ids=inputs, streamer=streamer, max_new_tokens=max_new_tokens,
+                                    temperature=temperature, top_p=top_p)
+            finally:
+                self._lock.release()
+
+        threading.Thread(target=run, daemon=True).start()
+        yield from streamer
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+
+class GrimoireUnslothBackend(_TorchBackend):
+    name = "cuda"
+
+    def __init__(self):
+        super().__init__("cuda")
+
+    def _load(self):
+        from unsloth import FastLanguageModel
+        from unsloth.chat_templates import get_chat_template
+
+        # 加载基础模型 (4-bit)
+        model, tokenizer = FastLanguageModel.from_pretrained(
+            model_name=str(Config.MODEL_PATH),
+            max_seq_length=Config.AI_MAX_SEQ_LENGTH,
+            load_in_4bit=True,
+        )
+        self._load_adapters(model)
+        return model, get_chat_template(tokenizer, chat_template="qwen-2.5")
+
+
+class GrimoireCPUBackend(_TorchBackend):
+    """
+    CPU 推理，适合 0.5B~3B 的小模型，或者用 int8 动态量化跑大一点的模型。
+    适配器用 CPU_*_ADAPTER_PATH，不会把 14B 的 LoRA 挂到小模型上。
+    """
+    name = "cpu"
+
+    def __init__(self, model_path=None, threads: int = Config.AI_CPU_THREADS,
+                 quantize: bool = Config.AI_CPU_QUANTIZE):
+        self.model_path = str(model_path if model_path else Config.CPU_MODEL_PATH)
+        if not self.model_path:
+            raise ValueError("CPU backend needs a model, set GRIMOIRE_CPU_MODEL_PATH")
+        self.threads = threads
+        self.quantize = quantize
+        super().__init__("cpu")
+
+    def _adapter_paths(self):
+        return {"router": Config.CPU_ROUTER_ADAPTER_PATH, "character": Config.CPU_CHARACTER_ADAPTER_PATH}
+
+    def _load(self):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+
+        # Qwen 系列的分词器自带 ChatML 模板，不需要 unsloth 的 get_chat_template
+        tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+        model = AutoModelForCausalLM.from_pretrained(self.model_path, torch_dtype=torch.float32)
+        # 适配器要在量化之前挂上，peft 认不出量化后的 Linear
+        self._load_adapters(model)
+        if self.quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.eval()
+        return model, tokenizer
+
+
+class GrimoireStubBackend(GrimoireInferenceBackend):
+    """
+    不加载模型：路由固定返回 Config.AI_STUB_ROUTE_REPLY，聊天逐词回显最后一条用户消息。
+    """
+    name = "stub"
+
+    def __init__(self, route_reply: str = Config.AI_STUB_ROUTE_REPLY):
+        self.route_reply = route_reply
+
+    def generate(self, adapter, messages, max_new_tokens, temperature, top_p=None):
+        text = self.route_reply if adapter == "router" else "".join(self._reply(messages))
+        return text, self.count_tokens(text)
+
+    def stream(self, adapter, messages, max_new_tokens, temperature, top_p=None):
+        yield from self._reply(messages)[:max_new_tokens]
+
+    @staticmethod
+    def _reply(messages: Messages) -> List[str]:
+        last = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        return [word + " " for word in f"[stub] {last}".split()]
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+
+def _cuda_available() -> bool:
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
+
+def _auto_backend() -> str:
+    """
+    auto 按能跑起来的程度挑后端：依赖和模型文件都在才选，否则退到 stub。
+    """
+    if os.path.isdir(Config.MODEL_PATH) and importlib.util.find_spec("unsloth") and _cuda_available():
+        return "cuda"
+    if (Config.CPU_MODEL_PATH and os.path.isdir(Config.CPU_MODEL_PATH)
+            and importlib.util.find_spec("torch") and importlib.util.find_spec("transformers")):
+        return "cpu"
+    log.warning("No usable AI model for auto backend (CUDA model %s, CPU model %s), falling back to stub",
+                Config.MODEL_PATH, Config.CPU_MODEL_PATH or "not set")
+    return "stub"
+
+
+def create_inference_backend(kind: str = Config.AI_BACKEND) -> GrimoireInferenceBackend:
+    """
+    按 Config.AI_BACKEND 创建推理后端。auto 选出的后端加载失败时退到 stub，显式指定的后端加载失败直接抛出。
+    """
+    if kind == "auto":
+        kind = _auto_backend()
+        if kind != "stub":
+            try:
+                return create_inference_backend(kind)
+            except Exception as e:
+                log.exception("AI backend %s failed to load, falling back to stub: %s", kind, e)
+                return GrimoireStubBackend()
+    if kind == "cuda":
+        return GrimoireUnslothBackend()
+    if kind == "cpu":
+        return GrimoireCPUBackend()
+    if kind == "stub":
+        return GrimoireStubBackend()
+    raise ValueError(f"Unknown AI backend: {kind}")
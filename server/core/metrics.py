@@ -0,0 +1,268 @@
+"""
+进程内的运行指标，按 Prometheus 文本格式导出 (GET /metrics)。
+心跳路径上每次只是加锁加一个数，可以常开；需要查库的数量 (任务、Beacon 按状态分组) 只在抓取时才算。
+"""
+import bisect
+import logging
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+# 请求延迟的默认分桶 (秒)，从 1ms 到 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence[str]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(map(str, labels)) if labels else ()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class GrimoireCounter(_Metric):
+    """
+    只增不减的累计值，每秒速率在 Prometheus 里用 rate() 算。
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        if not self.labelnames:
+            self._values[()] = 0.0
+
+    def inc(self, amount: float = 1.0, labels: Sequence[str] = ()):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, labels: Sequence[str] = ()) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _render_samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class GrimoireGauge(_Metric):
+    """
+    可增可减的当前值，一般在抓取时由 collector 整体刷新。
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, labels: Sequence[str] = ()):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def replace(self, values: Dict[LabelValues, float]):
+        """
+        整体替换所有标签组合的值，上次有、这次没有的标签组合会消失。
+        """
+        values = {self._key(key): value for key, value in values.items()}
+        with self._lock:
+            self._values = values
+
+    def _render_samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class GrimoireHistogram(_Metric):
+    """
+    固定分桶的直方图。observe 只做一次二分查找和几次加法。
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # {标签: [各桶计数 (不累计, 最后一个是 +Inf), 总和, 总数]}
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, labels: Sequence[str] = ()):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _render_samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        names = self.labelnames + ("le",)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+class GrimoireMetricsRegistry:
+    """
+    所有指标的登记处。collector 在每次抓取前调用，用来刷新需要现算的 gauge。
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], None]] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> GrimoireCounter:
+        return self._register(GrimoireCounter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> GrimoireGauge:
+        return self._register(GrimoireGauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> GrimoireHistogram:
+        return self._register(GrimoireHistogram(name, documentation, labelnames, buckets))
+
+    def set_collector(self, name: str, collector: Callable[[], None]):
+        """
+        按名字登记 collector，同名的会被替换 (create_app 调用多次也只留一份)。
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors.items())
+            metrics = list(self._metrics.values())
+
+        for name, collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                # 某个 collector 失败不影响其余指标的导出
+                log.exception("Metrics collector %s failed: %s", name, e, extra={"collector": name})
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 整个进程共用一份，Flask 和 ASGI 监听器都往这里记
+metrics = GrimoireMetricsRegistry()
+
+HTTP_REQUESTS = metrics.counter(
+    "grimoire_http_requests_total", "HTTP requests by blueprint, route, method and status.",
+    ("blueprint", "route", "method", "status"))
+HTTP_REQUEST_DURATION = metrics.histogram(
+    "grimoire_http_request_duration_seconds", "HTTP request latency by blueprint, route and method.",
+    ("blueprint", "route", "method"))
+
+CHECKINS = metrics.counter("grimoire_checkins_total", "Beacon check-ins (heartbeats and result uploads).")
+HANDSHAKES = metrics.counter("grimoire_handshakes_total", "Beacon key-exchange handshakes by result.", ("result",))
+DECRYPT_FAILURES = metrics.counter("grimoire_decrypt_failures_total",
+                                   "Beacon messages that failed decryption or authentication.")
+
+TASKS = metrics.gauge("grimoire_tasks", "Tasks in the database by status.", ("status",))
+PENDING_QUEUE = metrics.gauge("grimoire_pending_queue_tasks", "Tasks waiting in the in-memory dispatch queue.")
+BEACONS = metrics.gauge("grimoire_beacons", "Beacons by status (Active / Stale).", ("status",))
+SESSIONS = metrics.gauge("grimoire_sessions", "Beacon crypto sessions in the session store.", ("kind",))
+LOG_QUEUE = metrics.gauge("grimoire_log_queue_records", "Log records waiting to be written / dropped because the queue was full.",
+                         ("state",))
+
+DB_QUERIES = metrics.histogram(
+    "grimoire_db_queries_per_scope", "SQL statements per request (kind=http) or scheduler run (kind=job).",
+    ("kind", "name"), buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64, 128))
+DB_QUERY_SECONDS = metrics.histogram(
+    "grimoire_db_query_seconds_per_scope", "Time spent in SQL per request or scheduler run.", ("kind", "name"))
+QUERY_BUDGET_EXCEEDED = metrics.counter(
+    "grimoire_db_query_budget_exceeded_total", "Requests or scheduler runs that exceeded their query budget.",
+    ("kind", "name"))
+N_PLUS_ONE_SUSPECTS = metrics.counter(
+    "grimoire_db_repeated_statement_total", "Requests or scheduler runs that repeated one statement "
+    "QUERY_REPEAT_THRESHOLD+ times (possible N+1).", ("kind", "name"))
+
+SCHEDULER_JOB_DURATION = metrics.histogram(
+    "grimoire_scheduler_job_duration_seconds", "Background scheduler job run time.", ("job",))
+
+AI_INFERENCE_DURATION = metrics.histogram(
+    "grimoire_ai_inference_duration_seconds", "AI inference wall time by kind (route / chat).", ("kind",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+AI_TOKENS_PER_SECOND = metrics.histogram(
+    "grimoire_ai_tokens_per_second", "AI generation throughput per inference by kind.", ("kind",),
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 200))
+AI_GENERATED_TOKENS = metrics.counter(
+    "grimoire_ai_generated_tokens_total", "Tokens generated by the AI service by kind.", ("kind",))
+AI_BATCH_SIZE = metrics.histogram(
+    "grimoire_ai_batch_size", "Requests per batched generate call by kind.", ("kind",),
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32))
+AI_QUEUE_WAIT = metrics.histogram(
+    "grimoire_ai_queue_wait_seconds", "Time a request waited in the AI batching queue by kind.", ("kind",))
+AI_QUEUE = metrics.gauge("grimoire_ai_queue_requests", "Requests waiting in the AI batching queue by kind.", ("kind",))
+AI_REJECTED = metrics.counter(
+    "grimoire_ai_rejected_total", "AI requests rejected with 429 because the batching queue was full.", ("kind",))
+
+
+def observe_request(blueprint: str, route: str, method: str, status: int, seconds: float):
+    HTTP_REQUESTS.inc(1, (blueprint, route, method, status))
+    HTTP_REQUEST_DURATION.observe(seconds, (blueprint, route, method))
+
+
+def observe_inference(kind: str, seconds: float, tokens: int):
+    AI_INFERENCE_DURATION.observe(seconds, (kind,))
+    AI_GENERATED_TOKENS.inc(tokens, (kind,))
+    if seconds > 0 and tokens:
+        AI_TOKENS_PER_SECOND.observe(tokens / seconds, (kind,))
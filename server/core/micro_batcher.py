@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+from server.core.metrics import AI_BATCH_SIZE, AI_QUEUE_WAIT, AI_REJECTED
+
+log = logging.getLogger(__name__)
+
+
+class _PendingRequest:
+    __slots__ = ('item', 'future', 'enqueued_at')
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class GrimoireMicroBatcher:
+    """
+    动态微批队列：并发的请求先排队，由一个后台线程凑成一批交给 process_batch 一次处理，再把结果按顺序分回各自的 Future。
+    第一个请求入队后最多再等 window 秒或者凑满 max_batch 个就发车；上一批还没跑完时攒下的请求不再额外等待。
+    排队的请求达到 max_queued 时 submit 直接抛 OverflowError，不让请求线程越堆越多。
+    """
+    def __init__(self, kind: str, process_batch: Callable[[List[Any]], List[Any]],
+                 window: float, max_batch: int, max_queued: int):
+        self.kind = kind
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.max_queued = max_queued
+
+        self._pending: List[_PendingRequest] = []
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._worker_loop, name=f"grimoire-batch-{kind}", daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        """
+        入队，返回的 Future 在这一批处理完后拿到结果或异常。队列满了抛 OverflowError。
+        """
+        request = _PendingRequest(item)
+        with self._cond:
+            if len(self._pending) >= self.max_queued:
+                AI_REJECTED.inc(1, (self.kind,))
+                raise OverflowError(f"{self.kind} queue is full ({len(self._pending)} requests waiting), "
+                                    f"try again later")
+            self._pending.append(request)
+            self._cond.notify()
+        return request.future
+
+    def queued(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def _next_batch(self) -> List[_PendingRequest]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # 从第一个请求入队时开始算窗口
+            deadline = self._pending[0].enqueued_at + self.window
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _worker_loop(self):
+        while True:
+            batch = self._next_batch()
+            # 调用方等超时后会 cancel，这些请求不再处理
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            now = time.monotonic()
+            for request in batch:
+                AI_QUEUE_WAIT.observe(now - request.enqueued_at, (self.kind,))
+            AI_BATCH_SIZE.observe(len(batch), (self.kind,))
+
+            try:
+                results = self.process_batch([request.item for request in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.kind} batch returned {len(results)} results for {len(batch)} requests")
+            except Exception as e:
+                log.exception("%s batch of %d failed: %s", self.kind, len(batch), e,
+                              extra={"kind": self.kind, "batch_size": len(batch)})
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
@@ -0,0 +1,165 @@
+"""
+结构化日志：JSON lines 写到 Config.LOG_DIR 下按大小滚动的文件，同时在控制台输出一份可读的文本。
+请求线程只把日志记录放进队列，格式化和写文件/stdout 都在后台线程里做；队列满了直接丢弃并计数，不会卡住心跳。
+
+用法和标准库一样：
+    log = logging.getLogger(__name__)
+    log.info("Task result recorded", extra={"task_id": 1, "beacon_id": "..."})
+高频事件带上 sample 键按比例采样，比例在 GRIMOIRE_LOG_SAMPLING 里配置：
+    log.info("Beacon heartbeat", extra={"sample": "heartbeat", "beacon_id": "..."})
+"""
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict
+
+from config import Config
+
+# LogRecord 自带的属性，剩下的都是调用方通过 extra 传进来的结构化字段
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def parse_pairs(spec: str) -> Dict[str, str]:
+    """
+    "a=1,b=2" -> {"a": "1", "b": "2"}，空字符串返回空字典。
+    """
+    pairs = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        key, _, value = item.partition('=')
+        pairs[key.strip()] = value.strip()
+    return pairs
+
+
+class GrimoireJsonFormatter(logging.Formatter):
+    """
+    每条记录一行 JSON：时间、级别、logger 名、消息，加上 extra 里的所有字段。
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class GrimoireSamplingFilter(logging.Filter):
+    """
+    带 sample 字段的记录按 {sample: N} 每 N 条放行 1 条，放行的记录带上 sample_rate，方便按比例还原总数。
+    没有 sample 字段或者没配比例的记录全部放行。
+    """
+    def __init__(self, rates: Dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self._counters: Dict[str, itertools.count] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'sample', None)
+        rate = self.rates.get(key, 1) if key else 1
+        if rate <= 1:
+            return True
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters.setdefault(key, itertools.count())
+        if next(counter) % rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class GrimoireQueueHandler(QueueHandler):
+    """
+    非阻塞的队列 handler：请求线程里不做格式化，队列满了丢弃并计数。
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 默认实现会在调用线程里格式化消息，这里原样交给后台线程
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class GrimoireQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # 退出时队列可能是满的，阻塞等后台线程腾出位置，保证剩下的日志都能写完
+        self.queue.put(self._sentinel)
+
+
+_listener: QueueListener | None = None
+_queue_handler: GrimoireQueueHandler | None = None
+_init_lock = threading.Lock()
+
+
+def init_logging() -> GrimoireQueueHandler:
+    """
+    把根 logger 接到后台写日志的队列上，整个进程只初始化一次。
+    SQLAlchemy、APScheduler、werkzeug 的日志也都走这条队列。
+    """
+    global _listener, _queue_handler
+    with _init_lock:
+        if _queue_handler is not None:
+            return _queue_handler
+
+        os.makedirs(Config.LOG_DIR, exist_ok=True)
+        file_handler = RotatingFileHandler(
+            os.path.join(Config.LOG_DIR, 'grimoire.log'),
+            maxBytes=Config.LOG_MAX_BYTES,
+            backupCount=Config.LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+        file_handler.setFormatter(GrimoireJsonFormatter())
+        handlers = [file_handler]
+        if Config.LOG_CONSOLE:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+            handlers.append(console_handler)
+
+        log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        _queue_handler = GrimoireQueueHandler(log_queue)
+        _queue_handler.addFilter(GrimoireSamplingFilter(
+            {key: int(rate) for key, rate in parse_pairs(Config.LOG_SAMPLING).items()}
+        ))
+
+        root = logging.getLogger()
+        root.setLevel(Config.LOG_LEVEL)
+        root.addHandler(_queue_handler)
+
+        # SQL 回显也走队列，不再由 SQLAlchemy 自己同步写 stdout
+        if Config.DB_ECHO:
+            logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+        # 按模块单独设置级别，例如 server.core.task_service=DEBUG,apscheduler=WARNING
+        for name, level in parse_pairs(Config.LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level.upper())
+
+        _listener = GrimoireQueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # 退出前把队列里剩下的日志写完
+        atexit.register(_listener.stop)
+        return _queue_handler
+
+
+def logging_stats() -> Dict[str, int]:
+    if _queue_handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped}
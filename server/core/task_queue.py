@@ -0,0 +1,106 @@
+import threading
+from collections import deque
+from typing import Callable, Dict, Any, Deque, Optional
+
+from sqlalchemy.orm import Session
+
+from server.persistence.models import Task
+
+
+class GrimoirePendingTaskQueue:
+    """
+    进程内的待处理任务队列，按 beacon_id 建索引。
+    数据库依旧是持久化记录，这里只是挡在 tasks 表前面的一层，
+    让没有任务的心跳不用去碰 MySQL。
+    """
+    def __init__(self):
+        # {beacon_id: deque([{"task_id": .., "command": .., "arguments": ..}, ...])}
+        self._queues: Dict[str, Deque[Dict[str, Any]]] = {}
+        # Flask 是多线程跑的，入队和出队都要加锁
+        self._lock = threading.Lock()
+        # 长轮询挂起的心跳：{beacon_id: 回调}，有任务入队时调用，回调里不能阻塞。
+        # 每个 Beacon 只留最新的一个，旧连接多半已经断了，不能让它把任务取走
+        self._watchers: Dict[str, Callable[[], None]] = {}
+
+    def enqueue(self, beacon_id: str, task_id: int, command: str, arguments: str):
+        """
+        将一个已经提交到数据库的 PENDING 任务放入队列尾部。
+        """
+        entry = {"task_id": task_id, "command": command, "arguments": arguments}
+        with self._lock:
+            self._queues.setdefault(beacon_id, deque()).append(entry)
+            notify = self._watchers.get(beacon_id)
+        if notify:
+            notify()
+
+    def requeue(self, beacon_id: str, entry: Dict[str, Any]):
+        """
+        分配失败时把任务放回队头，保持先创建先执行的顺序。
+        """
+        with self._lock:
+            self._queues.setdefault(beacon_id, deque()).appendleft(entry)
+            notify = self._watchers.get(beacon_id)
+        if notify:
+            notify()
+
+    def pop(self, beacon_id: str) -> Optional[Dict[str, Any]]:
+        """
+        取出该 Beacon 最旧的一个任务，没有就返回 None。O(1)。
+        """
+        with self._lock:
+            queue = self._queues.get(beacon_id)
+            if not queue:
+                return None
+
+            entry = queue.popleft()
+            # 空队列顺手删掉，避免字典跟着 Beacon 数量一直涨
+            if not queue:
+                del self._queues[beacon_id]
+            return entry
+
+    def watch(self, beacon_id: str, notify: Callable[[], None]):
+        """
+        注册一个回调，该 Beacon 有任务入队时调用 (在入队的线程里调用)。
+        同一个 Beacon 之前挂起的回调被顶掉，并且调用一次让它醒来，它用 is_watching 发现自己被顶掉了就退出。
+        """
+        with self._lock:
+            superseded = self._watchers.get(beacon_id)
+            self._watchers[beacon_id] = notify
+        if superseded:
+            superseded()
+
+    def unwatch(self, beacon_id: str, notify: Callable[[], None]):
+        with self._lock:
+            if self._watchers.get(beacon_id) is notify:
+                del self._watchers[beacon_id]
+
+    def is_watching(self, beacon_id: str, notify: Callable[[], None]) -> bool:
+        with self._lock:
+            return self._watchers.get(beacon_id) is notify
+
+    def has_pending(self, beacon_id: str) -> bool:
+        return beacon_id in self._queues
+
+    def rebuild(self, db: Session) -> int:
+        """
+        启动时从数据库里的 PENDING 记录重建队列，返回重建的任务数量。
+        """
+        rows = (db.query(Task.task_id, Task.beacon_id, Task.command, Task.arguments)
+                .filter(Task.status == 'PENDING')
+                .order_by(Task.created_at, Task.task_id)
+                .all())
+
+        queues: Dict[str, Deque[Dict[str, Any]]] = {}
+        for task_id, beacon_id, command, arguments in rows:
+            queues.setdefault(beacon_id, deque()).append(
+                {"task_id": task_id, "command": command, "arguments": arguments}
+            )
+
+        with self._lock:
+            self._queues = queues
+
+        return len(rows)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
@@ -1,10 +1,19 @@
 import json
-from typing import Dict, Any, Optional, List
+import logging
+import uuid
+from typing import Dict, Any, Optional, List, Iterator
 import base64
+from config import Config
+from server.core.event_bus import GrimoireEventBus
+from server.core.task_queue import GrimoirePendingTaskQueue
+from server.core.upload_service import GrimoireUploadService
+from server.persistence.blob_store import GrimoireBlobStore
 from server.persistence.models import Task, TaskOutput, Beacon
+from sqlalchemy import and_, event, func, insert, or_
 from sqlalchemy.orm import Session
 from datetime import datetime
 
+log = logging.getLogger(__name__)
 
 # 结构将查询结果 (Task对象, TaskOutput对象) 封装结构
 # 使用一个简单的属性对象来命名元组，便于在 operator_routes.py 中访问
@@ -13,12 +22,43 @@ class TaskResultInfo:
         self.task = task
         self.output = output
 
+# 任务历史的一页，rows 是只带列表所需字段的查询结果，next_cursor 为 None 表示没有下一页
+class TaskHistoryPage:
+    def __init__(self, rows, next_cursor):
+        self.rows = rows
+        self.next_cursor = next_cursor
+
+# 批量下发的结果：created 是 [(task_id, beacon_id)]，rejected 是不存在或不活跃的 beacon_id
+class TaskBatchResult:
+    def __init__(self, batch_id, created, rejected):
+        self.batch_id = batch_id
+        self.created = created
+        self.rejected = rejected
+
 class GrimoireTaskService:
     """
     任务服务层：处理任务的创建、分配、状态更新和结果记录。
     所有方法都需要一个 Session 实例作为第一个参数。
     """
 
+    def __init__(self, task_queue: GrimoirePendingTaskQueue = None, blob_store: GrimoireBlobStore = None,
+                 upload_service: GrimoireUploadService = None, event_bus: GrimoireEventBus = None):
+        # 挡在 tasks 表前面的内存队列，心跳优先查这里
+        self.task_queue = task_queue if task_queue else GrimoirePendingTaskQueue()
+        # 回显正文存在 blob store 里，数据库只留元数据
+        self.blob_store = blob_store if blob_store else GrimoireBlobStore()
+        # 大结果的分块上传暂存
+        self.upload_service = upload_service if upload_service else GrimoireUploadService()
+        # 任务创建和完成时通知操作员的事件流
+        self.event_bus = event_bus if event_bus else GrimoireEventBus()
+
+    def restore_pending_queue(self, db: Session):
+        """
+        服务启动时调用，从数据库的 PENDING 记录重建内存队列。
+        """
+        count = self.task_queue.rebuild(db)
+        log.info("Pending task queue rebuilt with %d task(s).", count, extra={"count": count})
+
     def create_task(self, db: Session, beacon_id: str, command: str, arguments: str = None) -> Task:
         """
         由 Web UI 调用创建一个新任务并存入数据库。
@@ -37,62 +77,206 @@ class GrimoireTaskService:
             created_at=datetime.utcnow()
         )
 
-        # 将任务加入 Session (等待 commit)
+        # 将任务加入 Session，flush 一下拿到自增的 task_id
         db.add(new_task)
+        db.flush()
+
+        # 数据库是持久化记录，只有事务真正提交之后才放进内存队列
+        task_id, command, task_arguments = new_task.task_id, new_task.command, new_task.arguments
+
+        def _enqueue_after_commit(session):
+            self.task_queue.enqueue(beacon_id, task_id, command, task_arguments)
+
+        event.listen(db, 'after_commit', _enqueue_after_commit, once=True)
+        self.event_bus.publish_after_commit(db, 'task.created', {
+            "task_id": task_id, "beacon_id": beacon_id, "command": command
+        })
 
         return new_task
 
-    def get_pending_task(self, db: Session, beacon_id: str) -> dict | None:
+    def create_tasks_bulk(self, db: Session, command: str, arguments: str = None, beacon_ids: List[str] = None,
+                          os_pattern: str = None, hostname_pattern: str = None,
+                          user_pattern: str = None) -> TaskBatchResult:
         """
-        由 Beacon Check-in 调用查询数据库中分配给该 Beacon 的第一个待处理任务。
+        给一批 Beacon 下发同一个任务，整批在调用方的一个事务里完成：
+            1. 一条查询筛出目标 Beacon (给了 beacon_ids 就按列表，否则按 os/hostname/user 模式匹配，* 是通配符，
+               其余字符包括 % 和 _ 都按字面匹配)。
+            2. 按 BULK_INSERT_BATCH_SIZE 分段的多行 INSERT 写入所有任务，共用一个批次号。
+            3. 一条查询按批次号取回自增的 task_id。
+        和 create_task 一样只给 Active 的 Beacon 下发。
         """
-        # 查找最旧的 PENDING 任务
-        task = (db.query(Task)
-                .filter(Task.beacon_id == beacon_id, Task.status == 'PENDING')
-                .order_by(Task.created_at)  # 按照创建时间排序，先创建的先执行
-                .first())
-
-        if task:
-            # 状态转换：将任务状态更新为 ASSIGNED
-            task.status = 'ASSIGNED'
-            task.assigned_at = datetime.utcnow()
-            db.add(task)
+        query = db.query(Beacon.id).filter(Beacon.status == 'Active')
+        if beacon_ids is not None:
+            requested = list(dict.fromkeys(beacon_ids))   # 去重并保持顺序
+            if len(requested) > Config.BULK_TASK_MAX_BEACONS:
+                raise ValueError(f"Too many beacons in one batch (max {Config.BULK_TASK_MAX_BEACONS}).")
+            query = query.filter(Beacon.id.in_(requested))
+        else:
+            patterns = [(Beacon.os_info, os_pattern), (Beacon.hostname, hostname_pattern), (Beacon.username, user_pattern)]
+            if not any(pattern for _, pattern in patterns):
+                raise ValueError("Either beacon_ids or at least one filter is required.")
+            for column, pattern in patterns:
+                if pattern:
+                    query = query.filter(column.like(self._like_pattern(pattern), escape='\\'))
+
+        targets = {beacon_id for (beacon_id,) in query.all()}
+        if beacon_ids is not None:
+            rejected = [beacon_id for beacon_id in requested if beacon_id not in targets]
+            targets = [beacon_id for beacon_id in requested if beacon_id in targets]
+        else:
+            rejected = []
+            targets = sorted(targets)
+
+        if len(targets) > Config.BULK_TASK_MAX_BEACONS:
+            raise ValueError(f"Filter matches {len(targets)} beacons (max {Config.BULK_TASK_MAX_BEACONS}).")
+        if not targets:
+            return TaskBatchResult(batch_id=None, created=[], rejected=rejected)
+
+        batch_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        task_arguments = arguments if arguments else ''
+        rows = [
+            {"beacon_id": beacon_id, "command": command, "arguments": task_arguments,
+             "status": 'PENDING', "created_at": now, "batch_id": batch_id}
+            for beacon_id in targets
+        ]
+        # INSERT INTO tasks (...) VALUES (...), (...), ... 分段是为了不超过驱动的参数个数上限
+        for start in range(0, len(rows), Config.BULK_INSERT_BATCH_SIZE):
+            db.execute(insert(Task).values(rows[start:start + Config.BULK_INSERT_BATCH_SIZE]))
+
+        # 多行 INSERT 拿不到每一行的自增 ID (MySQL 也不保证连续)，按批次号查回来
+        created = (db.query(Task.task_id, Task.beacon_id)
+                   .filter(Task.batch_id == batch_id)
+                   .order_by(Task.task_id)
+                   .all())
+        created = [(task_id, beacon_id) for task_id, beacon_id in created]
+
+        # 和 create_task 一样，事务提交之后才放进内存队列
+        def _enqueue_after_commit(session):
+            for task_id, beacon_id in created:
+                self.task_queue.enqueue(beacon_id, task_id, command, task_arguments)
+
+        event.listen(db, 'after_commit', _enqueue_after_commit, once=True)
+        self.event_bus.publish_after_commit(db, 'task.batch_created', {
+            "batch_id": batch_id, "command": command, "count": len(created)
+        })
+
+        return TaskBatchResult(batch_id=batch_id, created=created, rejected=rejected)
+
+    @staticmethod
+    def _like_pattern(pattern: str) -> str:
+        # 先转义 LIKE 自己的通配符，再把 * 换成 %
+        escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return escaped.replace('*', '%')
+
+    def get_batch_summary(self, db: Session, batch_id: str) -> Dict[str, int]:
+        """
+        按状态统计一个批次的任务数量，例如 {"PENDING": 10, "COMPLETED": 1990}，批次不存在时返回空字典。
+        """
+        rows = (db.query(Task.status, func.count(Task.task_id))
+                .filter(Task.batch_id == batch_id)
+                .group_by(Task.status)
+                .all())
+        return {status: count for status, count in rows}
 
-            print(f"[{beacon_id[:8]}]: Assigning Task {task.task_id} ({task.command})")
+    def get_pending_task(self, db: Session, beacon_id: str) -> dict | None:
+        """
+        由 Beacon Check-in 调用，从内存队列取出分配给该 Beacon 的第一个待处理任务。
+        队列为空时直接返回，不查询数据库。
+        """
+        while True:
+            entry = self.task_queue.pop(beacon_id)
+            if entry is None:
+                return None  # 没有待处理任务
+
+            # 状态转换：将任务状态更新为 ASSIGNED，同时写穿到数据库
+            # 带上 status 条件，如果任务已经不是 PENDING (比如事务回滚了)，就丢掉取下一个
+            updated = (db.query(Task)
+                       .filter(Task.task_id == entry["task_id"], Task.status == 'PENDING')
+                       .update({Task.status: 'ASSIGNED', Task.assigned_at: datetime.utcnow()},
+                               synchronize_session=False))
+            if not updated:
+                log.warning("Queued task %s is no longer PENDING, skipping.", entry["task_id"],
+                            extra={"task_id": entry["task_id"]})
+                continue
+
+            # 如果这次心跳的事务最终回滚了，把任务放回队头，等下一次心跳重新分配
+            def _requeue_after_rollback(session, entry=entry):
+                self.task_queue.requeue(beacon_id, entry)
+
+            event.listen(db, 'after_rollback', _requeue_after_rollback, once=True)
+
+            log.info("[%s]: Assigning Task %s (%s)", beacon_id[:8], entry["task_id"], entry["command"],
+                     extra={"beacon_id": beacon_id, "task_id": entry["task_id"], "command": entry["command"]})
 
             # 返回一个字典结构，方便 Beacon 端解析
             return {
-                "task_id": str(task.task_id),       # cpp端只能解析字符串，所以得适配一下
-                "command": task.command,
-                "arguments": task.arguments
+                "task_id": str(entry["task_id"]),       # cpp端只能解析字符串，所以得适配一下
+                "command": entry["command"],
+                "arguments": entry["arguments"]
             }
 
-        return None  # 没有待处理任务
+    def release_task(self, db: Session, beacon_id: str, task: dict):
+        """
+        已经分配出去但没送到 Beacon 的任务 (长轮询的连接断了) 改回 PENDING，事务提交后放回队头。
+        task 是 get_pending_task 返回的字典。
+        """
+        task_id = int(task["task_id"])
+        released = (db.query(Task)
+                    .filter(Task.task_id == task_id, Task.beacon_id == beacon_id, Task.status == 'ASSIGNED')
+                    .update({Task.status: 'PENDING', Task.assigned_at: None}, synchronize_session=False))
+        if not released:
+            return
+
+        entry = {"task_id": task_id, "command": task["command"], "arguments": task["arguments"]}
+        event.listen(db, 'after_commit', lambda session: self.task_queue.requeue(beacon_id, entry), once=True)
+        log.warning("[%s]: Task %s was not delivered, requeued.", beacon_id[:8], task_id,
+                    extra={"beacon_id": beacon_id, "task_id": task_id})
 
-    def record_output(self, db: Session, task_id: int, output_data: str):
+    def record_output(self, db: Session, task_id: int, output_bytes: bytes, encoding: str = 'raw') -> bool:
         """
         由 Beacon Check-in 调用接收任务回显，更新任务状态和结果。
+        正文写进 blob store (按哈希去重)，task_outputs 只记录大小、哈希和编码。
+        """
+        return self._record_blob(db, task_id, lambda: self.blob_store.put(output_bytes), encoding)
+
+    def record_output_file(self, db: Session, task_id: int, path: str, encoding: str = 'raw') -> bool:
         """
+        分块上传完成后调用，按块读取暂存文件写进 blob store，不把整个结果读进内存。
+        """
+        return self._record_blob(db, task_id, lambda: self.blob_store.put_file(path), encoding)
 
+    def _record_blob(self, db: Session, task_id: int, write_blob, encoding: str) -> bool:
         # 查找任务，并且我们只接受 ASSIGNED 状态的任务回显
         task = db.query(Task).filter(Task.task_id == task_id, Task.status == 'ASSIGNED').first()
 
         if not task:
-            print(f"ERROR: Received output for non-existent task ID: {task_id}")
-            return
+            log.error("Received output for non-existent task ID: %s", task_id, extra={"task_id": task_id})
+            return False
 
         if task.status != 'ASSIGNED':
             # 避免重复记录，但允许 COMPLETED 状态的任务回传更新
-            print(f"WARNING: Output received for task {task_id} in status {task.status}")
+            log.warning("Output received for task %s in status %s", task_id, task.status, extra={"task_id": task_id})
 
 
         # 更新任务状态为 COMPLETED
         task.status = 'COMPLETED'
 
+        # 正文落盘，相同内容只存一份
+        blob = write_blob()
+
+        # 预览现在算好存起来，历史记录列表就不用再读正文
+        head = self.blob_store.read(blob.hash, 0, Config.OUTPUT_PREVIEW_CHARS * 4)
+        preview = TaskOutput.build_preview(task.command, head, blob.size, Config.OUTPUT_PREVIEW_CHARS)
+
         # 记录输出 (使用 TaskOutput 模型)
         output = TaskOutput(
             task_id=task_id,
-            output_data=output_data
+            output_hash=blob.hash,
+            output_size=blob.size,
+            output_encoding=encoding,
+            output_preview=preview,
+            received_at=datetime.utcnow()
         )
 
         # 更新 Task 的 last_updated time
@@ -100,24 +284,40 @@ class GrimoireTaskService:
 
         db.add(output)
 
-        print(f"[{task.beacon_id[:8]}]: Task {task_id} result recorded.")
+        self.event_bus.publish_after_commit(db, 'task.completed', {
+            "task_id": task_id, "beacon_id": task.beacon_id, "command": task.command,
+            "output_size": blob.size, "output_preview": preview
+        })
+
+        log.info("[%s]: Task %s result recorded.", task.beacon_id[:8], task_id,
+                 extra={"beacon_id": task.beacon_id, "task_id": task_id, "output_size": blob.size})
+        return True
 
     def process_and_get_task(self, db: Session, beacon_id: str, plaintext_bytes: bytes) -> Dict[str, Any]:
         """
         处理 Beacon 的心跳请求,分别有两个步骤：
             1. 尝试解析回传数据，并调用 record_output。
+               带 result_id 的是分块上传，交给 receive_result_chunk，没传完就直接回 ack。
             2. 调用 get_pending_task 获取下一个任务。
         """
 
         # 默认响应：让 Beacon 休眠 10 秒
         default_response = {"command": "sleep", "interval": 10}
 
+        # 心跳太频繁，按 GRIMOIRE_LOG_SAMPLING 的比例采样记录
+        log.info("[%s]: Heartbeat", beacon_id[:8], extra={"sample": "heartbeat", "beacon_id": beacon_id})
+
         try:
             # 解析 Beacon 回传的 JSON 数据
             # Beacon 回传的 JSON 格式为: {"task_id": "123", "output": "..."}
             beacon_data: Dict[str, Any] = json.loads(plaintext_bytes.decode('utf-8'))
 
-            if 'task_id' in beacon_data and 'output' in beacon_data:
+            if 'result_id' in beacon_data:
+                ack = self.receive_result_chunk(db, beacon_id, beacon_data)
+                if ack:
+                    return ack
+
+            elif 'task_id' in beacon_data and 'output' in beacon_data:
                 task_id = int(beacon_data['task_id'])   #得先转到整形，cpp比较死板，python端改
 
                 output_b64_from_beacon = beacon_data['output']
@@ -129,13 +329,13 @@ class GrimoireTaskService:
                 try:
                     # 尝试按 UTF-8 读取，如果成功
                     clean_text = raw_bytes.decode('gbk').encode('utf-8')
+                    encoding = 'utf-8'
                 except:
                     clean_text = raw_bytes
+                    encoding = 'raw'
 
-                # 把洗干净的字符串，重新变回 Base64 字符串存入数据库
-                clean_b64 = base64.b64encode(clean_text).decode('utf-8')
-                # 记录结果
-                self.record_output(db, task_id, clean_b64)
+                # 记录结果，原始字节直接进 blob store，不再转回 Base64
+                self.record_output(db, task_id, clean_text, encoding)
 
             # 获取下一个待分配的任务
             next_task = self.get_pending_task(db, beacon_id)
@@ -147,14 +347,89 @@ class GrimoireTaskService:
             return default_response
 
         except json.JSONDecodeError:
-            print(f"ERROR: Beacon {beacon_id[:8]} uploaded invalid JSON data.")
+            log.error("Beacon %s uploaded invalid JSON data.", beacon_id[:8], extra={"beacon_id": beacon_id})
             # 如果解析失败，仍然返回默认休眠指令，不影响下一次签入
             return default_response
         except Exception as e:
-            print(f"ERROR: Task processing failed for {beacon_id[:8]}: {e}")
+            log.exception("Task processing failed for %s: %s", beacon_id[:8], e, extra={"beacon_id": beacon_id})
             return default_response
 
 
+    def receive_result_chunk(self, db: Session, beacon_id: str, beacon_data: Dict[str, Any]) -> Dict[str, Any] | None:
+        """
+        处理分块上传的一个分块，Beacon 回传格式：
+            {"task_id": "123", "result_id": "..", "chunk_index": 0, "chunk_size": 1048576,
+             "total_size": 5242880, "chunk": "<Base64>"}
+        每个分块都是一条独立的 AES-GCM 消息。还没传完时返回 ack (列出缺失的分块，
+        Beacon 断线重连后照着补传即可)；传完并落库后返回 None，继续正常分配任务。
+        最后一个 ack 丢了的话 Beacon 会重传，已经传完的上传同样返回 None，不会被拒绝。
+        """
+        result_id = str(beacon_data['result_id'])
+        task_id = int(beacon_data['task_id'])
+
+        if self.upload_service.is_completed(result_id, beacon_id, task_id):
+            return None
+
+        try:
+            if not self.upload_service.is_known(result_id):
+                # 第一个分块：确认这个任务确实分配给了这个 Beacon
+                assigned = (db.query(Task.task_id)
+                            .filter(Task.task_id == task_id, Task.beacon_id == beacon_id, Task.status == 'ASSIGNED')
+                            .first())
+                if not assigned:
+                    raise ValueError(f"Task {task_id} is not assigned to this beacon")
+
+            progress = self.upload_service.receive_chunk(
+                beacon_id=beacon_id,
+                result_id=result_id,
+                task_id=task_id,
+                chunk_index=int(beacon_data['chunk_index']),
+                chunk_size=int(beacon_data['chunk_size']),
+                total_size=int(beacon_data['total_size']),
+                data=base64.b64decode(beacon_data['chunk'])
+            )
+        except ValueError as e:
+            log.error("Rejected result chunk from %s: %s", beacon_id[:8], e,
+                      extra={"beacon_id": beacon_id, "result_id": result_id})
+            return {"command": "upload_reject", "result_id": result_id, "reason": str(e)}
+
+        if not progress.complete:
+            return {"command": "upload_ack", "result_id": result_id, "missing": progress.missing}
+
+        # 同时到达的几个最后分块只有一个能认领落库，其余的当作已完成
+        if progress.finalized or not self.upload_service.claim_completion(result_id):
+            return None
+
+        # 全部到齐：暂存文件按块写进 blob store，事务提交后再删暂存文件，留下完成标记给重传用；
+        # 落库失败或者事务回滚就撤销认领，Beacon 重传时重新落库
+        try:
+            recorded = self.record_output_file(db, task_id, progress.path, 'raw')
+        except Exception:
+            self.upload_service.release_completion(result_id)
+            raise
+        if recorded:
+            event.listen(db, 'after_commit',
+                         lambda session: self.upload_service.discard(result_id, keep_marker=True), once=True)
+            event.listen(db, 'after_rollback', lambda session: self.upload_service.release_completion(result_id),
+                         once=True)
+        else:
+            self.upload_service.discard(result_id)
+
+        return None
+
+    def iter_output(self, output: TaskOutput, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        流式读取回显正文的 [start, end) 部分，不会把整个正文读进内存。
+        """
+        if output.output_hash:
+            yield from self.blob_store.iter_range(output.output_hash, start, end)
+        elif output.output_data:
+            # 还没迁移的老数据
+            yield base64.b64decode(output.output_data)[start:end]
+
+    def read_output(self, output: TaskOutput, start: int = 0, end: Optional[int] = None) -> bytes:
+        return b"".join(self.iter_output(output, start, end))
+
     def get_task_output_by_id(self, db: Session, task_id: int) -> Optional[Any]:
         """
         根据任务ID查询任务本身及其输出。
@@ -172,20 +447,55 @@ class GrimoireTaskService:
         task_obj, output_obj = result
         return TaskResultInfo(task=task_obj, output=output_obj)
 
-    def get_tasks_by_beacon_id(self, db: Session, beacon_id: str) -> List[TaskResultInfo]:
+    def get_task_history_page(self, db: Session, beacon_id: str, limit: int = Config.HISTORY_PAGE_SIZE,
+                              cursor: str = None) -> TaskHistoryPage:
         """
-        根据 Beacon ID (SF) 查询所有相关的 Task 及其输出。
-        使用 LEFT JOIN，即使没有输出 (TaskOutput)，也能返回 Task 记录。
+        按 (assigned_at, task_id) 倒序分页查询某个 Beacon 的任务历史 (keyset 分页)。
+        只查列表需要的列，回显只取预览和大小，不会读正文。
+        cursor 是上一页返回的 next_cursor，格式不对时抛 ValueError。
+        还没分配的任务 assigned_at 为 NULL，倒序时 MySQL 和 SQLite 都把 NULL 排在最后。
         """
-
-        # 执行关联查询 (Task LEFT JOIN TaskOutput)
-        # 按 beacon_id 过滤，并使用 .all() 获取所有结果
-        results = db.query(Task, TaskOutput).outerjoin(TaskOutput, Task.task_id == TaskOutput.task_id).filter(Task.beacon_id == beacon_id).order_by(Task.assigned_at.desc()).all()
-
-        # 封装结果
-        task_info_list: List[TaskResultInfo] = []
-        for task_obj, output_obj in results:
-            # 将 (Task对象, TaskOutput对象) 封装成 TaskResultInfo
-            task_info_list.append(TaskResultInfo(task=task_obj, output=output_obj))
-
-        return task_info_list
\ No newline at end of file
+        limit = max(1, min(limit, Config.HISTORY_PAGE_MAX))
+
+        # 老数据还没迁移时，在 SQL 里截取 output_data 开头，不把整个 LONGTEXT 取回来
+        preview = func.coalesce(
+            TaskOutput.output_preview,
+            func.substr(TaskOutput.output_data, 1, Config.OUTPUT_PREVIEW_CHARS)
+        ).label('output_preview')
+        output_size = func.coalesce(TaskOutput.output_size, func.length(TaskOutput.output_data)).label('output_size')
+
+        query = (db.query(Task.task_id, Task.status, Task.command, Task.arguments, Task.created_at, Task.assigned_at,
+                          output_size, preview, TaskOutput.received_at)
+                 .outerjoin(TaskOutput, Task.task_id == TaskOutput.task_id)
+                 .filter(Task.beacon_id == beacon_id))
+
+        if cursor:
+            cursor_assigned_at, cursor_task_id = self._parse_history_cursor(cursor)
+            if cursor_assigned_at is None:
+                # 已经翻到未分配的任务了，只剩更小的 task_id
+                query = query.filter(Task.assigned_at.is_(None), Task.task_id < cursor_task_id)
+            else:
+                query = query.filter(or_(
+                    Task.assigned_at < cursor_assigned_at,
+                    and_(Task.assigned_at == cursor_assigned_at, Task.task_id < cursor_task_id),
+                    Task.assigned_at.is_(None)
+                ))
+
+        # 多取一条判断还有没有下一页，ix_tasks_beacon_assigned 覆盖这个排序 (InnoDB 二级索引自带主键)
+        rows = query.order_by(Task.assigned_at.desc(), Task.task_id.desc()).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = f"{last.assigned_at.isoformat() if last.assigned_at else ''}~{last.task_id}"
+
+        return TaskHistoryPage(rows=rows, next_cursor=next_cursor)
+
+    @staticmethod
+    def _parse_history_cursor(cursor: str):
+        try:
+            assigned_at, task_id = cursor.split('~', 1)
+            return (datetime.fromisoformat(assigned_at) if assigned_at else None), int(task_id)
+        except ValueError:
+            raise ValueError(f"Invalid history cursor: {cursor[:64]}")
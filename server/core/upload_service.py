@@ -0,0 +1,219 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, NamedTuple
+
+from config import Config
+
+
+class UploadProgress(NamedTuple):
+    complete: bool
+    missing: List[int]    # 还没收到的分块序号，只列前几个
+    path: str             # 暂存文件路径，complete 之后交给 blob store
+    finalized: bool = False   # 已经有别的请求在落库或者已经落库了，这个分块只是重传
+
+
+class GrimoireUploadService:
+    """
+    分块上传服务层：把大结果的分块按偏移写进暂存文件，全部到齐后交给任务服务落库。
+    每个上传在暂存目录下有三个文件：
+        <result_id>.part  数据本身，按 chunk_index * chunk_size 写入，分块可以乱序、重复到达
+        <result_id>.map   每个分块一个字节，收到就置 1，服务重启后也能续传
+        <result_id>.json  上传的元数据 (task_id, beacon_id, total_size, chunk_size, 已收到的块数, 第一个缺的块)
+    全部到齐后 .json 改名成 .done，改名成功的那个请求负责落库；.done 留到过期清理，
+    最后一个 ack 丢了 Beacon 重传时还能认出这个上传已经完成。
+    内存里只放一个分块，峰值内存和文件大小无关；每个分块只读写一个字节的分块表，只有列缺失分块时才往后扫。
+    """
+    # result_id 会拼进文件名，只允许这些字符
+    RESULT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+    # ack 里最多列出多少个缺失的分块
+    MISSING_REPORT_LIMIT = 16
+    # 扫分块表时每次读多少字节
+    MAP_SCAN_BLOCK = 64 * 1024
+
+    def __init__(self, staging_dir=Config.UPLOAD_STAGING_DIR):
+        self.staging_dir = str(staging_dir)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        # 同一个上传的分块串行处理
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _path(self, result_id: str, suffix: str) -> str:
+        return os.path.join(self.staging_dir, f"{result_id}.{suffix}")
+
+    def _lock_for(self, result_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(result_id, threading.Lock())
+
+    def _load_meta(self, result_id: str, suffix: str = 'json') -> Dict | None:
+        try:
+            with open(self._path(result_id, suffix), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save_meta(self, result_id: str, meta: Dict):
+        # 先写临时文件再替换，写到一半崩溃也不会留下半个 JSON
+        tmp_path = self._path(result_id, 'json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path(result_id, 'json'))
+
+    def _scan_missing(self, fd: int, start: int, total_chunks: int) -> List[int]:
+        """
+        从 start 开始往后找还没收到的分块，找够 MISSING_REPORT_LIMIT 个就停。
+        """
+        missing = []
+        offset = start
+        while offset < total_chunks and len(missing) < self.MISSING_REPORT_LIMIT:
+            block = os.pread(fd, min(self.MAP_SCAN_BLOCK, total_chunks - offset), offset)
+            for i, flag in enumerate(block):
+                if not flag:
+                    missing.append(offset + i)
+                    if len(missing) >= self.MISSING_REPORT_LIMIT:
+                        break
+            offset += len(block)
+        return missing
+
+    def is_known(self, result_id: str) -> bool:
+        return self.RESULT_ID_PATTERN.match(result_id) is not None and os.path.exists(self._path(result_id, 'json'))
+
+    def is_completed(self, result_id: str, beacon_id: str, task_id: int) -> bool:
+        """
+        这个上传是不是已经传完 (正在落库或者已经落库)，用来给重传的最后一个分块回 ack。
+        """
+        if self.RESULT_ID_PATTERN.match(result_id) is None:
+            return False
+        meta = self._load_meta(result_id, 'done')
+        return meta is not None and (meta["beacon_id"], meta["task_id"]) == (beacon_id, task_id)
+
+    def claim_completion(self, result_id: str) -> bool:
+        """
+        全部到齐后由落库的请求调用，.json 改名成 .done。同时到达的多个最后分块只有一个能改名成功，只有它去落库。
+        """
+        with self._lock_for(result_id):
+            try:
+                os.rename(self._path(result_id, 'json'), self._path(result_id, 'done'))
+                return True
+            except FileNotFoundError:
+                return False
+
+    def release_completion(self, result_id: str):
+        """
+        落库的事务回滚了，改回未完成，Beacon 重传最后的分块时重新落库。
+        """
+        with self._lock_for(result_id):
+            try:
+                os.rename(self._path(result_id, 'done'), self._path(result_id, 'json'))
+            except FileNotFoundError:
+                pass
+
+    def receive_chunk(self, beacon_id: str, result_id: str, task_id: int,
+                      chunk_index: int, chunk_size: int, total_size: int, data: bytes) -> UploadProgress:
+        """
+        写入一个分块，返回当前进度。参数不合法时抛 ValueError。
+        """
+        if not self.RESULT_ID_PATTERN.match(result_id):
+            raise ValueError(f"Invalid result_id: {result_id[:16]}")
+        if not 0 < chunk_size <= Config.UPLOAD_MAX_CHUNK_SIZE:
+            raise ValueError(f"Chunk size {chunk_size} out of range")
+        if not 0 < total_size <= Config.UPLOAD_MAX_TOTAL_SIZE:
+            raise ValueError(f"Total size {total_size} out of range")
+        # 只有一块的上传不限分块大小，否则分块太小会让分块表和分块数一起膨胀
+        if chunk_size < Config.UPLOAD_MIN_CHUNK_SIZE and total_size > chunk_size:
+            raise ValueError(f"Chunk size {chunk_size} below minimum {Config.UPLOAD_MIN_CHUNK_SIZE}")
+
+        total_chunks = (total_size + chunk_size - 1) // chunk_size
+        if total_chunks > Config.UPLOAD_MAX_CHUNKS:
+            raise ValueError(f"Upload split into {total_chunks} chunks, maximum is {Config.UPLOAD_MAX_CHUNKS}")
+        if not 0 <= chunk_index < total_chunks:
+            raise ValueError(f"Chunk index {chunk_index} out of range")
+
+        expected_length = min(chunk_size, total_size - chunk_index * chunk_size)
+        if len(data) != expected_length:
+            raise ValueError(f"Chunk {chunk_index} has {len(data)} bytes, expected {expected_length}")
+
+        with self._lock_for(result_id):
+            if os.path.exists(self._path(result_id, 'done')):
+                # 已经传完了，这是重传的分块
+                return UploadProgress(complete=True, missing=[], path=self._path(result_id, 'part'), finalized=True)
+
+            meta = self._load_meta(result_id)
+            if meta is None:
+                # 第一个到达的分块，建暂存文件，数据文件和分块表都是稀疏文件，不会真的占满
+                meta = {
+                    "task_id": task_id,
+                    "beacon_id": beacon_id,
+                    "total_size": total_size,
+                    "chunk_size": chunk_size,
+                    "created_at": time.time(),
+                    "received": 0,
+                    "next_missing": 0,
+                }
+                with open(self._path(result_id, 'part'), 'wb') as f:
+                    f.truncate(total_size)
+                with open(self._path(result_id, 'map'), 'wb') as f:
+                    f.truncate(total_chunks)
+
+            elif (meta["task_id"], meta["beacon_id"], meta["total_size"], meta["chunk_size"]) != \
+                    (task_id, beacon_id, total_size, chunk_size):
+                raise ValueError(f"Chunk does not match upload {result_id[:16]}")
+
+            fd = os.open(self._path(result_id, 'part'), os.O_WRONLY)
+            try:
+                os.pwrite(fd, data, chunk_index * chunk_size)
+            finally:
+                os.close(fd)
+
+            fd = os.open(self._path(result_id, 'map'), os.O_RDWR)
+            try:
+                # 重复到达的分块不重复计数
+                if os.pread(fd, 1, chunk_index) != b'\x01':
+                    os.pwrite(fd, b'\x01', chunk_index)
+                    meta["received"] += 1
+
+                missing = []
+                if meta["received"] < total_chunks:
+                    # 第一个缺的块之前都已经收到了，从那里开始扫；顺序上传时几乎不用往后读
+                    missing = self._scan_missing(fd, meta["next_missing"], total_chunks)
+                    meta["next_missing"] = missing[0] if missing else total_chunks
+            finally:
+                os.close(fd)
+
+            self._save_meta(result_id, meta)
+
+        return UploadProgress(
+            complete=meta["received"] >= total_chunks,
+            missing=missing,
+            path=self._path(result_id, 'part'),
+        )
+
+    def discard(self, result_id: str, keep_marker: bool = False):
+        """
+        删除上传的暂存文件，落库成功或者过期后调用。keep_marker 时留下 .done，给丢了 ack 的重传用。
+        """
+        for suffix in ('part', 'map', 'json', 'json.tmp') + (() if keep_marker else ('done',)):
+            try:
+                os.remove(self._path(result_id, suffix))
+            except FileNotFoundError:
+                pass
+        with self._locks_guard:
+            self._locks.pop(result_id, None)
+
+    def cleanup_stale(self, max_age_seconds: int = Config.UPLOAD_STALE_SECONDS) -> int:
+        """
+        清理长时间没有新分块的上传，返回清理的数量。
+        """
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self.staging_dir):
+            result_id, _, suffix = name.rpartition('.')
+            # 进行中的上传看 .json (每个分块都会重写)，传完的看 .done 标记，修改时间就是最后活动时间
+            if suffix not in ('json', 'done'):
+                continue
+            if now - os.path.getmtime(os.path.join(self.staging_dir, name)) > max_age_seconds:
+                self.discard(result_id)
+                removed += 1
+        return removed
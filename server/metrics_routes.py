@@ -0,0 +1,87 @@
+import hmac
+import time
+
+from flask import Blueprint, Response, g, jsonify, request
+from sqlalchemy import func
+
+from config import Config
+from server.core.metrics import AI_QUEUE, BEACONS, LOG_QUEUE, PENDING_QUEUE, SESSIONS, TASKS, metrics, observe_request
+from server.core.structured_log import logging_stats
+from server.persistence.database import get_db_session
+from server.persistence.models import Beacon, Task
+from server.persistence.query_metrics import begin_scope, end_scope
+
+metrics_bp = Blueprint('metrics', __name__)
+
+TASK_STATUSES = ('PENDING', 'ASSIGNED', 'COMPLETED', 'FAILED')
+BEACON_STATUSES = ('Active', 'Stale')
+
+
+# Prometheus 抓取入口 (GET /metrics)
+# 配了 GRIMOIRE_METRICS_TOKEN 就要带 Authorization: Bearer <token>，没配只允许本机访问
+@metrics_bp.route('/metrics', methods=['GET'])
+def export_metrics():
+    if Config.METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied.encode('utf-8'), Config.METRICS_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'Unauthorized'}), 401
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'error': 'Forbidden'}), 403
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app):
+    """
+    给 Flask 挂上按路由统计请求数和延迟的钩子，并登记抓取时才计算的数量。
+    """
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        # 用路由模板而不是实际路径，/task/output/<int:task_id> 不会因为 ID 不同拆出无数条序列
+        g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g.query_scope = begin_scope('http', g.metrics_route)
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            observe_request(request.blueprint or 'app', g.metrics_route, request.method, response.status_code,
+                            time.perf_counter() - started)
+        token = g.pop('query_scope', None)
+        if token is not None:
+            stats = end_scope(token)
+            if stats is not None and Config.QUERY_STATS_HEADERS:
+                response.headers['X-DB-Queries'] = str(stats.count)
+                response.headers['X-DB-Time-Ms'] = f"{stats.seconds * 1000:.2f}"
+        return response
+
+    @app.teardown_request
+    def _close_query_scope(exc):
+        # after_request 没跑到 (处理异常时中途失败) 也要把统计范围关掉，免得线程复用时串到下一个请求
+        token = g.pop('query_scope', None)
+        if token is not None:
+            end_scope(token)
+
+    def collect_populations():
+        with get_db_session() as db:
+            task_counts = dict(db.query(Task.status, func.count(Task.task_id)).group_by(Task.status).all())
+            beacon_counts = dict(db.query(Beacon.status, func.count(Beacon.id)).group_by(Beacon.status).all())
+
+        # 没有记录的状态也导出 0，图表上不会断线
+        TASKS.replace({(status,): task_counts.get(status, 0) for status in set(TASK_STATUSES) | set(task_counts)})
+        BEACONS.replace({(status,): beacon_counts.get(status, 0)
+                         for status in set(BEACON_STATUSES) | set(beacon_counts)})
+
+        PENDING_QUEUE.set(len(app.config['TASK_SERVICE'].task_queue))
+        session_stats = app.config['CRYPTO_MANAGER'].sessions.stats()
+        SESSIONS.replace({("cached",): session_stats["cached_sessions"],
+                          ("persisted",): session_stats["persisted_sessions"]})
+        log_stats = logging_stats()
+        LOG_QUEUE.replace({("queued",): log_stats["queued"], ("dropped",): log_stats["dropped"]})
+        # debug 模式下重载器的父进程不加载 AI 服务
+        ai_service = app.config.get('AI_SERVICE')
+        if ai_service is not None:
+            AI_QUEUE.set(ai_service.route_batcher.queued(), ("route",))
+
+    metrics.set_collector('populations', collect_populations)
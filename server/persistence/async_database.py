@@ -0,0 +1,79 @@
+from contextlib import asynccontextmanager
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
+
+from config import Config
+from server.persistence.query_metrics import instrument_queries
+
+# 异步连接引擎，只给 ASGI 监听器用，表结构和迁移依旧由 database.init_db 负责
+AsyncConnectEngine: AsyncEngine | None = None
+# 异步会话工厂
+AsyncSessionManager = None
+
+# 同步驱动 -> 异步驱动
+ASYNC_DRIVERS = {
+    "mysql+pymysql://": "mysql+aiomysql://",
+    "mysql://": "mysql+aiomysql://",
+    "sqlite://": "sqlite+aiosqlite://",
+    "sqlite+pysqlite://": "sqlite+aiosqlite://",
+}
+
+
+def get_async_database_uri() -> str:
+    """
+    优先使用 Config.ASYNC_DATABASE_URI，没有配置就把 DATABASE_URI 的驱动换成异步驱动。
+    """
+    if Config.ASYNC_DATABASE_URI:
+        return Config.ASYNC_DATABASE_URI
+
+    for sync_prefix, async_prefix in ASYNC_DRIVERS.items():
+        if Config.DATABASE_URI.startswith(sync_prefix):
+            return async_prefix + Config.DATABASE_URI[len(sync_prefix):]
+
+    raise RuntimeError(f"No async driver known for {Config.DATABASE_URI}, set GRIMOIRE_ASYNC_DATABASE_URI.")
+
+
+def init_async_db():
+    global AsyncConnectEngine, AsyncSessionManager
+
+    uri = get_async_database_uri()
+    engine_options = {
+        "echo": False,  # SQL 回显统一由 init_logging 通过 sqlalchemy.engine logger 控制
+        "pool_pre_ping": Config.DB_POOL_PRE_PING,
+        "pool_recycle": Config.DB_POOL_RECYCLE,
+    }
+    if not uri.startswith("sqlite"):
+        engine_options.update({
+            "pool_size": Config.DB_POOL_SIZE,
+            "max_overflow": Config.DB_MAX_OVERFLOW,
+            "pool_timeout": Config.DB_POOL_TIMEOUT,
+        })
+
+    AsyncConnectEngine = create_async_engine(uri, **engine_options)
+    instrument_queries(AsyncConnectEngine.sync_engine)
+    # 提交后不让对象过期，避免提交后访问属性又去查一次库
+    AsyncSessionManager = async_sessionmaker(AsyncConnectEngine, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def get_async_db_session():
+    """
+    异步版本的 get_db_session，正常退出提交，异常回滚。
+    """
+    if AsyncSessionManager is None:
+        raise RuntimeError("Async database not initialized. Call init_async_db() first.")
+
+    db = AsyncSessionManager()
+    try:
+        yield db
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise e
+    finally:
+        await db.close()
+
+
+async def shutdown_async_db():
+    if AsyncConnectEngine is not None:
+        await AsyncConnectEngine.dispose()
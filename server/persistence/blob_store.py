@@ -0,0 +1,140 @@
+"""
+任务回显的内容寻址存储
+回显正文按 SHA256 存到本地磁盘，相同内容只存一份，task_outputs 表里只留元数据。
+
+文件格式 (所有整数小端)：
+    chunk_0 | chunk_1 | ... | chunk_n-1 | index | footer
+    index:  n 个 (offset u64, stored_len u32, compressed u8)
+    footer: magic "GBLB" | chunk_size u32 | raw_size u64 | n_chunks u32
+
+按固定大小分块压缩，读取时用 mmap 只解压范围覆盖到的块，所以可以流式读取或随机读取一段。
+已经压缩过的数据 (截图、zip 等) 压不动的块直接原样存。
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from config import Config
+
+MAGIC = b"GBLB"
+FOOTER = struct.Struct("<4sIQI")
+INDEX_ENTRY = struct.Struct("<QIB")
+
+
+class BlobInfo(NamedTuple):
+    hash: str
+    size: int
+
+
+class GrimoireBlobStore:
+    def __init__(self, root=Config.BLOB_STORE_DIR,
+                 chunk_size: int = Config.BLOB_CHUNK_SIZE,
+                 compress_level: int = Config.BLOB_COMPRESS_LEVEL):
+        self.root = str(root)
+        self.chunk_size = chunk_size
+        self.compress_level = compress_level
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, blob_hash: str) -> str:
+        return os.path.join(self.root, blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def exists(self, blob_hash: str) -> bool:
+        return os.path.exists(self._path(blob_hash))
+
+    def put(self, data: bytes) -> BlobInfo:
+        view = memoryview(data)
+        return self.put_stream(view[i:i + self.chunk_size] for i in range(0, len(view), self.chunk_size))
+
+    def put_file(self, path: str) -> BlobInfo:
+        """
+        按块读取一个本地文件写入，用于分块上传完成后的落库。
+        """
+        with open(path, "rb") as f:
+            return self.put_stream(iter(lambda: f.read(self.chunk_size), b""))
+
+    def put_stream(self, pieces: Iterable[bytes]) -> BlobInfo:
+        """
+        边读边压缩写入临时文件，最后按哈希改名。内容已存在就丢掉临时文件 (去重)。
+        内存占用只跟 chunk_size 有关，跟数据总大小无关。
+        """
+        hasher = hashlib.sha256()
+        index = []
+        raw_size = 0
+        pending = bytearray()
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".incoming_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                def write_chunk(chunk):
+                    compressed = zlib.compress(chunk, self.compress_level)
+                    if len(compressed) < len(chunk):
+                        stored, flag = compressed, 1
+                    else:
+                        stored, flag = chunk, 0
+                    index.append((f.tell(), len(stored), flag))
+                    f.write(stored)
+
+                for piece in pieces:
+                    hasher.update(piece)
+                    raw_size += len(piece)
+                    # 刚好一整块的直接写，不经过缓冲区
+                    if not pending and len(piece) == self.chunk_size:
+                        write_chunk(piece)
+                        continue
+                    pending += piece
+                    while len(pending) >= self.chunk_size:
+                        write_chunk(bytes(pending[:self.chunk_size]))
+                        del pending[:self.chunk_size]
+
+                if pending:
+                    write_chunk(bytes(pending))
+
+                for entry in index:
+                    f.write(INDEX_ENTRY.pack(*entry))
+                f.write(FOOTER.pack(MAGIC, self.chunk_size, raw_size, len(index)))
+
+            blob_hash = hasher.hexdigest()
+            path = self._path(blob_hash)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            return BlobInfo(hash=blob_hash, size=raw_size)
+
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def iter_range(self, blob_hash: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        流式读取 [start, end) 这一段原始数据，每次最多产出一个块。
+        """
+        with open(self._path(blob_hash), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, chunk_size, raw_size, n_chunks = FOOTER.unpack_from(mm, len(mm) - FOOTER.size)
+                if magic != MAGIC:
+                    raise ValueError(f"Corrupted blob {blob_hash[:8]}")
+
+                end = raw_size if end is None else min(end, raw_size)
+                if start >= end:
+                    return
+
+                index_start = len(mm) - FOOTER.size - n_chunks * INDEX_ENTRY.size
+                for chunk_no in range(start // chunk_size, (end - 1) // chunk_size + 1):
+                    offset, stored_len, compressed = INDEX_ENTRY.unpack_from(
+                        mm, index_start + chunk_no * INDEX_ENTRY.size
+                    )
+                    stored = mm[offset:offset + stored_len]
+                    chunk = zlib.decompress(stored) if compressed else stored
+
+                    chunk_base = chunk_no * chunk_size
+                    yield chunk[max(start - chunk_base, 0):min(end - chunk_base, len(chunk))]
+
+    def read(self, blob_hash: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        return b"".join(self.iter_range(blob_hash, start, end))
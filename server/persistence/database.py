@@ -3,6 +3,9 @@ from sqlalchemy.orm import sessionmaker, scoped_session
 
 import config
 from server.persistence.models import Base, Operator
+from server.persistence.migrations import run_migrations
+from server.persistence.pool_metrics import InstrumentedQueuePool, instrument_engine, pool_metrics
+from server.persistence.query_metrics import instrument_queries
 from contextlib import contextmanager
 from config import Config
 
@@ -17,11 +20,27 @@ def init_db():
     global ConnectEngine, DatabaseSessionManager
 
     # 创建 SQLAlchemy 引擎
-    ConnectEngine = create_engine(
-        Config.DATABASE_URI,
-        # echo=True 打印所有执行的 SQL 语句，方便调试
-        echo=True
-    )
+    # 连接池参数都来自 Config，按 GRIMOIRE_ENV 取默认值
+    engine_options = {
+        # 不用 echo (它会在请求线程里同步写 stdout)，GRIMOIRE_DB_ECHO 打开时由 init_logging
+        # 把 sqlalchemy.engine 调到 INFO，SQL 语句走后台日志队列
+        "echo": False,
+        "pool_pre_ping": Config.DB_POOL_PRE_PING,
+        "pool_recycle": Config.DB_POOL_RECYCLE,
+    }
+    # SQLite 用不了 QueuePool 的这些参数，本地调试时跳过
+    if not Config.DATABASE_URI.startswith("sqlite"):
+        engine_options.update({
+            "poolclass": InstrumentedQueuePool,
+            "pool_size": Config.DB_POOL_SIZE,
+            "max_overflow": Config.DB_MAX_OVERFLOW,
+            "pool_timeout": Config.DB_POOL_TIMEOUT,
+        })
+
+    ConnectEngine = create_engine(Config.DATABASE_URI, **engine_options)
+    instrument_engine(ConnectEngine)
+    # 按请求 / 调度任务统计语句数和耗时
+    instrument_queries(ConnectEngine)
 
     # 测试连接并创建表
     try:
@@ -29,6 +48,9 @@ def init_db():
         # 创建所有表
         Base.metadata.create_all(bind=ConnectEngine)
         print("MySQL tables checked/created successfully.")
+        # 补齐老库上缺失的索引和字段
+        schema_version = run_migrations(ConnectEngine)
+        print(f"Database schema at version {schema_version}.")
     except Exception as e:
         print("ERROR: Could not connect to database or create tables!")
         print(f"Connection URI: {Config.DATABASE_URI}")
@@ -104,4 +126,11 @@ def shutdown_session(exception=None):
     在 Flask 请求结束后移除和清理会话。
     """
     if DatabaseSessionManager:
-        DatabaseSessionManager.remove()
\ No newline at end of file
+        DatabaseSessionManager.remove()
+
+
+def get_pool_stats() -> dict:
+    """
+    返回连接池的监控数据，包括等待时间、占满次数和每条连接的使用情况。
+    """
+    return pool_metrics.snapshot(ConnectEngine)
@@ -0,0 +1,180 @@
+"""
+Grimoire 数据库结构迁移
+create_all 只会建新表，不会改已经存在的表，老库上的索引和新字段都靠这里补。
+新增迁移时往 MIGRATIONS 末尾追加一项，版本号递增，迁移函数必须可以重复执行。
+"""
+import base64
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn
+
+from config import Config
+from server.persistence.blob_store import GrimoireBlobStore
+from server.persistence.models import Base, SchemaVersion, Task, TaskOutput
+
+
+def _create_index_if_missing(conn: Connection, table_name: str, index_name: str):
+    """
+    按 models.py 里声明的 Index 创建索引，已经存在就跳过。
+    """
+    existing = {ix['name'] for ix in inspect(conn).get_indexes(table_name)}
+    if index_name in existing:
+        return
+
+    table = Base.metadata.tables[table_name]
+    index = next(ix for ix in table.indexes if ix.name == index_name)
+    index.create(bind=conn)
+    print(f"MIGRATION: Created index {index_name} on {table_name}.")
+
+
+def _v1_hot_path_indexes(conn: Connection):
+    # 心跳取任务、历史记录、僵尸清理三条热路径的复合索引
+    _create_index_if_missing(conn, 'tasks', 'ix_tasks_beacon_status_created')
+    _create_index_if_missing(conn, 'tasks', 'ix_tasks_beacon_assigned')
+    _create_index_if_missing(conn, 'beacons', 'ix_beacons_status_last_checkin')
+
+
+def _add_column_if_missing(conn: Connection, table_name: str, column_name: str):
+    """
+    按 models.py 里的列定义 ALTER TABLE ADD COLUMN，已经存在就跳过。
+    """
+    existing = {col['name'] for col in inspect(conn).get_columns(table_name)}
+    if column_name in existing:
+        return
+
+    column = Base.metadata.tables[table_name].c[column_name]
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+    print(f"MIGRATION: Added column {table_name}.{column_name}.")
+
+
+def _v2_output_blob_store(conn: Connection):
+    # 回显正文搬出 LONGTEXT，task_outputs 只留元数据
+    for column_name in ('output_hash', 'output_size', 'output_encoding'):
+        _add_column_if_missing(conn, 'task_outputs', column_name)
+    _create_index_if_missing(conn, 'task_outputs', 'ix_task_outputs_output_hash')
+
+    # 老字段改成可空，SQLite 不支持修改列，而且 SQLite 库都是 create_all 新建的，不用改
+    if conn.dialect.name == 'mysql':
+        conn.execute(text("ALTER TABLE task_outputs MODIFY output_data LONGTEXT NULL"))
+
+    # 把老数据逐条搬进 blob store，每次只把一条回显读进内存
+    blob_store = GrimoireBlobStore()
+    table = TaskOutput.__table__
+    legacy_ids = [row[0] for row in conn.execute(
+        table.select().with_only_columns(table.c.task_id)
+        .where(table.c.output_hash.is_(None), table.c.output_data.isnot(None))
+    )]
+    for task_id in legacy_ids:
+        output_b64 = conn.execute(
+            table.select().with_only_columns(table.c.output_data).where(table.c.task_id == task_id)
+        ).scalar_one()
+        info = blob_store.put(base64.b64decode(output_b64))
+        conn.execute(table.update().where(table.c.task_id == task_id).values(
+            output_hash=info.hash, output_size=info.size, output_encoding='legacy', output_data=None
+        ))
+
+    if legacy_ids:
+        print(f"MIGRATION: Moved {len(legacy_ids)} task output(s) into the blob store.")
+
+
+def _v3_output_preview(conn: Connection):
+    # 历史记录分页只查预览列，老回显从 blob store 读开头一段补上预览
+    _add_column_if_missing(conn, 'task_outputs', 'output_preview')
+
+    blob_store = GrimoireBlobStore()
+    outputs, tasks = TaskOutput.__table__, Task.__table__
+    head_bytes = Config.OUTPUT_PREVIEW_CHARS * 4
+    rows = conn.execute(
+        outputs.select()
+        .with_only_columns(outputs.c.task_id, outputs.c.output_hash, outputs.c.output_size, tasks.c.command)
+        .join_from(outputs, tasks, outputs.c.task_id == tasks.c.task_id)
+        .where(outputs.c.output_preview.is_(None), outputs.c.output_hash.isnot(None))
+    ).all()
+    for task_id, output_hash, output_size, command in rows:
+        if not blob_store.exists(output_hash):
+            continue
+        preview = TaskOutput.build_preview(
+            command, blob_store.read(output_hash, 0, head_bytes), output_size or 0, Config.OUTPUT_PREVIEW_CHARS
+        )
+        conn.execute(outputs.update().where(outputs.c.task_id == task_id).values(output_preview=preview))
+
+    if rows:
+        print(f"MIGRATION: Built previews for {len(rows)} task output(s).")
+
+
+def _v4_beacon_updated_at(conn: Connection):
+    # Beacon 列表的增量拉取和 ETag，老记录用最后签入时间当作更新时间
+    _add_column_if_missing(conn, 'beacons', 'updated_at')
+    _create_index_if_missing(conn, 'beacons', 'ix_beacons_updated_at')
+    conn.execute(text(
+        "UPDATE beacons SET updated_at = COALESCE(last_checkin, first_seen) WHERE updated_at IS NULL"
+    ))
+
+
+def _v5_task_batch_id(conn: Connection):
+    # 批量下发的任务按批次号查询汇总进度
+    _add_column_if_missing(conn, 'tasks', 'batch_id')
+    _create_index_if_missing(conn, 'tasks', 'ix_tasks_batch_id')
+
+
+def _v6_beacon_updated_at_microseconds(conn: Connection):
+    # updated_at 改成微秒精度，同一秒里的变化也能刷新 ETag 和增量游标
+    # SQLite 本来就按字符串存微秒，只有 MySQL 要改列
+    if conn.dialect.name == 'mysql':
+        column = Base.metadata.tables['beacons'].c['updated_at']
+        ddl = CreateColumn(column).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE beacons MODIFY {ddl}"))
+
+
+# (版本号, 描述, 迁移函数)，按版本号升序排列
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "composite indexes for heartbeat, history and stale sweep", _v1_hot_path_indexes),
+    (2, "move task output bodies into the blob store", _v2_output_blob_store),
+    (3, "precomputed output previews for task history", _v3_output_preview),
+    (4, "beacon updated_at for delta polling", _v4_beacon_updated_at),
+    (5, "task batch_id for bulk creation", _v5_task_batch_id),
+    (6, "microsecond beacon updated_at", _v6_beacon_updated_at_microseconds),
+]
+
+
+def get_schema_version(conn: Connection) -> int:
+    """
+    返回当前数据库已经执行到的迁移版本，没有记录时为 0。
+    """
+    row = conn.execute(
+        SchemaVersion.__table__.select()
+        .with_only_columns(SchemaVersion.version)
+        .order_by(SchemaVersion.version.desc())
+        .limit(1)
+    ).first()
+    return row[0] if row else 0
+
+
+def run_migrations(engine: Engine) -> int:
+    """
+    执行所有还没执行过的迁移，每个迁移单独一个事务，返回执行后的版本号。
+    """
+    SchemaVersion.__table__.create(bind=engine, checkfirst=True)
+
+    with engine.connect() as conn:
+        current = get_schema_version(conn)
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+
+        with engine.begin() as conn:
+            print(f"MIGRATION: Applying v{version} - {description}")
+            migrate(conn)
+            conn.execute(SchemaVersion.__table__.insert().values(
+                version=version,
+                description=description,
+                applied_at=datetime.utcnow()
+            ))
+        current = version
+
+    return current
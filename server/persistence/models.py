@@ -1,7 +1,8 @@
+import base64
 from datetime import datetime
 
-from sqlalchemy.dialects.mysql import LONGTEXT
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey
+from sqlalchemy.dialects.mysql import DATETIME, LONGTEXT
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, Boolean, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from werkzeug.security import check_password_hash, generate_password_hash
@@ -31,10 +32,20 @@ class Beacon(Base):
     status = Column(String(50), default='Active', nullable=False)  # Active, Sleep, Dead三种状态
     first_seen = Column(DateTime, default=datetime.utcnow)
     last_checkin = Column(DateTime, default=datetime.utcnow)
+    # 任何字段变化 (包括签入时间的批量写回) 都会刷新，控制台按它做增量拉取和 ETag
+    # MySQL 的 DATETIME 默认只到秒，同一秒里的两次变化 MAX 不变，ETag 也不变，所以要精确到微秒
+    updated_at = Column(DateTime().with_variant(DATETIME(fsp=6), 'mysql'),
+                        default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
     tasks = relationship("Task", back_populates="beacon")
 
+    # 清理僵尸 Beacon 时按 (status, last_checkin) 扫描，控制台增量拉取按 updated_at 查
+    __table_args__ = (
+        Index('ix_beacons_status_last_checkin', 'status', 'last_checkin'),
+        Index('ix_beacons_updated_at', 'updated_at'),
+    )
+
     # 输出调试的模样
     def __repr__(self):
         return f"<Beacon(id='{self.id}', ip='{self.ip_address}', user='{self.username}')>"
@@ -63,10 +74,19 @@ class Task(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     assigned_at = Column(DateTime)
 
+    # 批量下发时同一批任务共用一个批次号，单个创建的任务为空
+    batch_id = Column(String(32), index=True)
+
     # 关系
     beacon = relationship("Beacon", back_populates="tasks")
     output = relationship("TaskOutput", back_populates="task", uselist=False)  # 任务和输出是一对一关系
 
+    # 心跳取任务按 (beacon_id, status, created_at) 查，历史记录按 (beacon_id, assigned_at) 排序
+    __table_args__ = (
+        Index('ix_tasks_beacon_status_created', 'beacon_id', 'status', 'created_at'),
+        Index('ix_tasks_beacon_assigned', 'beacon_id', 'assigned_at'),
+    )
+
     # 依旧是调试消息
     def __repr__(self):
         return f"<Task(id={self.task_id}, status='{self.status}', cmd='{self.command[:20]}')>"
@@ -82,8 +102,14 @@ class TaskOutput(Base):
     # 关联的任务
     task_id = Column(Integer, ForeignKey('tasks.task_id'), primary_key=True, nullable=False)
 
-    # 结果内容
-    output_data = Column(LONGTEXT,nullable=False)  # 原始回显数据
+    # 结果内容，正文存在 blob store 里 (见 blob_store.py)，这里只有元数据
+    output_hash = Column(String(64), index=True)   # 正文的 SHA256，也是 blob store 里的文件名
+    output_size = Column(BigInteger)               # 正文原始字节数
+    output_encoding = Column(String(16))           # utf-8: GBK 已转成 UTF-8; raw: 原样保存
+    output_preview = Column(String(255))           # 正文开头的预览，历史记录列表只查这一列，不碰正文
+
+    # 老版本直接存 Base64 的字段，迁移 v2 会把它搬进 blob store 后置空
+    output_data = Column(Text().with_variant(LONGTEXT, 'mysql'), nullable=True)
 
     # 时间戳
     received_at = Column(DateTime, default=datetime.utcnow)
@@ -91,9 +117,29 @@ class TaskOutput(Base):
     # 关系
     task = relationship("Task", back_populates="output")
 
+    # 这两种命令的回显是二进制，预览按 Base64 显示
+    BINARY_COMMANDS = ('screenshot', 'download')
+
+    @classmethod
+    def build_preview(cls, command: str, head: bytes, total_size: int, max_chars: int) -> str:
+        """
+        用正文开头的 head 字节生成预览，超出 max_chars 的部分用 ... 表示。
+        head 至少要有 max_chars * 4 字节 (或者就是全部正文)。
+        """
+        if command in cls.BINARY_COMMANDS:
+            # Base64 每 3 字节变 4 个字符
+            preview_bytes = max_chars // 4 * 3
+            preview = base64.b64encode(head[:preview_bytes]).decode('ascii')
+            truncated = total_size > preview_bytes
+        else:
+            text = head.decode('utf-8', errors='replace')
+            preview = text[:max_chars]
+            truncated = len(text) > max_chars or total_size > len(head)
+        return preview + "..." if truncated else preview
+
     # 依旧是调试消息
     def __repr__(self):
-        return f"<TaskOutput(task_id={self.task_id}, len={len(self.output_data)})>"
+        return f"<TaskOutput(task_id={self.task_id}, size={self.output_size}, hash='{(self.output_hash or '')[:8]}')>"
 
 
 class Operator(Base):
@@ -112,4 +158,19 @@ class Operator(Base):
         return check_password_hash(self.password_hash, password)
 
     def __repr__(self):
-        return f'<Operator {self.username}>'
\ No newline at end of file
+        return f'<Operator {self.username}>'
+
+
+class SchemaVersion(Base):
+    """
+    数据库结构版本记录
+    create_all 不会修改已存在的表，所以用这张表记录已经执行过的迁移。
+    """
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}: {self.description}>'
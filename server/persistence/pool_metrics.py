@@ -0,0 +1,126 @@
+"""
+数据库连接池的监控
+记录取连接的等待时间、连接池被占满的次数，以及每条连接被借出的次数和占用时长，
+用来按 Flask 工作线程数调整连接池大小，也能看出心跳是不是在排队等连接。
+"""
+import itertools
+import threading
+import time
+from typing import Dict, Any
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+
+class GrimoirePoolMetrics:
+    """
+    连接池统计数据，所有计数都是进程内累计值。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn_seq = itertools.count(1)
+
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.exhausted_events = 0   # 取连接时连接池已经满了，只能排队等
+        self.timeouts = 0           # 等到 pool_timeout 还没拿到连接
+
+        # {连接编号: {"checkouts": 借出次数, "held_seconds": 累计占用时长}}
+        self.connections: Dict[int, Dict[str, float]] = {}
+
+    def record_wait(self, seconds: float, exhausted: bool, timed_out: bool):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.checkout_wait_total += seconds
+            if seconds > self.checkout_wait_max:
+                self.checkout_wait_max = seconds
+            if exhausted:
+                self.exhausted_events += 1
+
+    def register_connection(self, connection_record):
+        conn_no = next(self._conn_seq)
+        connection_record.info['grimoire_conn_no'] = conn_no
+        with self._lock:
+            self.connections[conn_no] = {"checkouts": 0, "held_seconds": 0.0}
+
+    def forget_connection(self, connection_record):
+        conn_no = connection_record.info.pop('grimoire_conn_no', None)
+        with self._lock:
+            self.connections.pop(conn_no, None)
+
+    def on_checkout(self, connection_record):
+        connection_record.info['grimoire_checkout_at'] = time.perf_counter()
+
+    def on_checkin(self, connection_record):
+        checkout_at = connection_record.info.pop('grimoire_checkout_at', None)
+        conn_no = connection_record.info.get('grimoire_conn_no')
+        if checkout_at is None or conn_no is None:
+            return
+
+        held = time.perf_counter() - checkout_at
+        with self._lock:
+            usage = self.connections.get(conn_no)
+            if usage is not None:
+                usage["checkouts"] += 1
+                usage["held_seconds"] += held
+
+    def snapshot(self, engine: Engine = None) -> Dict[str, Any]:
+        """
+        返回当前统计数据的快照，传入 engine 时附带连接池的实时状态。
+        """
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            data = {
+                "checkouts": self.checkouts,
+                "checkout_wait_avg_ms": (self.checkout_wait_total / attempts * 1000) if attempts else 0.0,
+                "checkout_wait_max_ms": self.checkout_wait_max * 1000,
+                "exhausted_events": self.exhausted_events,
+                "timeouts": self.timeouts,
+                "connections": {conn_no: dict(usage) for conn_no, usage in self.connections.items()},
+            }
+
+        pool = engine.pool if engine is not None else None
+        if isinstance(pool, QueuePool):
+            data.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+            })
+        return data
+
+
+# 整个进程共用一份，engine.dispose() 重建连接池后统计也不会丢
+pool_metrics = GrimoirePoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    在 QueuePool 取连接的地方计时，统计等待时间和连接池占满的次数。
+    """
+    def _do_get(self):
+        exhausted = self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start, exhausted, timed_out)
+
+
+def instrument_engine(engine: Engine):
+    """
+    给 engine 的连接池挂上连接级别的事件，统计每条连接的使用情况。
+    """
+    event.listen(engine, 'connect', lambda dbapi_conn, record: pool_metrics.register_connection(record))
+    event.listen(engine, 'close', lambda dbapi_conn, record: pool_metrics.forget_connection(record))
+    event.listen(engine, 'checkout', lambda dbapi_conn, record, proxy: pool_metrics.on_checkout(record))
+    event.listen(engine, 'checkin', lambda dbapi_conn, record: pool_metrics.on_checkin(record))
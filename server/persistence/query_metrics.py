@@ -0,0 +1,147 @@
+"""
+按请求和调度任务统计 SQL 语句数和数据库耗时。
+统计范围用 contextvars 标记，Flask 的工作线程、ASGI 监听器的协程 (run_sync 也会带上) 和调度器线程都适用；
+不在任何统计范围里的语句 (启动迁移之类) 不计数，连计时都不做。
+
+每个范围结束时：
+    1. 语句数和耗时记进 /metrics 的直方图。
+    2. 超过查询预算 (Config.QUERY_BUDGET / QUERY_BUDGETS) 的记一条 warning 并计数。
+    3. 同一条语句执行次数达到 Config.QUERY_REPEAT_THRESHOLD 的当作疑似 N+1，一起记下来。
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import Config
+from server.core.metrics import DB_QUERIES, DB_QUERY_SECONDS, N_PLUS_ONE_SUSPECTS, QUERY_BUDGET_EXCEEDED
+
+log = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """
+    一个统计范围 (一次请求或一次调度任务) 里的 SQL 统计。
+    """
+    __slots__ = ('kind', 'name', 'count', 'seconds', 'statements')
+
+    def __init__(self, kind: str, name: str):
+        self.kind = kind        # http / job
+        self.name = name        # 路由模板或调度任务名
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()   # {语句文本: 执行次数}，参数不同的同一条语句算一种
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= threshold]
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar('grimoire_query_stats', default=None)
+
+
+def _parse_budgets(spec: str) -> Dict[str, int]:
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, budget = item.rpartition('=')
+        budgets[name.strip()] = int(budget)
+    return budgets
+
+
+_budgets = _parse_budgets(Config.QUERY_BUDGETS)
+
+
+def query_budget(stats: QueryStats) -> Optional[int]:
+    """
+    单独配置过的按配置来；没配置的 HTTP 路由用默认预算，调度任务默认不设预算 (批量任务语句数随数据量变)。
+    """
+    if stats.name in _budgets:
+        return _budgets[stats.name]
+    return Config.QUERY_BUDGET if stats.kind == 'http' else None
+
+
+def begin_scope(kind: str, name: str) -> Token:
+    return _current_stats.set(QueryStats(kind, name))
+
+
+def end_scope(token: Token) -> Optional[QueryStats]:
+    """
+    结束统计范围，记指标、检查预算，返回这个范围的统计。
+    """
+    stats = _current_stats.get()
+    _current_stats.reset(token)
+    if stats is None:
+        return None
+
+    labels = (stats.kind, stats.name)
+    DB_QUERIES.observe(stats.count, labels)
+    DB_QUERY_SECONDS.observe(stats.seconds, labels)
+
+    budget = query_budget(stats)
+    repeated = stats.repeated(Config.QUERY_REPEAT_THRESHOLD)
+    if repeated:
+        N_PLUS_ONE_SUSPECTS.inc(1, labels)
+    if budget is not None and stats.count > budget:
+        QUERY_BUDGET_EXCEEDED.inc(1, labels)
+        log.warning("%s %s ran %d queries (budget %d, %.1f ms in DB)",
+                    stats.kind, stats.name, stats.count, budget, stats.seconds * 1000,
+                    extra={"kind": stats.kind, "scope": stats.name, "queries": stats.count, "budget": budget,
+                           "repeated": [{"statement": s[:200], "count": n} for s, n in repeated]})
+    elif repeated:
+        log.warning("%s %s repeated a statement %d times, possible N+1",
+                    stats.kind, stats.name, repeated[0][1],
+                    extra={"kind": stats.kind, "scope": stats.name, "queries": stats.count,
+                           "repeated": [{"statement": s[:200], "count": n} for s, n in repeated]})
+    return stats
+
+
+@contextmanager
+def query_scope(kind: str, name: str):
+    token = begin_scope(kind, name)
+    try:
+        yield _current_stats.get()
+    finally:
+        end_scope(token)
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_stats.get() is not None:
+        conn.info.setdefault('grimoire_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    started = conn.info.get('grimoire_query_started')
+    if stats is None or not started:
+        return
+    stats.record(statement, time.perf_counter() - started.pop())
+
+
+def _handle_error(exception_context):
+    # 执行失败不会触发 after_cursor_execute，把开始时间弹掉，免得下一条语句拿错
+    conn = exception_context.connection
+    started = conn.info.get('grimoire_query_started') if conn is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_queries(engine: Engine):
+    """
+    给 engine 挂上语句计时的事件，异步引擎传 engine.sync_engine。
+    """
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
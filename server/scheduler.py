@@ -1,16 +1,36 @@
-import os
-import shutil
+import logging
+import time
+from functools import wraps
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from config import Config
+from server.core.metrics import SCHEDULER_JOB_DURATION
 from server.persistence.database import get_db_session  # 调度器需要 db session
-import time
+from server.persistence.query_metrics import query_scope
+
+log = logging.getLogger(__name__)
+
 
+def timed_job(job):
+    """
+    记录每次任务的执行时长和 SQL 统计，按函数名区分。
+    """
+    @wraps(job)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with query_scope('job', job.__name__):
+                return job(*args, **kwargs)
+        finally:
+            SCHEDULER_JOB_DURATION.observe(time.perf_counter() - started, (job.__name__,))
+    return wrapper
+
+
+@timed_job
 def cleanup_job(app):
     """
     实际执行清理 Beacon 的任务。
     """
-    print("--- SCHEDULER: Starting stale beacon cleanup job ---")
     try:
         beacon_service = app.config['BEACON_SERVICE']
         # 调度器在后台运行，必须自己获取和管理数据库会话
@@ -18,45 +38,71 @@ def cleanup_job(app):
             # 调用 beacon_service 中实现的清理逻辑
             # cleanup_stale_beacons 会根据 config 中的阈值更新状态
             beacon_service.cleanup_stale_beacons(db)
-        print("--- SCHEDULER: Stale beacon cleanup job finished ---")
 
     except Exception as e:
         # 确保调度器任务失败时，数据库连接能正确释放
-        print(f"!!! SCHEDULER ERROR: Failed to run cleanup job: {e}")
+        log.exception("Failed to run cleanup job: %s", e)
 
 
-def clean_tmp(app):
+@timed_job
+def flush_checkins_job(app):
     """
-    执行清理任务：只清理过期的临时构建目录
+    把 Beacon 签入时间的写回缓存批量落库。
     """
     try:
-        # 找到 tmp 根目录
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        tmp_dir = os.path.join(base_dir, "tmp")
+        beacon_service = app.config['BEACON_SERVICE']
+        with get_db_session() as db:
+            beacon_service.flush_checkin_times(db)
 
-        if not os.path.exists(tmp_dir):
-            return
+    except Exception as e:
+        log.exception("Failed to flush check-in times: %s", e)
 
-        now = time.time()
-        expiration_seconds = 600  # 10分钟前的文件统统删除
 
-        # 遍历 tmp 下的所有子目录
-        for item in os.listdir(tmp_dir):
-            item_path = os.path.join(tmp_dir, item)
+@timed_job
+def evict_idle_sessions_job(app):
+    """
+    把空闲太久的会话从内存里淘汰，落盘的会话需要时会懒加载回来。
+    """
+    try:
+        crypto_mgr = app.config['CRYPTO_MANAGER']
+        evicted = crypto_mgr.sessions.evict_idle()
+        if evicted:
+            log.info("Evicted %d idle session(s) from memory.", evicted, extra={"count": evicted})
+
+    except Exception as e:
+        log.exception("Failed to evict idle sessions: %s", e)
 
-            # 只针对 build_ 开头的文件夹进行逻辑判断
-            if os.path.isdir(item_path) and item.startswith("build_"):
-                # 获取文件夹的最后修改时间
-                mtime = os.path.getmtime(item_path)
 
-                if (now - mtime) > expiration_seconds:
-                    shutil.rmtree(item_path, ignore_errors=True)
-                    print(f"[CLEANUP] 成功超度了过期的文件夹: {item}")
-                else:
-                    print(f"[CLEANUP] 文件夹 {item} 还很年轻，留它一条生路。")
+@timed_job
+def cleanup_uploads_job(app):
+    """
+    清理长时间没有新分块的上传暂存文件。
+    """
+    try:
+        upload_service = app.config['TASK_SERVICE'].upload_service
+        removed = upload_service.cleanup_stale()
+        if removed:
+            log.info("Discarded %d stale chunked upload(s).", removed, extra={"count": removed})
 
     except Exception as e:
-        print(f"!!! SCHEDULER ERROR: Cleanup failed: {e}")
+        log.exception("Failed to clean chunked uploads: %s", e)
+
+
+@timed_job
+def clean_tmp(app):
+    """
+    执行清理任务：按登记表清理过期的构建产物和构建任务记录，不再遍历目录
+    """
+    try:
+        build_queue = app.config['BUILD_QUEUE']
+        artifacts = build_queue.build_service.expire_artifacts()
+        jobs = build_queue.expire_jobs()
+        if artifacts or jobs:
+            log.info("[CLEANUP] 成功超度了 %d 个过期产物和 %d 条构建记录", artifacts, jobs,
+                     extra={"artifacts": artifacts, "jobs": jobs})
+
+    except Exception as e:
+        log.exception("Cleanup failed: %s", e)
 
 def start_scheduler(app):
     """
@@ -66,18 +112,53 @@ def start_scheduler(app):
     if not hasattr(app, 'scheduler'):
         scheduler = BackgroundScheduler()
 
-        # 注册任务：定时清理
+        # 注册任务：定时清理，间隔可以小于一分钟
         scheduler.add_job(
             cleanup_job,
             'interval',
-            minutes=Config.CLEANUP_INTERVAL_MINUTES,
+            seconds=Config.STALE_SWEEP_INTERVAL_SECONDS,
             id='cleanup_stale_beacons_job',
             name='Stale Beacon Cleanup',
             max_instances=1,
+            coalesce=True,
+            args=[app]
+        )
+
+        # 注册任务: 批量写回签入时间
+        scheduler.add_job(
+            flush_checkins_job,
+            'interval',
+            seconds=Config.CHECKIN_MAX_STALENESS_SECONDS,
+            id='flush_checkins_job',
+            name='Check-in Write-behind Flush',
+            max_instances=1,
+            coalesce=True,
+            args=[app]
+        )
+
+        # 注册任务: 淘汰内存里的空闲会话
+        scheduler.add_job(
+            evict_idle_sessions_job,
+            'interval',
+            minutes=Config.CLEANUP_INTERVAL_MINUTES,
+            id='evict_idle_sessions_job',
+            name='Idle Session Eviction',
+            max_instances=1,
+            args=[app]
+        )
+
+        # 注册任务: 清理过期的分块上传
+        scheduler.add_job(
+            cleanup_uploads_job,
+            'interval',
+            minutes=Config.CLEANUP_INTERVAL_MINUTES,
+            id='cleanup_uploads_job',
+            name='Stale Upload Cleanup',
+            max_instances=1,
             args=[app]
         )
 
-        # 注册任务: 删除tmp文件夹
+        # 注册任务: 清理过期的构建产物
         scheduler.add_job(
             clean_tmp,
             'interval',
@@ -90,8 +171,15 @@ def start_scheduler(app):
 
         scheduler.start()
         app.scheduler = scheduler
-        print(f"*** Scheduler started. Cleanup job runs every {Config.CLEANUP_INTERVAL_MINUTES} minutes. ***")
+        log.info("Scheduler started. Stale sweep runs every %g seconds, cleanup jobs every %d minutes.",
+                 Config.STALE_SWEEP_INTERVAL_SECONDS, Config.CLEANUP_INTERVAL_MINUTES)
 
-        # 在程序退出时关闭调度器
+        # 在程序退出时关闭调度器，再把最后一批签入时间写回数据库
         import atexit
-        atexit.register(lambda: scheduler.shutdown())
\ No newline at end of file
+
+        def shutdown_scheduler():
+            if scheduler.running:
+                scheduler.shutdown()
+            flush_checkins_job(app)
+
+        atexit.register(shutdown_scheduler)
\ No newline at end of file
@@ -1,25 +1,55 @@
 import hashlib
 import os
-from base64 import b64encode, b64decode
 from typing import Tuple
 from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from config import Config
+from shared.Framing import parse_frame, build_frame
+from shared.SessionStore import GrimoireSessionStore
 
 # 这里为了安全掩蔽，我采用 ECDH（X25519） 一次性密钥交换策略
 class GrimoireCryptoManager:
-    def __init__(self):
-        # 存储所有的AESGCM {beacon_id: AESGCM实例}
-        self.sessions = {}
-
-        # 生成自己的临时密钥对
-        self.private = x25519.X25519PrivateKey.generate()
+    def __init__(self, key_path=Config.SERVER_KEY_PATH, store_path=Config.SESSION_STORE_PATH):
+        # 服务端密钥对，配置了 key_path 就从磁盘加载，重启后 Beacon 不用重新握手
+        self.private = self._load_or_generate_private(key_path)
         self.public = self.private.public_key()
 
+        # 存储所有的AESGCM {beacon_id: AESGCM实例}，有上限，落盘部分重启后懒加载
+        # 只有服务端私钥是持久的，落盘的会话才有意义
+        wrapping_secret = self.private.private_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PrivateFormat.Raw,
+            encryption_algorithm=serialization.NoEncryption()
+        ) if key_path else None
+        self.sessions = GrimoireSessionStore(store_path=store_path, wrapping_secret=wrapping_secret)
+
+    @staticmethod
+    def _load_or_generate_private(key_path) -> x25519.X25519PrivateKey:
+        if not key_path:
+            # 生成自己的临时密钥对
+            return x25519.X25519PrivateKey.generate()
+
+        if os.path.exists(key_path):
+            with open(key_path, 'rb') as f:
+                return x25519.X25519PrivateKey.from_private_bytes(f.read())
+
+        private = x25519.X25519PrivateKey.generate()
+        raw = private.private_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PrivateFormat.Raw,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(key_path)), exist_ok=True)
+        # 私钥只允许当前用户读写
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(raw)
+        print(f"INFO: Generated new server key at {key_path}")
+        return private
+
 
     # 返回公钥字节
     def get_publickey(self) -> bytes:
@@ -43,65 +73,44 @@ class GrimoireCryptoManager:
         ).derive(shared)
 
         aes_key = derived
-        beacon_id_bytes = hashlib.sha256(aes_key).hexdigest()
-        beacon_id = beacon_id_bytes
+        # SF 就是 AES 密钥的 SHA256，会话按这 32 字节原样查找，beacon_id 是它的 Hex
+        session_fingerprint = hashlib.sha256(aes_key).digest()
+        beacon_id = session_fingerprint.hex()
 
-        self.sessions[beacon_id] = AESGCM(aes_key)
+        self.sessions.put(session_fingerprint, aes_key)
 
         return  beacon_id
 
-    # 下面就是熟悉的 AES-GCM 了
+    # 下面就是熟悉的 AES-GCM 了，组帧和拆帧见 shared/Framing.py
     # 加密方法
     def grimoire_encrypt(self, beacon_id: str, data: bytes) -> str:
         """
         输出结构: Base64( IV || Ciphertext || GCM Tag || SF )
         """
-        aesgcm = self.sessions.get(beacon_id)
-        if not aesgcm:
-            raise ValueError(f"No session found: {beacon_id[:8]}")
-
-        iv = os.urandom(Config.IV_LENGTH)
-
-        # ct_and_tag 包含了 Ciphertext 和 GCM Tag,为了证明
-        ct_and_tag = aesgcm.encrypt(iv, data, None)
-
         # 获取 SF 原始字节
         session_fingerprint_bytes = bytes.fromhex(beacon_id)
 
-        # 组合最终负载: IV || CT || Tag || SF
-        full_payload = iv + ct_and_tag + session_fingerprint_bytes
+        aesgcm = self.sessions.get(session_fingerprint_bytes)
+        if not aesgcm:
+            raise ValueError(f"No session found: {beacon_id[:8]}")
 
-        return b64encode(full_payload).decode('utf-8')
+        return build_frame(aesgcm, session_fingerprint_bytes, data)
 
     # 解密方法
     def grimoire_decrypt(self, payload: str) -> Tuple[bytes, str]:
         """
         Base64 解码，剥离 SF，查找密钥，解密并验证负载。
+        IV、CT||Tag、SF 都是同一块内存上的 memoryview，不复制负载。
         """
-        try:
-            raw_payload = b64decode(payload)
-        except Exception:
-            raise ValueError("Invalid Base64 payload received.")
-
-        # 剥离 SF
-        if len(raw_payload) < Config.IV_LENGTH + Config.SF_LENGTH:
-            raise ValueError("Payload too short")
-
-        session_fingerprint_bytes = raw_payload[-Config.SF_LENGTH:]
-        # 这里现在只剩 IV + CT||Tag
-        encrypted_data = raw_payload[:-Config.SF_LENGTH]
+        iv, ciphertext_and_tag, session_fingerprint = parse_frame(payload)
 
-        # 查找密钥
-        beacon_id = session_fingerprint_bytes.hex()
-        aesgcm = self.sessions.get(beacon_id)
+        # 查找密钥，SF 只有 32 字节，拷一份当字典键
+        session_fingerprint_bytes = session_fingerprint.tobytes()
+        aesgcm = self.sessions.get(session_fingerprint_bytes)
         if not aesgcm:
-            raise ValueError(f"No active session found: {beacon_id[:8]}")
-
-        # 剥离 IV
-        iv = encrypted_data[:Config.IV_LENGTH]
+            raise ValueError(f"No active session found: {session_fingerprint_bytes.hex()[:8]}")
 
-        # 剩余部分正是 CT || Tag
-        ciphertext_and_tag = encrypted_data[Config.IV_LENGTH:]
+        beacon_id = session_fingerprint_bytes.hex()
 
         # 解密
         try:
@@ -110,4 +119,3 @@ class GrimoireCryptoManager:
         except InvalidTag:
             # 重新抛出，让上层捕获
             raise InvalidTag(f"GCM authentication failed: {beacon_id[:8]}.")
-
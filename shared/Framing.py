@@ -0,0 +1,53 @@
+import os
+from binascii import a2b_base64, b2a_base64, Error as Base64Error
+from typing import Tuple
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from config import Config
+
+# 通信帧格式: IV || CT || TAG || SF
+# 解析时只做一次 Base64 解码，后面的切分都用 memoryview，不再复制负载；
+# 组帧时先按总长度分配一块缓冲区，密文直接写进去，再整体 Base64 编码。
+TAG_LENGTH = 16
+MIN_FRAME_LENGTH = Config.IV_LENGTH + TAG_LENGTH + Config.SF_LENGTH
+
+# cryptography 新版本才有 encrypt_into，老版本退回到 encrypt 再拷贝一次
+_HAS_ENCRYPT_INTO = hasattr(AESGCM, "encrypt_into")
+
+
+def parse_frame(payload) -> Tuple[memoryview, memoryview, memoryview]:
+    """
+    解析 Base64 帧，返回 (IV, CT||TAG, SF) 三个指向同一块内存的 memoryview。
+    """
+    try:
+        raw = a2b_base64(payload)
+    except (Base64Error, ValueError):
+        raise ValueError("Invalid Base64 payload received.")
+
+    if len(raw) < MIN_FRAME_LENGTH:
+        raise ValueError("Payload too short")
+
+    view = memoryview(raw)
+    return (
+        view[:Config.IV_LENGTH],
+        view[Config.IV_LENGTH:-Config.SF_LENGTH],
+        view[-Config.SF_LENGTH:],
+    )
+
+
+def build_frame(aesgcm: AESGCM, session_fingerprint: bytes, data) -> str:
+    """
+    加密 data 并组帧，返回 Base64 字符串。
+    """
+    iv = os.urandom(Config.IV_LENGTH)
+
+    buf = bytearray(Config.IV_LENGTH + len(data) + TAG_LENGTH + Config.SF_LENGTH)
+    view = memoryview(buf)
+    view[:Config.IV_LENGTH] = iv
+    if _HAS_ENCRYPT_INTO:
+        aesgcm.encrypt_into(iv, data, None, view[Config.IV_LENGTH:-Config.SF_LENGTH])
+    else:
+        view[Config.IV_LENGTH:-Config.SF_LENGTH] = aesgcm.encrypt(iv, data, None)
+    view[-Config.SF_LENGTH:] = session_fingerprint
+
+    return b2a_base64(view, newline=False).decode('ascii')
@@ -0,0 +1,175 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from config import Config
+
+log = logging.getLogger(__name__)
+
+
+# 会话存储：内存里是有上限的 LRU，落盘部分用 SQLite 文件保存加密后的 AES 会话密钥
+class GrimoireSessionStore:
+    # 粗略估计每个会话在内存里的占用 (AESGCM 对象 + OrderedDict 节点 + 32 字节的 SF)
+    APPROX_BYTES_PER_SESSION = 400
+
+    def __init__(self, store_path=None, wrapping_secret: bytes = None,
+                 max_sessions: int = Config.SESSION_CACHE_MAX,
+                 idle_seconds: int = Config.SESSION_IDLE_SECONDS):
+        # {SF原始字节: [AESGCM实例, 最后使用时间]}，按最近使用排序
+        # 直接用 32 字节的 SF 当键，解密时不用再转 Hex
+        self._cache: "OrderedDict[bytes, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+
+        # 没有落盘路径或者没有稳定的服务端密钥时，只在内存里保存
+        self._db: Optional[sqlite3.Connection] = None
+        self._kek: Optional[AESGCM] = None
+        if store_path and wrapping_secret:
+            os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+            self._db = sqlite3.connect(str(store_path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "beacon_id TEXT PRIMARY KEY, wrapped_key BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+            # 落盘的会话密钥用服务端私钥派生出来的 KEK 加密
+            kek = HKDF(
+                algorithm=hashes.SHA256(),
+                length=Config.AES_KEY_LENGTH,
+                salt=None,
+                info=Config.HKDF_INFO + b"-session-store",
+            ).derive(wrapping_secret)
+            self._kek = AESGCM(kek)
+
+    @property
+    def persistent(self) -> bool:
+        return self._db is not None
+
+    def put(self, session_fingerprint: bytes, aes_key: bytes):
+        """
+        保存一个新派生的会话，同时写入落盘存储。
+        """
+        aesgcm = AESGCM(aes_key)
+        with self._lock:
+            self._cache[session_fingerprint] = [aesgcm, time.monotonic()]
+            self._cache.move_to_end(session_fingerprint)
+            self._evict_locked()
+
+            if self._db is not None:
+                # 落盘时还是用 Hex 形式的 beacon_id，方便和数据库里的 beacons 表对照
+                beacon_id = session_fingerprint.hex()
+                iv = os.urandom(Config.IV_LENGTH)
+                # beacon_id 作为附加数据，防止密文被挪到别的记录上
+                wrapped = iv + self._kek.encrypt(iv, aes_key, beacon_id.encode('utf-8'))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions (beacon_id, wrapped_key, created_at) VALUES (?, ?, ?)",
+                    (beacon_id, wrapped, time.time())
+                )
+                self._db.commit()
+
+    def get(self, session_fingerprint: bytes) -> Optional[AESGCM]:
+        """
+        按 32 字节的 SF 查找会话，内存里没有就从落盘存储懒加载回来。
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(session_fingerprint)
+            if entry is not None:
+                entry[1] = now
+                self._cache.move_to_end(session_fingerprint)
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            aesgcm = self._load_locked(session_fingerprint.hex())
+            if aesgcm is None:
+                return None
+
+            self.reloads += 1
+            self._cache[session_fingerprint] = [aesgcm, now]
+            self._evict_locked()
+            return aesgcm
+
+    def _load_locked(self, beacon_id: str) -> Optional[AESGCM]:
+        if self._db is None:
+            return None
+
+        row = self._db.execute("SELECT wrapped_key FROM sessions WHERE beacon_id = ?", (beacon_id,)).fetchone()
+        if row is None:
+            return None
+
+        wrapped = row[0]
+        try:
+            aes_key = self._kek.decrypt(wrapped[:Config.IV_LENGTH], wrapped[Config.IV_LENGTH:], beacon_id.encode('utf-8'))
+        except InvalidTag:
+            # 服务端密钥换过了，老会话解不开，只能让 Beacon 重新握手
+            log.warning("Stored session for %s cannot be unwrapped, dropping it.", beacon_id[:8],
+                        extra={"beacon_id": beacon_id})
+            self._db.execute("DELETE FROM sessions WHERE beacon_id = ?", (beacon_id,))
+            self._db.commit()
+            return None
+
+        return AESGCM(aes_key)
+
+    def _evict_locked(self):
+        # 先按容量淘汰最久没用的
+        while len(self._cache) > self.max_sessions:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+        # 再淘汰空闲太久的，OrderedDict 头部就是最久没用的，遇到没过期的就停
+        if self.idle_seconds:
+            deadline = time.monotonic() - self.idle_seconds
+            while self._cache:
+                oldest_id, (_, last_used) = next(iter(self._cache.items()))
+                if last_used >= deadline:
+                    break
+                del self._cache[oldest_id]
+                self.evictions += 1
+
+    def evict_idle(self) -> int:
+        """
+        主动淘汰空闲会话，返回淘汰的数量。落盘存储里的记录不受影响。
+        """
+        with self._lock:
+            before = self.evictions
+            self._evict_locked()
+            return self.evictions - before
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            cached = len(self._cache)
+            persisted = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] if self._db else 0
+            return {
+                "cached_sessions": cached,
+                "persisted_sessions": persisted,
+                "approx_memory_bytes": cached * self.APPROX_BYTES_PER_SESSION,
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._cache)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None